@@ -0,0 +1,494 @@
+/*
+ * Model phân loại chất lượng không khí cho ESP32 - SINH TỰ ĐỘNG bởi
+ * backend/export_model_c.py, không sửa tay.
+ * Nguồn: model_artifact.npy (model version 1, 2026-10-17T20:13:29.577640+00:00)
+ *
+ * Đầu vào: double x[CAQM_N_FEATURES] theo thứ tự co2 (ppm), co (ppm),
+ * pm25 (ug/m3), temperature (C), humidity (%) - giá trị gốc, không cần scale.
+ *   int q = caqm_predict_quality(x, &confidence);   // chỉ số trong CAQM_QUALITY_LABELS
+ *   caqm_predict_problems(x, flags);                // flags[i] = 1: cảm biến i có vấn đề
+ */
+#ifndef CAQM_MODEL_H
+#define CAQM_MODEL_H
+
+#include <stdint.h>
+
+#define CAQM_MODEL_VERSION 1
+#define CAQM_N_FEATURES 5
+#define CAQM_N_CLASSES 3
+#define CAQM_N_PROBLEMS 5
+#define CAQM_N_QUALITY_TREES 1
+
+#define CAQM_CLASS_KEM 0  /* Kém */
+#define CAQM_CLASS_TRUNG_BINH 1  /* Trung bình */
+#define CAQM_CLASS_TOT 2  /* Tốt */
+
+static const char *const CAQM_QUALITY_LABELS[CAQM_N_CLASSES] = {"K\xc3\xa9m", "Trung b\xc3\xacnh", "T\xe1\xbb\x91t"};
+static const char *const CAQM_PROBLEM_LABELS[CAQM_N_PROBLEMS] = {"CO2", "CO", "PM2.5", "Nhi\xe1\xbb\x87t \xc4\x91\xe1\xbb\x99", "\xc4\x90\xe1\xbb\x99 \xe1\xba\xa9m"};
+
+typedef struct {
+    const int8_t *feature;      /* < 0: lá */
+    const double *threshold;    /* đi nhánh trái khi x[feature] <= threshold */
+    const int16_t *left;
+    const int16_t *right;
+    const double *proba;        /* cây chất lượng: [node][CAQM_N_CLASSES] */
+    const uint8_t *label;       /* cây chất lượng: chỉ số lớp; cây chẩn đoán: [node][n_outputs] nhãn 0/1 */
+    uint8_t n_outputs;
+    uint8_t first_output;
+} caqm_tree_t;
+
+static const int8_t caqm_q0_feature[197] = {
+    0, 4, 0, 4, 2, -1, 0, 4, 4, 3, -1, 0, -1, -1, 4, 1, 2, 1, -1, 0, -1, 4, -1, 4,
+    4, 1, -1, 4, 1, 0, -1, 4, -1, -1, 4, 0, 0, 0, -1, 3, 4, 1, -1, -1, -1, -1, -1, 4,
+    3, 4, -1, -1, 1, -1, 3, 2, 3, 3, 4, -1, 1, 4, -1, 3, 2, 0, 1, -1, 4, 4, -1, 4,
+    -1, -1, -1, 4, 1, 2, 4, -1, -1, -1, 0, -1, 0, -1, -1, -1, -1, 4, 0, 1, -1, 2, -1, 4,
+    4, 2, 1, -1, 0, 3, -1, -1, -1, -1, 0, 2, -1, 2, 2, -1, -1, 0, -1, 4, -1, -1, 0, -1,
+    0, 3, -1, 3, -1, 1, -1, -1, -1, -1, -1, -1, 1, -1, -1, 1, 3, -1, -1, -1, -1, 2, -1, 0,
+    2, 2, -1, -1, -1, -1, 1, -1, -1, 3, 1, -1, 1, -1, 3, 1, -1, 2, -1, -1, -1, -1, 2, -1,
+    -1, -1, -1, -1, -1, 1, -1, -1, 2, -1, -1, 0, 3, 2, -1, -1, 0, -1, -1, 0, 2, -1, -1, -1,
+    -1, -1, -1, -1, -1,
+};
+static const double caqm_q0_threshold[197] = {
+    997.0, 70.45439839719438, 998.0, 64.95437547794828,
+    39.0, 0.0, 1381.0, 31.940619153321343,
+    69.46195496140693, 34.1014588795382, 0.0, 1055.0,
+    0.0, 0.0, 50.90892760682916, 1.5729827840470556,
+    41.0, 7.979461433865119, 0.0, 1010.0,
+    0.0, 50.02058959691267, 0.0, 65.53193705583483,
+    67.96061097899974, 7.6169199119994975, 0.0, 84.98580449014953,
+    11.523264399528312, 999.0, 0.0, 39.50927593098435,
+    0.0, 0.0, 66.77796172891868, 768.0,
+    424.0, 441.0, 0.0, 33.90786218450649,
+    90.83234161849818, 8.784302472275325, 0.0, 0.0,
+    0.0, 0.0, 0.0, 66.49937134222033,
+    28.47906403395441, 65.24917371481381, 0.0, 0.0,
+    1.98659057728799, 0.0, 32.88964553785418, 34.0,
+    33.99619799241458, 26.16167772962009, 91.65214909615327, 0.0,
+    8.994243226342515, 65.65163879702676, 0.0, 25.245023224856368,
+    14.0, 760.0, 4.389871602225347, 0.0,
+    69.36252588810537, 70.40875017926223, 0.0, 83.43387986256982,
+    0.0, 0.0, 0.0, 89.15502678090009,
+    0.1934247912859588, 21.0, 92.1238707484828, 0.0,
+    0.0, 0.0, 457.0, 0.0,
+    705.0, 0.0, 0.0, 0.0,
+    0.0, 65.47779551979167, 756.0, 3.273465407156741,
+    0.0, 4.000000000000001, 0.0, 79.17195416838491,
+    83.44199705299724, 23.0, 3.895469716908853, 0.0,
+    741.0, 28.36415844960215, 0.0, 0.0,
+    0.0, 0.0, 578.0, 1.0000000000000016,
+    0.0, 4.000000000000001, 11.0, 0.0,
+    0.0, 517.0, 0.0, 69.72421488959206,
+    0.0, 0.0, 771.0, 0.0,
+    720.0, 25.62806351760151, 0.0, 25.642886303984394,
+    0.0, 0.20986363121753102, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.9305070892313879, 0.0, 0.0, 2.6065033370678483,
+    26.176916309491787, 0.0, 0.0, 0.0,
+    0.0, 3.16e-322, 0.0, 687.0,
+    12.0, 7.000000000000005, 0.0, 0.0,
+    0.0, 0.0, 1.447181840150111, 0.0,
+    0.0, 25.951139654100686, 3.6372619564306032, 0.0,
+    1.772741044143037, 0.0, 29.530652275110935, 1.2689882127799619,
+    0.0, 9.000000000000005, 0.0, 0.0,
+    0.0, 0.0, 10.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 5.68289510616952, 0.0, 0.0,
+    1.0000000000000016, 0.0, 0.0, 575.0,
+    27.885933381116544, 22.0, 0.0, 0.0,
+    462.0, 0.0, 0.0, 701.0,
+    17.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0,
+};
+static const int16_t caqm_q0_left[197] = {
+    1, 3, 5, 7, 9, -1, 11, 13, 15, 17, -1, 19, -1, -1, 21, 23,
+    25, 27, -1, 29, -1, 31, -1, 33, 35, 37, -1, 39, 41, 43, -1, 45,
+    -1, -1, 47, 49, 51, 53, -1, 55, 57, 59, -1, -1, -1, -1, -1, 61,
+    63, 65, -1, -1, 67, -1, 69, 71, 73, 75, 77, -1, 79, 81, -1, 83,
+    85, 87, 89, -1, 91, 93, -1, 95, -1, -1, -1, 97, 99, 101, 103, -1,
+    -1, -1, 105, -1, 107, -1, -1, -1, -1, 109, 111, 113, -1, 115, -1, 117,
+    119, 121, 123, -1, 125, 127, -1, -1, -1, -1, 129, 131, -1, 133, 135, -1,
+    -1, 137, -1, 139, -1, -1, 141, -1, 143, 145, -1, 147, -1, 149, -1, -1,
+    -1, -1, -1, -1, 151, -1, -1, 153, 155, -1, -1, -1, -1, 157, -1, 159,
+    161, 163, -1, -1, -1, -1, 165, -1, -1, 167, 169, -1, 171, -1, 173, 175,
+    -1, 177, -1, -1, -1, -1, 179, -1, -1, -1, -1, -1, -1, 181, -1, -1,
+    183, -1, -1, 185, 187, 189, -1, -1, 191, -1, -1, 193, 195, -1, -1, -1,
+    -1, -1, -1, -1, -1,
+};
+static const int16_t caqm_q0_right[197] = {
+    2, 4, 6, 8, 10, -1, 12, 14, 16, 18, -1, 20, -1, -1, 22, 24,
+    26, 28, -1, 30, -1, 32, -1, 34, 36, 38, -1, 40, 42, 44, -1, 46,
+    -1, -1, 48, 50, 52, 54, -1, 56, 58, 60, -1, -1, -1, -1, -1, 62,
+    64, 66, -1, -1, 68, -1, 70, 72, 74, 76, 78, -1, 80, 82, -1, 84,
+    86, 88, 90, -1, 92, 94, -1, 96, -1, -1, -1, 98, 100, 102, 104, -1,
+    -1, -1, 106, -1, 108, -1, -1, -1, -1, 110, 112, 114, -1, 116, -1, 118,
+    120, 122, 124, -1, 126, 128, -1, -1, -1, -1, 130, 132, -1, 134, 136, -1,
+    -1, 138, -1, 140, -1, -1, 142, -1, 144, 146, -1, 148, -1, 150, -1, -1,
+    -1, -1, -1, -1, 152, -1, -1, 154, 156, -1, -1, -1, -1, 158, -1, 160,
+    162, 164, -1, -1, -1, -1, 166, -1, -1, 168, 170, -1, 172, -1, 174, 176,
+    -1, 178, -1, -1, -1, -1, 180, -1, -1, -1, -1, -1, -1, 182, -1, -1,
+    184, -1, -1, 186, 188, 190, -1, -1, 192, -1, -1, 194, 196, -1, -1, -1,
+    -1, -1, -1, -1, -1,
+};
+static const double caqm_q0_proba[591] = {
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    1.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    1.0, 0.0, 0.0, 1.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    1.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    1.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+    0.0, 1.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+    1.0, 0.0, 0.0, 1.0,
+    0.0, 0.0, 0.5, 0.0,
+    0.5, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    1.0, 0.0, 0.0, 1.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 1.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    1.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 1.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.5, 0.5,
+    0.0, 0.0, 0.0, 0.0,
+    1.0, 0.0, 0.0, 0.0,
+    1.0, 0.0, 1.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+    1.0, 0.0, 0.0, 0.0,
+    0.0, 1.0, 0.0, 0.0,
+    0.0, 0.0, 0.5, 0.5,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 1.0, 0.0, 0.75,
+    0.25, 0.0, 0.0, 1.0,
+    0.0, 1.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+    0.0, 0.0, 0.5, 0.5,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.6666666666666666, 0.3333333333333333, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+    0.0, 0.25, 0.75, 0.0,
+    1.0, 0.0, 0.0, 0.0,
+    1.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.5, 0.5, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+    0.0, 0.0, 0.0, 1.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 1.0, 0.0, 0.0,
+    1.0, 0.0, 0.0, 0.0,
+    0.0, 1.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 1.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 1.0,
+    0.0, 0.0, 1.0, 0.0,
+    0.5, 0.5, 0.0, 0.0,
+    0.0, 1.0, 0.0, 1.0,
+    0.0, 0.0, 0.5, 0.5,
+    0.0, 0.0, 0.0, 0.0,
+    0.5, 0.5, 0.0, 1.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    1.0, 0.0, 0.0, 0.25,
+    0.75, 0.0, 0.0, 1.0,
+    0.0, 1.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 1.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 1.0,
+    0.0, 1.0, 0.0, 0.0,
+    0.5, 0.5, 0.0, 1.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 1.0,
+    0.0, 0.3333333333333333, 0.6666666666666666, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.6666666666666666, 0.3333333333333333,
+    0.0, 0.0, 0.0, 0.5,
+    0.5, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.75, 0.25, 0.0, 0.0,
+    0.0, 0.0, 0.0, 1.0,
+    0.0, 0.0, 1.0, 0.0,
+    0.75, 0.25, 0.0, 0.0,
+    1.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.5, 0.5,
+    0.0, 0.0, 1.0, 0.0,
+    1.0, 0.0, 0.0, 0.25,
+    0.75, 0.0, 1.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+    0.0, 0.0, 0.0, 1.0,
+    0.0, 0.6666666666666666, 0.3333333333333333, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    1.0, 0.0, 0.3333333333333333, 0.6666666666666666,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 1.0,
+    0.0, 0.3333333333333333, 0.6666666666666666, 0.0,
+    0.0, 0.0, 0.0, 0.5,
+    0.5, 0.0, 0.0, 1.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 0.0, 0.0, 0.5454545454545454,
+    0.45454545454545453, 0.0, 0.06666666666666667, 0.9333333333333333,
+    0.0, 0.2, 0.8, 0.0,
+    0.0, 1.0, 0.0, 0.0,
+    1.0, 0.0, 1.0, 0.0,
+    0.0, 1.0, 0.0, 0.0,
+    0.25, 0.75, 0.0,
+};
+static const uint8_t caqm_q0_label[197] = {
+    0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2, 0,
+    0, 0, 0, 0, 0, 0, 0, 0, 2, 2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0,
+    0, 0, 2, 2, 0, 2, 0, 0, 0, 0, 0, 1, 0, 0, 2, 0, 0, 0, 0, 2, 0, 0, 1, 0,
+    0, 1, 0, 0, 0, 0, 0, 1, 0, 2, 0, 1, 0, 2, 1, 2, 1, 0, 0, 0, 2, 0, 1, 0,
+    0, 0, 0, 0, 0, 0, 0, 1, 0, 1, 0, 0, 2, 0, 0, 1, 2, 0, 1, 0, 1, 1, 0, 0,
+    0, 0, 0, 0, 1, 0, 1, 1, 1, 2, 1, 1, 0, 1, 1, 0, 0, 1, 2, 2, 1, 0, 1, 0,
+    0, 0, 1, 0, 1, 0, 0, 2, 2, 0, 0, 1, 0, 1, 0, 0, 0, 0, 1, 1, 0, 1, 0, 1,
+    2, 1, 2, 1, 2, 0, 1, 0, 0, 1, 1, 0, 0, 0, 1, 1, 0, 1, 1, 0, 0, 0, 1, 1,
+    1, 1, 0, 0, 1,
+};
+
+static const caqm_tree_t CAQM_QUALITY_TREES[CAQM_N_QUALITY_TREES] = {
+    {caqm_q0_feature, caqm_q0_threshold, caqm_q0_left, caqm_q0_right, caqm_q0_proba, caqm_q0_label, 1, 0},
+};
+
+static const int8_t caqm_p0_feature[9] = {
+    0, 0, -1, -1, 0, -1, 0, -1, -1,
+};
+static const double caqm_p0_threshold[9] = {
+    1023.0, 937.0, 0.0, 0.0,
+    994.0, 0.0, 999.0, 0.0,
+    0.0,
+};
+static const int16_t caqm_p0_left[9] = {
+    1, 3, -1, -1, 5, -1, 7, -1, -1,
+};
+static const int16_t caqm_p0_right[9] = {
+    2, 4, -1, -1, 6, -1, 8, -1, -1,
+};
+static const uint8_t caqm_p0_label[9] = {
+    0, 0, 1, 0, 0, 0, 0, 0, 1,
+};
+
+static const int8_t caqm_p1_feature[9] = {
+    1, 1, -1, -1, 1, -1, 1, -1, -1,
+};
+static const double caqm_p1_threshold[9] = {
+    12.509581665733501, 5.766929525972121, 0.0, 0.0,
+    8.77866292868438, 0.0, 8.994243226342515, 0.0,
+    0.0,
+};
+static const int16_t caqm_p1_left[9] = {
+    1, 3, -1, -1, 5, -1, 7, -1, -1,
+};
+static const int16_t caqm_p1_right[9] = {
+    2, 4, -1, -1, 6, -1, 8, -1, -1,
+};
+static const uint8_t caqm_p1_label[9] = {
+    0, 0, 1, 0, 0, 0, 0, 0, 1,
+};
+
+static const int8_t caqm_p2_feature[7] = {
+    2, -1, 2, 2, -1, -1, -1,
+};
+static const double caqm_p2_threshold[7] = {
+    33.0, 0.0, 42.0, 34.0,
+    0.0, 0.0, 0.0,
+};
+static const int16_t caqm_p2_left[7] = {
+    1, -1, 3, 5, -1, -1, -1,
+};
+static const int16_t caqm_p2_right[7] = {
+    2, -1, 4, 6, -1, -1, -1,
+};
+static const uint8_t caqm_p2_label[7] = {
+    0, 0, 0, 0, 1, 0, 1,
+};
+
+static const int8_t caqm_p3_feature[13] = {
+    3, 3, -1, -1, 3, 3, -1, 3, -1, -1, 3, -1, -1,
+};
+static const double caqm_p3_threshold[13] = {
+    34.33968983880834, 31.782767160986985, 0.0, 0.0,
+    34.04933878833335, 34.02247056826771, 0.0, 33.84640810229951,
+    0.0, 0.0, 33.99619799241458, 0.0,
+    0.0,
+};
+static const int16_t caqm_p3_left[13] = {
+    1, 3, -1, -1, 5, 7, -1, 9, -1, -1, 11, -1, -1,
+};
+static const int16_t caqm_p3_right[13] = {
+    2, 4, -1, -1, 6, 8, -1, 10, -1, -1, 12, -1, -1,
+};
+static const uint8_t caqm_p3_label[13] = {
+    0, 0, 1, 0, 0, 0, 1, 0, 1, 0, 0, 0, 1,
+};
+
+static const int8_t caqm_p4_feature[139] = {
+    4, 4, 3, 4, 4, 4, 3, 0, 4, 4, 1, 3, 4, 1, -1, 0, -1, 2, -1, -1, 0, 0, 0, 3,
+    4, 4, -1, 1, -1, -1, 0, -1, 3, 3, -1, 2, -1, 2, -1, 1, -1, -1, 1, -1, -1, -1, -1, -1,
+    -1, 3, -1, 1, 0, 3, -1, 3, 0, 2, -1, 1, 2, -1, -1, 2, -1, -1, 3, 4, -1, -1, -1, 2,
+    -1, -1, -1, 3, -1, 2, 1, -1, 2, 1, -1, 0, 3, 2, -1, -1, -1, -1, 1, 0, 2, 2, -1, -1,
+    -1, -1, 3, -1, -1, -1, 3, -1, 3, -1, 0, -1, -1, 1, 0, -1, -1, -1, -1, -1, -1, 3, -1, 1,
+    -1, 1, -1, 2, -1, 2, -1, -1, -1, 2, 4, -1, -1, 0, -1, -1, -1, -1, -1,
+};
+static const double caqm_p4_threshold[139] = {
+    84.79488345876517, 56.87120949551408, 29.569381451608983, 38.07627908218299,
+    83.3026135424741, 91.65214909615327, 29.923432287626238, 1527.0,
+    50.26188913176667, 78.13144763797479, 3.3772802266821285, 25.443164873747904,
+    92.1238707484828, 1.7700981901600568, 0.0, 792.0,
+    0.0, 8.0, 0.0, 0.0,
+    747.0, 859.0, 687.0, 25.197087925601814,
+    84.98338918049936, 91.93449916020525, 0.0, 1.4202919452021452,
+    0.0, 0.0, 795.0, 0.0,
+    27.294034771345178, 28.987089544166246, 0.0, 28.0,
+    0.0, 4.000000000000001, 0.0, 1.2689882127799619,
+    0.0, 0.0, 1.3362934257353087, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 26.26254374844191, 0.0, 5.172681163451766,
+    705.0, 29.00504121598958, 0.0, 27.44389694114833,
+    524.0, 1.0000000000000016, 0.0, 0.20986363121753102,
+    11.0, 0.0, 0.0, 1.0000000000000016,
+    0.0, 0.0, 29.390167564222285, 84.28916458648322,
+    0.0, 0.0, 0.0, 15.0,
+    0.0, 0.0, 0.0, 26.348712329368837,
+    0.0, 2.0000000000000013, 3.6445106789537496, 0.0,
+    31.0, 2.346514981800035, 0.0, 720.0,
+    27.208732458188535, 14.0, 0.0, 0.0,
+    0.0, 0.0, 4.242411049668698, 410.0,
+    26.0, 25.0, 0.0, 0.0,
+    0.0, 0.0, 27.997305698293584, 0.0,
+    0.0, 0.0, 28.4915666197028, 0.0,
+    27.485702318761007, 0.0, 767.0, 0.0,
+    0.0, 4.8114577083629335, 483.0, 0.0,
+    0.0, 0.0, 0.0, 0.0,
+    0.0, 28.95203737941494, 0.0, 2.555568192447503,
+    0.0, 0.8126899373435393, 0.0, 23.0,
+    0.0, 7.000000000000005, 0.0, 0.0,
+    0.0, 15.0, 86.17132995177835, 0.0,
+    0.0, 609.0, 0.0, 0.0,
+    0.0, 0.0, 0.0,
+};
+static const int16_t caqm_p4_left[139] = {
+    1, 3, 5, 7, 9, 11, 13, 15, 17, 19, 21, 23, 25, 27, -1, 29,
+    -1, 31, -1, -1, 33, 35, 37, 39, 41, 43, -1, 45, -1, -1, 47, -1,
+    49, 51, -1, 53, -1, 55, -1, 57, -1, -1, 59, -1, -1, -1, -1, -1,
+    -1, 61, -1, 63, 65, 67, -1, 69, 71, 73, -1, 75, 77, -1, -1, 79,
+    -1, -1, 81, 83, -1, -1, -1, 85, -1, -1, -1, 87, -1, 89, 91, -1,
+    93, 95, -1, 97, 99, 101, -1, -1, -1, -1, 103, 105, 107, 109, -1, -1,
+    -1, -1, 111, -1, -1, -1, 113, -1, 115, -1, 117, -1, -1, 119, 121, -1,
+    -1, -1, -1, -1, -1, 123, -1, 125, -1, 127, -1, 129, -1, 131, -1, -1,
+    -1, 133, 135, -1, -1, 137, -1, -1, -1, -1, -1,
+};
+static const int16_t caqm_p4_right[139] = {
+    2, 4, 6, 8, 10, 12, 14, 16, 18, 20, 22, 24, 26, 28, -1, 30,
+    -1, 32, -1, -1, 34, 36, 38, 40, 42, 44, -1, 46, -1, -1, 48, -1,
+    50, 52, -1, 54, -1, 56, -1, 58, -1, -1, 60, -1, -1, -1, -1, -1,
+    -1, 62, -1, 64, 66, 68, -1, 70, 72, 74, -1, 76, 78, -1, -1, 80,
+    -1, -1, 82, 84, -1, -1, -1, 86, -1, -1, -1, 88, -1, 90, 92, -1,
+    94, 96, -1, 98, 100, 102, -1, -1, -1, -1, 104, 106, 108, 110, -1, -1,
+    -1, -1, 112, -1, -1, -1, 114, -1, 116, -1, 118, -1, -1, 120, 122, -1,
+    -1, -1, -1, -1, -1, 124, -1, 126, -1, 128, -1, 130, -1, 132, -1, -1,
+    -1, 134, 136, -1, -1, 138, -1, -1, -1, -1, -1,
+};
+static const uint8_t caqm_p4_label[139] = {
+    0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 1, 0, 0, 1, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 1, 1,
+    0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 1, 0, 0,
+    0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 0, 0, 0, 0, 0, 1,
+    0, 1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 1, 0, 1, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 1, 0, 1, 0, 0, 1, 0, 0, 1, 1, 0, 1, 0,
+};
+
+#define CAQM_N_PROBLEM_TREES 5
+static const caqm_tree_t CAQM_PROBLEM_TREES[CAQM_N_PROBLEM_TREES] = {
+    {caqm_p0_feature, caqm_p0_threshold, caqm_p0_left, caqm_p0_right, 0, caqm_p0_label, 1, 0},
+    {caqm_p1_feature, caqm_p1_threshold, caqm_p1_left, caqm_p1_right, 0, caqm_p1_label, 1, 1},
+    {caqm_p2_feature, caqm_p2_threshold, caqm_p2_left, caqm_p2_right, 0, caqm_p2_label, 1, 2},
+    {caqm_p3_feature, caqm_p3_threshold, caqm_p3_left, caqm_p3_right, 0, caqm_p3_label, 1, 3},
+    {caqm_p4_feature, caqm_p4_threshold, caqm_p4_left, caqm_p4_right, 0, caqm_p4_label, 1, 4},
+};
+
+/* Id node lá mà x rơi vào */
+static inline int caqm_leaf(const caqm_tree_t *tree, const double *x) {
+    int node = 0;
+    while (tree->feature[node] >= 0) {
+        node = x[tree->feature[node]] <= tree->threshold[node] ? tree->left[node] : tree->right[node];
+    }
+    return node;
+}
+
+/*
+ * Chỉ số lớp chất lượng; *confidence = xác suất cao nhất. 1 cây: nhãn lưu ở lá;
+ * rừng: argmax của xác suất trung bình các cây (cộng theo thứ tự cây như numpy)
+ */
+static inline int caqm_predict_quality(const double *x, double *confidence) {
+    double proba[CAQM_N_CLASSES] = {0};
+    int t, k, best = 0, leaf = 0;
+    for (t = 0; t < CAQM_N_QUALITY_TREES; t++) {
+        leaf = caqm_leaf(&CAQM_QUALITY_TREES[t], x);
+        for (k = 0; k < CAQM_N_CLASSES; k++) proba[k] += CAQM_QUALITY_TREES[t].proba[leaf * CAQM_N_CLASSES + k];
+    }
+    for (k = 0; k < CAQM_N_CLASSES; k++) {
+        proba[k] /= CAQM_N_QUALITY_TREES;
+        if (proba[k] > proba[best]) best = k;
+    }
+    if (confidence) *confidence = proba[best];
+    return CAQM_N_QUALITY_TREES == 1 ? CAQM_QUALITY_TREES[0].label[leaf] : best;
+}
+
+/* flags[i] = 1 nếu cảm biến CAQM_PROBLEM_LABELS[i] có vấn đề */
+static inline void caqm_predict_problems(const double *x, uint8_t *flags) {
+    int t, o;
+    for (t = 0; t < CAQM_N_PROBLEM_TREES; t++) {
+        const caqm_tree_t *tree = &CAQM_PROBLEM_TREES[t];
+        const uint8_t *label = tree->label + caqm_leaf(tree, x) * tree->n_outputs;
+        for (o = 0; o < tree->n_outputs; o++) flags[tree->first_output + o] = label[o];
+    }
+}
+
+#endif /* CAQM_MODEL_H */
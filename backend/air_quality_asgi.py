@@ -0,0 +1,226 @@
+"""
+Chế độ ASGI cho AI service: cùng các route và định dạng JSON như Flask
+(air_quality_classifier.py), nhưng chạy trên event loop nên 1 worker giữ
+được nhiều kết nối keep-alive đồng thời. Phần tính toán (dự đoán, parse
+batch) được đẩy sang thread/process pool để không chặn event loop.
+
+Chạy:
+    uvicorn air_quality_asgi:app --host 0.0.0.0 --port 5000 --workers 4
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import air_quality_classifier as aqc
+
+logger = logging.getLogger(__name__)
+
+# Số thread xử lý request đơn lẻ (/predict, /retrain...) trong mỗi worker
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", "8"))
+# Số process chạy /predict/batch; 0 = chạy batch trên thread pool
+ASGI_BATCH_PROCESSES = int(os.environ.get("ASGI_BATCH_PROCESSES", "0"))
+# Giới hạn kích thước body (MAX_BATCH_SIZE reading dạng JSON cỡ vài MB)
+MAX_BODY_BYTES = int(os.environ.get("ASGI_MAX_BODY_BYTES", str(16 * 1024 * 1024)))
+
+_thread_pool = None
+_batch_pool = None
+
+
+class _MetricsRecorder:
+    """
+    Thay service_metrics trong process chạy batch: ghi lại các lần observe /
+    count_model_call để gửi về process cha cùng response rồi phát lại vào
+    service_metrics thật (process con không có /metrics riêng)
+    """
+    def __init__(self):
+        self.events = []
+
+    def observe(self, stage, seconds):
+        self.events.append(("observe", stage, seconds))
+
+    def count_model_call(self, n_readings):
+        self.events.append(("count_model_call", n_readings))
+
+    def drain(self):
+        events, self.events = self.events, []
+        return events
+
+
+def _init_batch_process():
+    aqc.service_metrics = _MetricsRecorder()
+    aqc.get_model_bundle()
+
+
+def _run_in_batch_process(handler, *args):
+    aqc.service_metrics.drain()
+    payload, status = handler(*args)
+    return payload, status, aqc.service_metrics.drain()
+
+
+def _replay_metrics(events):
+    for name, *args in events:
+        getattr(aqc.service_metrics, name)(*args)
+
+
+def _start_pools():
+    global _thread_pool, _batch_pool
+    _thread_pool = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix="asgi")
+    if ASGI_BATCH_PROCESSES > 0:
+        # spawn: không fork process đang có event loop và thread; mỗi process
+        # tự load model_artifact.npy (mmap, dùng chung page cache)
+        _batch_pool = ProcessPoolExecutor(
+            max_workers=ASGI_BATCH_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_batch_process,
+        )
+    else:
+        _batch_pool = _thread_pool
+
+
+def _stop_pools():
+    global _thread_pool, _batch_pool
+    if _batch_pool is not None and _batch_pool is not _thread_pool:
+        _batch_pool.shutdown(wait=False, cancel_futures=True)
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False, cancel_futures=True)
+    _thread_pool = _batch_pool = None
+
+
+# (method, path) -> (handler, có nhận body không, pool)
+ROUTES = {
+    ("POST", "/predict"): (aqc.handle_predict, True, "thread"),
+    ("POST", "/predict/batch"): (aqc.handle_predict_batch, True, "batch"),
+    ("POST", "/predict/stream"): (aqc.handle_predict_stream, True, "thread"),
+    ("GET", "/predict/stream"): (aqc.handle_stream_stats, False, "thread"),
+    ("GET", "/predict/cache"): (aqc.handle_cache_stats, False, "thread"),
+    ("POST", "/retrain"): (aqc.handle_retrain, True, "thread"),
+    ("GET", "/retrain/status"): (aqc.handle_retrain_status, False, "thread"),
+    ("GET", "/metrics"): (aqc.handle_metrics, False, "thread"),
+}
+
+
+async def _read_body(receive):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise OverflowError
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _send(send, body, status, content_type):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type),
+            (b"content-length", str(len(body)).encode("ascii")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_json(send, payload, status=200):
+    await _send(send, json.dumps(payload).encode("utf-8"), status, b"application/json")
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                _start_pools()
+                # Load model trước khi nhận request đầu tiên
+                await asyncio.get_running_loop().run_in_executor(_thread_pool, aqc.get_model_bundle)
+            except Exception as e:
+                logger.error(f"ASGI startup failed: {e}")
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _stop_pools()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    if _thread_pool is None:
+        # Server không hỗ trợ lifespan: tạo pool ở request đầu tiên
+        _start_pools()
+
+    started = time.perf_counter()
+    status = await _dispatch(scope, receive, send)
+    if status is not None:
+        aqc.service_metrics.count_request(scope["path"], status, time.perf_counter() - started)
+
+
+async def _dispatch(scope, receive, send):
+    """
+    Xử lý 1 request HTTP, trả về status đã gửi để đếm vào caqm_requests_total
+    (None nếu client ngắt kết nối hoặc path không có route, tránh label tùy ý)
+    """
+    route = ROUTES.get((scope["method"], scope["path"]))
+    if route is None:
+        if any(path == scope["path"] for _, path in ROUTES):
+            await _send_json(send, {"error": "Method not allowed"}, 405)
+            return 405
+        await _send_json(send, {"error": "Not found"}, 404)
+        return None
+    handler, takes_body, pool = route
+
+    args = ()
+    if takes_body:
+        try:
+            body = await _read_body(receive)
+        except OverflowError:
+            await _send_json(send, {"error": "Request body too large"}, 413)
+            return 413
+        if body is None:
+            return None
+        parse_started = time.perf_counter()
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            await _send_json(send, {"error": "Invalid JSON"}, 400)
+            return 400
+        aqc.service_metrics.observe("parse", time.perf_counter() - parse_started)
+        args = (data,)
+
+    loop = asyncio.get_running_loop()
+    try:
+        if pool == "batch" and _batch_pool is not _thread_pool:
+            payload, status, events = await loop.run_in_executor(_batch_pool, _run_in_batch_process, handler, *args)
+            _replay_metrics(events)
+        else:
+            executor = _batch_pool if pool == "batch" else _thread_pool
+            payload, status = await loop.run_in_executor(executor, handler, *args)
+    except Exception as e:
+        await _send_json(send, {"error": str(e)}, 500)
+        return 500
+
+    if handler is aqc.handle_metrics:
+        await _send(send, payload.encode("utf-8"), status, aqc.METRICS_CONTENT_TYPE.encode("ascii"))
+        return status
+    if not takes_body:
+        await _send_json(send, payload, status)
+        return status
+    serialize_started = time.perf_counter()
+    body = json.dumps(payload).encode("utf-8")
+    aqc.service_metrics.observe("serialization", time.perf_counter() - serialize_started)
+    await _send(send, body, status, b"application/json")
+    return status
@@ -1,13 +1,20 @@
 import numpy as np
-import pandas as pd
-from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import train_test_split
-import joblib
 import json
-from flask import Flask, request, jsonify
+import bisect
+import hashlib
+import heapq
+import itertools
+import struct
+from flask import Flask, Response, request, jsonify
 import logging
 import os
-from collections import Counter
+import multiprocessing
+import threading
+import time
+import queue
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from concurrent.futures import Future, ProcessPoolExecutor
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -15,140 +22,794 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# Tên file models
-MODEL_QUALITY_PATH = "model_quality_custom.pkl"
-MODEL_PROBLEMS_PATH = "model_problems_custom.pkl"
-SCALER_PATH = "scaler_custom.pkl"
+# Artifact model để phục vụ dự đoán: mean/scale của scaler + các cây ở dạng compiled
+MODEL_ARTIFACT_PATH = "model_artifact.npy"
+ARTIFACT_FORMAT = "caqm-tree-bundle"
+ARTIFACT_FORMAT_VERSION = 2
+ARTIFACT_ALIGN = 64
+
+# Số bin khi huấn luyện ở chế độ histogram (0 = split chính xác trên giá trị gốc)
+TRAIN_MAX_BINS = int(os.environ.get("TRAIN_MAX_BINS", "0")) or None
+# Số process dùng để huấn luyện song song các cây (mặc định = số core)
+TRAIN_N_JOBS = int(os.environ.get("TRAIN_N_JOBS", "0")) or os.cpu_count() or 1
+# Tổng số dòng huấn luyện (cộng qua các cây) tối thiểu để dùng process pool: dưới ngưỡng
+# này khởi động worker (spawn/forkserver import lại module) tốn hơn chính việc fit
+TRAIN_PARALLEL_MIN_ROWS = int(os.environ.get("TRAIN_PARALLEL_MIN_ROWS", "200000"))
+# Số cây của model chất lượng (0 = 1 cây quyết định, > 0 = SimpleRandomForest)
+QUALITY_N_ESTIMATORS = int(os.environ.get("QUALITY_N_ESTIMATORS", "0"))
+# Độ sâu tối đa / số mẫu tối thiểu để tách node của model chất lượng (chọn bằng tune_classifier.py)
+QUALITY_MAX_DEPTH = int(os.environ.get("QUALITY_MAX_DEPTH", "15"))
+QUALITY_MIN_SAMPLES_SPLIT = int(os.environ.get("QUALITY_MIN_SAMPLES_SPLIT", "5"))
+# Cắt tỉa cây sau huấn luyện: "none", "same_label" (gộp cây con cùng nhãn, dự đoán
+# không đổi) hoặc "ccp" (cost-complexity, alpha chọn trên dữ liệu validation + same_label)
+TREE_PRUNING = os.environ.get("TREE_PRUNING", "none")
+# Model chẩn đoán: "binary_relevance" (5 cây, mỗi nhãn 1 cây) hoặc "multi_output" (1 cây cho cả 5 nhãn)
+DIAGNOSTIC_MODEL = os.environ.get("DIAGNOSTIC_MODEL", "binary_relevance")
+
+# Kiểm tra ngay khi import: giá trị sai không được đợi tới lúc huấn luyện xong mới báo lỗi
+if TREE_PRUNING not in ("none", "same_label", "ccp"):
+    raise ValueError(f"TREE_PRUNING must be one of none, same_label, ccp, got {TREE_PRUNING!r}")
+if DIAGNOSTIC_MODEL not in ("binary_relevance", "multi_output"):
+    raise ValueError(f"DIAGNOSTIC_MODEL must be one of binary_relevance, multi_output, got {DIAGNOSTIC_MODEL!r}")
+
+# Thứ tự feature đầu vào của model
+SENSOR_KEYS = ["co2", "co", "pm25", "temperature", "humidity"]
+SENSOR_NAMES = ["CO2", "CO", "PM2.5", "Nhiệt độ", "Độ ẩm"]
+SENSOR_UNITS = ["ppm", "ppm", "μg/m³", "°C", "%"]
 
 # ============================================
 # 0. CUSTOM DECISION TREE IMPLEMENTATION
 # ============================================
 
-class Node:
-    def __init__(self, feature=None, threshold=None, left=None, right=None, *, value=None, proba=None):
-        self.feature = feature
-        self.threshold = threshold
-        self.left = left
-        self.right = right
-        self.value = value
-        self.proba = proba
+TREE_LEAF = -1
+
+# Số bin tối đa cho mỗi feature ở chế độ huấn luyện binned (vừa uint8)
+MAX_BINS = 256
+# Số dòng tối đa dùng để ước lượng biên bin theo quantile
+BIN_SAMPLE_SIZE = 200_000
+
+
+def check_max_bins(max_bins):
+    """
+    Kiểm tra số bin: None / 0 = tắt chế độ histogram, ngược lại phải nằm trong
+    [2, MAX_BINS] vì ma trận bin là uint8 (vượt quá thì chỉ số bin bị tràn)
+    """
+    if not max_bins:
+        return None
+    if isinstance(max_bins, bool) or int(max_bins) != max_bins or not 2 <= max_bins <= MAX_BINS:
+        raise ValueError(f"max_bins must be an integer in [2, {MAX_BINS}], got {max_bins!r}")
+    return int(max_bins)
+
+
+# Kiểm tra cấu hình TRAIN_MAX_BINS ngay khi import (đọc từ biến môi trường ở đầu file)
+TRAIN_MAX_BINS = check_max_bins(TRAIN_MAX_BINS)
+
+
+def compute_bin_edges(X, max_bins=MAX_BINS):
+    """
+    Tính biên bin cho từng feature: nếu cột có ít giá trị khác nhau thì lấy
+    điểm giữa các giá trị (split chính xác), ngược lại lấy quantile.
+    Trả về list các mảng tăng dần, mảng thứ j có tối đa max_bins - 1 biên
+    """
+    if check_max_bins(max_bins) is None:
+        raise ValueError(f"max_bins must be an integer in [2, {MAX_BINS}], got {max_bins!r}")
+    X = np.asarray(X, dtype=np.float64)
+    if X.shape[0] > BIN_SAMPLE_SIZE:
+        X = X[::X.shape[0] // BIN_SAMPLE_SIZE + 1]
+
+    bin_edges = []
+    for j in range(X.shape[1]):
+        values = np.unique(X[:, j])
+        if len(values) <= max_bins:
+            edges = (values[:-1] + values[1:]) / 2
+        else:
+            edges = np.unique(np.quantile(X[:, j], np.linspace(0, 1, max_bins + 1)[1:-1]))
+        bin_edges.append(edges)
+    return bin_edges
+
+
+def bin_features(X, bin_edges):
+    """
+    Lượng tử hóa X thành ma trận uint8: bin(x) <= b  <=>  x <= bin_edges[j][b]
+    """
+    X = np.asarray(X, dtype=np.float64)
+    X_binned = np.empty(X.shape, dtype=np.uint8)
+    for j, edges in enumerate(bin_edges):
+        X_binned[:, j] = np.searchsorted(edges, X[:, j], side="left")
+    return X_binned
+
+
+class _TreeStore:
+    """
+    Bộ nhớ node dạng mảng song song, cùng bố cục với cây compiled (id node =
+    chỉ số mảng). Dung lượng tăng gấp đôi khi đầy; finish() cắt đúng số node
+    rồi gắn các mảng vào cây. Mỗi node tốn vài chục byte thay vì 1 đối tượng Python
+    """
+    def __init__(self, value_shape=(), proba_shape=(), capacity=64):
+        self.n_nodes = 0
+        self.feature = np.full(capacity, TREE_LEAF, dtype=np.intp)
+        self.threshold = np.zeros(capacity, dtype=np.float64)
+        self.left = np.full(capacity, TREE_LEAF, dtype=np.intp)
+        self.right = np.full(capacity, TREE_LEAF, dtype=np.intp)
+        self.value = np.zeros((capacity,) + tuple(value_shape), dtype=np.intp)
+        self.proba = np.zeros((capacity,) + tuple(proba_shape), dtype=np.float64)
+
+    def add(self):
+        if self.n_nodes == len(self.feature):
+            for name in ("feature", "threshold", "left", "right", "value", "proba"):
+                arr = getattr(self, name)
+                fill = TREE_LEAF if name in ("feature", "left", "right") else 0
+                grown = np.full((2 * len(arr),) + arr.shape[1:], fill, dtype=arr.dtype)
+                grown[:len(arr)] = arr
+                setattr(self, name, grown)
+        self.n_nodes += 1
+        return self.n_nodes - 1
+
+    def set_split(self, node_id, feature, threshold, left, right):
+        self.feature[node_id] = feature
+        self.threshold[node_id] = threshold
+        self.left[node_id] = left
+        self.right[node_id] = right
+
+    def set_leaf(self, node_id, value, proba):
+        self.value[node_id] = value
+        self.proba[node_id] = proba
+
+    def finish(self, tree):
+        n = self.n_nodes
+        tree.feature_ = self.feature[:n].copy()
+        tree.threshold_ = self.threshold[:n].copy()
+        tree.left_ = self.left[:n].copy()
+        tree.right_ = self.right[:n].copy()
+        tree.value_ = self.value[:n].copy()
+        tree.proba_ = self.proba[:n].copy()
+        return tree
+
+def _raw_threshold(threshold, mean, scale):
+    """
+    Threshold theo đơn vị gốc: giá trị float lớn nhất x sao cho
+    (x - mean) / scale <= threshold. Làm tròn float của t * scale + mean có thể
+    lệch vài ulp, nên dịch từng ulp cho tới khi khớp đúng phép so sánh trên
+    dữ liệu đã scale -> cây gộp scaler cho kết quả giống hệt cây gốc
+    """
+    def goes_left(x):
+        return (x - mean) / scale <= threshold
+
+    raw = threshold * scale + mean
+    for _ in range(64):
+        too_high = ~goes_left(raw)
+        if not too_high.any():
+            break
+        raw[too_high] = np.nextafter(raw[too_high], -np.inf)
+    for _ in range(64):
+        step_up = np.nextafter(raw, np.inf)
+        can_raise = goes_left(step_up)
+        if not can_raise.any():
+            break
+        raw[can_raise] = step_up[can_raise]
+    return raw
 
-    def is_leaf_node(self):
-        return self.value is not None
 
 class SimpleDecisionTree:
     """
     Cây quyết định tự xây dựng (Classification Tree) sử dụng Gini Impurity
     """
-    def __init__(self, min_samples_split=2, max_depth=100, n_features=None):
+    def __init__(self, min_samples_split=2, max_depth=100, n_features=None, max_bins=None, random_state=None):
         self.min_samples_split = min_samples_split
         self.max_depth = max_depth
         self.n_features = n_features
-        self.root = None
+        # max_bins != None: huấn luyện trên dữ liệu đã lượng tử hóa (histogram)
+        self.max_bins = check_max_bins(max_bins)
+        # Seed riêng của cây: kết quả không phụ thuộc thứ tự/process huấn luyện
+        self.random_state = random_state
+        # Cây đã fit: các mảng COMPILED_ARRAYS do _TreeStore.finish / from_arrays gắn vào
+        self.feature_ = None
 
     def fit(self, X, y):
-        self.n_features = X.shape[1] if not self.n_features else min(X.shape[1], self.n_features)
-        self.root = self._grow_tree(X, y)
-
-    def _grow_tree(self, X, y, depth=0):
-        n_samples, n_feats = X.shape
-        n_labels = len(np.unique(y))
-
-        # Điều kiện dừng
-        if (depth >= self.max_depth or n_labels == 1 or n_samples < self.min_samples_split):
-            counter = Counter(y)
-            most_common = counter.most_common(1)[0][0]
-            # Tính xác suất cho từng class tại lá này
-            total = len(y)
-            proba = {k: v / total for k, v in counter.items()}
-            return Node(value=most_common, proba=proba)
+        if self.max_bins:
+            bin_edges = compute_bin_edges(X, self.max_bins)
+            return self.fit_binned(bin_features(X, bin_edges), y, bin_edges)
 
-        feat_idxs = np.random.choice(n_feats, self.n_features, replace=False)
-
-        # Tìm split tốt nhất
-        best_feat, best_thresh = self._best_split(X, y, feat_idxs)
-
-        if best_feat is None: # Không tìm được split nào tốt hơn
-            counter = Counter(y)
-            most_common = counter.most_common(1)[0][0]
-            proba = {k: v / len(y) for k, v in counter.items()}
-            return Node(value=most_common, proba=proba)
+        self.n_features = X.shape[1] if not self.n_features else min(X.shape[1], self.n_features)
+        # Mã hóa nhãn thành chỉ số 0..n_classes-1, lá lưu chỉ số class + mảng xác suất
+        self.classes_, y_encoded = self._encode_labels(y)
+        rng = np.random.default_rng(self.random_state)
+
+        def find_split(idxs, feat_idxs, counts):
+            X_node = X[idxs]
+            best_feat, best_thresh = self._best_split(X_node, y_encoded[idxs], feat_idxs)
+            if best_feat is None:
+                return None
+            return best_feat, best_thresh, X_node[:, best_feat] <= best_thresh
+
+        return self._grow_tree(y_encoded, X.shape[1], rng, find_split)
+
+    def fit_binned(self, X_binned, y, bin_edges):
+        """
+        Huấn luyện trên ma trận đã lượng tử hóa (bin_features). Mỗi node chỉ
+        giữ mảng chỉ số dòng, split lấy từ histogram class theo bin nên
+        không copy ma trận con. Threshold lưu theo đơn vị gốc của X
+        nên predict vẫn nhận dữ liệu float bình thường
+        """
+        self.n_features = X_binned.shape[1] if not self.n_features else min(X_binned.shape[1], self.n_features)
+        self.classes_, y_encoded = self._encode_labels(y)
+        self.bin_edges_ = bin_edges
+        rng = np.random.default_rng(self.random_state)
+
+        def find_split(idxs, feat_idxs, counts):
+            best_feat, best_bin = self._best_split_binned(X_binned, y_encoded, idxs, feat_idxs, counts)
+            if best_feat is None:
+                return None
+            return best_feat, bin_edges[best_feat][best_bin], X_binned[idxs, best_feat] <= best_bin
+
+        return self._grow_tree(y_encoded, X_binned.shape[1], rng, find_split)
+
+    def fit_bootstrap(self, X, y, boot_seed, bin_edges=None):
+        """
+        Huấn luyện trên mẫu bootstrap rút từ boot_seed ngay trong process
+        huấn luyện (dùng cho SimpleRandomForest): job chỉ mang seed thay vì
+        bản copy X[idxs]. bin_edges khác None: X là ma trận đã lượng tử hóa
+        """
+        idxs = bootstrap_indices(boot_seed, len(y))
+        if bin_edges is None:
+            return self.fit(X[idxs], y[idxs])
+        return self.fit_binned(X[idxs], y[idxs], bin_edges)
+
+    def _encode_labels(self, y):
+        return np.unique(y, return_inverse=True)
+
+    def _class_counts(self, y):
+        return np.bincount(y, minlength=len(self.classes_))
+
+    @staticmethod
+    def _is_pure(counts):
+        # Mọi mẫu cùng 1 class (với cây nhiều đầu ra: ở từng đầu ra)
+        return bool(np.all(np.count_nonzero(counts, axis=-1) == 1))
+
+    def _leaf_values(self, counts):
+        # Tính xác suất cho từng class tại lá này
+        return int(np.argmax(counts)), counts / counts.sum()
+
+    def _grow_tree(self, y, n_feats, rng, find_split):
+        """
+        Xây cây không đệ quy: stack tường minh chứa (id node, chỉ số dòng, độ sâu),
+        node ghi thẳng vào _TreeStore nên không tạo đối tượng Python và không
+        giới hạn bởi độ sâu đệ quy. Nhánh trái được lấy ra trước (giống thứ tự
+        đệ quy cũ) nên rng được dùng theo cùng thứ tự -> cùng 1 cây.
+        find_split(idxs, feat_idxs, counts) -> None hoặc (feature, threshold, mask nhánh trái)
+        """
+        counts = self._class_counts(y)
+        store = _TreeStore(counts.shape[:-1], counts.shape)
+        stack = [(store.add(), np.arange(len(y)), 0)]
+        while stack:
+            node_id, idxs, depth = stack.pop()
+            counts = self._class_counts(y[idxs])
+
+            # Điều kiện dừng
+            split = None
+            if not (depth >= self.max_depth or self._is_pure(counts) or len(idxs) < self.min_samples_split):
+                feat_idxs = rng.choice(n_feats, self.n_features, replace=False)
+                # Tìm split tốt nhất (None: không có split nào tốt hơn)
+                split = find_split(idxs, feat_idxs, counts)
+            if split is None:
+                store.set_leaf(node_id, *self._leaf_values(counts))
+                continue
+
+            best_feat, best_thresh, go_left = split
+            left, right = store.add(), store.add()
+            store.set_split(node_id, best_feat, best_thresh, left, right)
+            stack.append((right, idxs[~go_left], depth + 1))
+            stack.append((left, idxs[go_left], depth + 1))
+        return store.finish(self)
+
+    def _best_split_binned(self, X_binned, y, idxs, feat_idxs, parent_counts):
+        n_classes = len(self.classes_)
+        y_node = y[idxs]
+
+        best_gain = 0
+        split_idx, split_bin = None, None
 
-        left_idxs, right_idxs = self._split(X[:, best_feat], best_thresh)
-        left = self._grow_tree(X[left_idxs, :], y[left_idxs], depth + 1)
-        right = self._grow_tree(X[right_idxs, :], y[right_idxs], depth + 1)
-        return Node(best_feat, best_thresh, left, right)
+        for feat_idx in feat_idxs:
+            # Histogram (n_bins, n_classes) của node trên feature này
+            n_bins = len(self.bin_edges_[feat_idx]) + 1
+            hist = np.bincount(
+                X_binned[idxs, feat_idx].astype(np.intp) * n_classes + y_node,
+                minlength=n_bins * n_classes,
+            ).reshape(n_bins, n_classes)
+
+            best_bin, gain = self._best_cut_from_histogram(hist, parent_counts)
+            if gain > best_gain:
+                best_gain = gain
+                split_idx = feat_idx
+                split_bin = best_bin
+
+        return split_idx, split_bin
+
+    @staticmethod
+    def _child_gini(left_counts, parent_counts):
+        """
+        Gini có trọng số của 2 nhánh con cho nhiều vị trí cắt cùng lúc:
+        left_counts (n_cuts, n_classes) -> mảng (n_cuts,)
+        """
+        right_counts = parent_counts - left_counts
+        n_l = left_counts.sum(axis=1)
+        n_r = right_counts.sum(axis=1)
+        gini_l = 1 - np.sum((left_counts / n_l[:, None]) ** 2, axis=1)
+        gini_r = 1 - np.sum((right_counts / n_r[:, None]) ** 2, axis=1)
+        return (n_l * gini_l + n_r * gini_r) / (n_l + n_r)
+
+    @classmethod
+    def _best_cut_from_histogram(cls, hist, parent_counts):
+        """
+        Trả về (bin b tốt nhất cho split "bin <= b", gain) từ histogram class theo bin
+        """
+        n_samples = parent_counts.sum()
+        parent_gini = 1 - np.sum((parent_counts / n_samples) ** 2)
+        left_counts = np.cumsum(hist, axis=0)[:-1]
+        n_l = left_counts.sum(axis=1)
+        # Bỏ các vị trí cắt làm 1 nhánh rỗng
+        cut_bins = np.flatnonzero((n_l > 0) & (n_l < n_samples))
+        if cut_bins.size == 0:
+            return None, 0
+        child_gini = cls._child_gini(left_counts[cut_bins], parent_counts)
+        best = np.argmin(child_gini)
+        return cut_bins[best], parent_gini - child_gini[best]
 
     def _best_split(self, X, y, feat_idxs):
-        best_gain = -1
+        """
+        Tìm split chính xác: sort mỗi cột 1 lần rồi quét tất cả threshold,
+        số lượng từng class ở nhánh trái/phải lấy từ tổng cộng dồn nên
+        Gini của mọi vị trí cắt được tính cùng lúc - O(n log n) mỗi feature
+        """
+        n_samples = len(y)
+        n_classes = len(self.classes_)
+        parent_counts = np.bincount(y, minlength=n_classes)
+        parent_gini = 1 - np.sum((parent_counts / n_samples) ** 2)
+        one_hot = np.eye(n_classes, dtype=np.int64)
+
+        best_gain = 0
         split_idx, split_threshold = None, None
 
         for feat_idx in feat_idxs:
-            X_column = X[:, feat_idx]
-            thresholds = np.unique(X_column)
+            order = np.argsort(X[:, feat_idx], kind="stable")
+            x_sorted = X[order, feat_idx]
+
+            # Chỉ cắt giữa 2 giá trị khác nhau (vị trí cắt i: trái = x_sorted[:i + 1])
+            cut_pos = np.flatnonzero(x_sorted[:-1] < x_sorted[1:])
+            if cut_pos.size == 0:
+                continue
+
+            left_counts = np.cumsum(one_hot[y[order]], axis=0)[cut_pos]
+            child_gini = self._child_gini(left_counts, parent_counts)
+
+            best = np.argmin(child_gini)
+            gain = parent_gini - child_gini[best]
+            if gain > best_gain:
+                best_gain = gain
+                split_idx = feat_idx
+                pos = cut_pos[best]
+                # Threshold ở giữa 2 giá trị liền kề
+                split_threshold = (x_sorted[pos] + x_sorted[pos + 1]) / 2
+                if split_threshold >= x_sorted[pos + 1]:
+                    split_threshold = x_sorted[pos]
 
-            # Chỉ thử tối đa 10 threshold ngẫu nhiên để tăng tốc nếu dữ liệu lớn
-            if len(thresholds) > 10:
-                thresholds = np.random.choice(thresholds, 10, replace=False)
+        return split_idx, split_threshold
 
-            for thr in thresholds:
-                gain = self._information_gain(y, X_column, thr)
-                if gain > best_gain:
-                    best_gain = gain
-                    split_idx = feat_idx
-                    split_threshold = thr
+    # Các mảng song song mô tả cây (chỉ số = id node): feature_, threshold_, left_, right_
+    # (TREE_LEAF ở node lá), value_ (chỉ số class trong classes_), proba_ (n_nodes, n_classes);
+    # cây nhiều đầu ra thêm chiều n_outputs: value_ (n_nodes, n_outputs), proba_ (n_nodes, n_outputs, n_classes)
+    COMPILED_ARRAYS = ("feature_", "threshold_", "left_", "right_", "value_", "proba_", "classes_")
+
+    def to_arrays(self):
+        self._check_fitted()
+        return {name: getattr(self, name) for name in self.COMPILED_ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Tạo cây chỉ để dự đoán từ các mảng compiled
+        """
+        tree = cls()
+        for name in cls.COMPILED_ARRAYS:
+            setattr(tree, name, np.asarray(arrays[name]))
+        return tree
+
+    def fuse_scaler(self, mean, scale):
+        """
+        Trả về cây dự đoán trực tiếp trên giá trị gốc (ppm, μg/m³, °C, %).
+        Cây không đổi khi biến đổi đơn điệu từng feature:
+        (x - mean) / scale <= t  <=>  x <= t * scale + mean  (scale > 0)
+        """
+        arrays = self.to_arrays()
+        threshold = np.array(arrays["threshold_"], dtype=np.float64)
+        is_split = arrays["feature_"] != TREE_LEAF
+        feature = arrays["feature_"][is_split]
+        threshold[is_split] = _raw_threshold(threshold[is_split], mean[feature], scale[feature])
+        return type(self).from_arrays({**arrays, "threshold_": threshold})
+
+    # Cắt tỉa sau huấn luyện. Dựa trên id node con luôn lớn hơn id node cha
+    # (đúng với cây xây bằng _TreeStore)
+
+    def node_depths(self):
+        """
+        Độ sâu của từng node (gốc = 0)
+        """
+        self._check_fitted()
+        depth = np.zeros(len(self.feature_), dtype=np.intp)
+        for k in np.flatnonzero(self.feature_ != TREE_LEAF):
+            depth[self.left_[k]] = depth[self.right_[k]] = depth[k] + 1
+        return depth
+
+    def average_path_length(self, X):
+        # Số phép so sánh trung bình để 1 dòng của X đi tới lá
+        return float(np.mean(self.node_depths()[self.apply(X)]))
+
+    def node_counts(self, X, y):
+        """
+        Số mẫu theo từng class đi qua mỗi node khi đưa (X, y) qua cây, cùng
+        shape với proba_: (n_nodes, n_classes) hoặc (n_nodes, n_outputs, 2)
+        """
+        leaf_ids = self.apply(X)
+        y_encoded = np.searchsorted(self.classes_, np.asarray(y))
+        counts = np.zeros(self.proba_.shape, dtype=np.int64)
+        if y_encoded.ndim == 1:
+            np.add.at(counts, (leaf_ids, y_encoded), 1)
+        else:
+            np.add.at(counts, (leaf_ids[:, None], np.arange(y_encoded.shape[1]), y_encoded), 1)
+        for k in np.flatnonzero(self.feature_ != TREE_LEAF)[::-1]:
+            counts[k] = counts[self.left_[k]] + counts[self.right_[k]]
+        return counts
+
+    @staticmethod
+    def _node_risk(counts):
+        """
+        R(t) của từng node nếu nó là lá: Gini (cộng qua các đầu ra) x tỉ lệ mẫu đi qua node
+        """
+        counts = counts.reshape(len(counts), -1, counts.shape[-1])
+        n = counts.sum(axis=-1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            gini = np.nan_to_num(1 - np.sum((counts / n[..., None]) ** 2, axis=-1))
+        return gini.sum(axis=1) * n[:, 0] / n[0, 0]
+
+    def _collapsed(self, is_leaf, counts, value=None):
+        """
+        Cây mới trong đó mọi node có is_leaf = True thành lá (bỏ cây con bên dưới).
+        Node được gộp lấy value/proba từ counts (value truyền vào thì ưu tiên).
+        Id node đánh lại theo đúng thứ tự _grow_tree (2 con liền nhau, nhánh trái trước)
+        """
+        arrays = self.to_arrays()
+        new_id = np.full(len(is_leaf), TREE_LEAF, dtype=np.intp)
+        new_id[0] = 0
+        order, stack = [0], [0]
+        while stack:
+            k = stack.pop()
+            if is_leaf[k]:
+                continue
+            left, right = arrays["left_"][k], arrays["right_"][k]
+            new_id[left], new_id[right] = len(order), len(order) + 1
+            order += [left, right]
+            stack += [right, left]
+
+        order = np.array(order, dtype=np.intp)
+        leaf = is_leaf[order]
+        pruned = {
+            "feature_": np.where(leaf, TREE_LEAF, arrays["feature_"][order]),
+            "threshold_": np.where(leaf, 0.0, arrays["threshold_"][order]),
+            "left_": np.where(leaf, TREE_LEAF, new_id[arrays["left_"][order]]),
+            "right_": np.where(leaf, TREE_LEAF, new_id[arrays["right_"][order]]),
+            "value_": arrays["value_"][order].copy(),
+            "proba_": arrays["proba_"][order].copy(),
+            "classes_": arrays["classes_"],
+        }
+        for i in np.flatnonzero(leaf & (arrays["feature_"][order] != TREE_LEAF)):
+            pruned["value_"][i], pruned["proba_"][i] = self._leaf_values(counts[order[i]])
+            if value is not None:
+                pruned["value_"][i] = value[order[i]]
+        return type(self).from_arrays(pruned)
+
+    def prune_same_label(self, X, y):
+        """
+        Gộp các cây con mà mọi lá dự đoán cùng 1 nhãn thành 1 lá: nhãn dự đoán
+        không đổi, chỉ bớt node và phép so sánh. (X, y) là dữ liệu huấn luyện,
+        dùng để tính xác suất của lá mới
+        """
+        counts = self.node_counts(X, y)
+        is_leaf = self.feature_ == TREE_LEAF
+        value = self.value_.copy()
+        for k in np.flatnonzero(~is_leaf)[::-1]:
+            left, right = self.left_[k], self.right_[k]
+            if is_leaf[left] and is_leaf[right] and np.array_equal(value[left], value[right]):
+                is_leaf[k] = True
+                value[k] = value[left]
+        return self._collapsed(is_leaf, counts, value)
+
+    def _pruning_steps(self, counts):
+        """
+        Dãy cắt tỉa cost-complexity (weakest link, CART) từ counts của node_counts:
+        mỗi bước gộp các node t có g(t) = (R(t) - R(cây con của t)) / (số lá của
+        cây con - 1) nhỏ nhất. Không dựng cây cho từng bước, chỉ ghi bước mà
+        mỗi node thành lá. Khi gộp 1 node chỉ cập nhật R / số lá của các node
+        tổ tiên, g lấy từ heap nên mỗi bước không phải duyệt lại cả cây.
+        Trả về (alphas, prune_step, n_nodes): bước i có alpha alphas[i] và
+        n_nodes[i] node (bước 0 là cây gốc); node k là lá ở bước i khi prune_step[k] <= i
+        """
+        risk = self._node_risk(counts)
+        n = len(self.feature_)
+        is_leaf = self.feature_ == TREE_LEAF
+        internal = np.flatnonzero(~is_leaf)
+        parent = np.full(n, TREE_LEAF, dtype=np.intp)
+        parent[self.left_[internal]] = internal
+        parent[self.right_[internal]] = internal
+
+        subtree_risk = risk.copy()
+        n_leaves = np.ones(n, dtype=np.intp)
+        for k in internal[::-1]:
+            left, right = self.left_[k], self.right_[k]
+            subtree_risk[k] = subtree_risk[left] + subtree_risk[right]
+            n_leaves[k] = n_leaves[left] + n_leaves[right]
+
+        def weakness(k):
+            return (risk[k] - subtree_risk[k]) / (n_leaves[k] - 1)
+
+        g = np.full(n, np.inf)
+        g[internal] = (risk[internal] - subtree_risk[internal]) / (n_leaves[internal] - 1)
+        heap = [(g[k], k) for k in internal.tolist()]
+        heapq.heapify(heap)
+        # Node còn nằm trong cây (chưa bị gộp vào lá phía trên)
+        reachable = np.ones(n, dtype=bool)
+        prune_step = np.where(is_leaf, 0, np.iinfo(np.intp).max)
+        alphas, n_nodes = [0.0], [n]
+
+        def stale(entry):
+            weak, k = entry
+            return is_leaf[k] or not reachable[k] or weak != g[k]
+
+        while not is_leaf[0]:
+            while stale(heap[0]):
+                heapq.heappop(heap)
+            alpha = max(float(heap[0][0]), 0.0)
+            weakest = set()
+            while heap and heap[0][0] <= alpha + 1e-12:
+                entry = heapq.heappop(heap)
+                if not stale(entry):
+                    weakest.add(entry[1])
+
+            step, removed = len(alphas), 0
+            # Con có id lớn hơn cha: gộp node sâu trước rồi tới tổ tiên của nó
+            for k in sorted(weakest, reverse=True):
+                removed += 2 * (n_leaves[k] - 1)
+                is_leaf[k] = True
+                prune_step[k] = step
+                subtree_risk[k], n_leaves[k] = risk[k], 1
+                stack = [self.left_[k], self.right_[k]]
+                while stack:
+                    d = stack.pop()
+                    if reachable[d] and self.feature_[d] != TREE_LEAF:
+                        stack += [self.left_[d], self.right_[d]]
+                    reachable[d] = False
+                a = parent[k]
+                while a != TREE_LEAF:
+                    left, right = self.left_[a], self.right_[a]
+                    subtree_risk[a] = subtree_risk[left] + subtree_risk[right]
+                    n_leaves[a] = n_leaves[left] + n_leaves[right]
+                    g[a] = weakness(a)
+                    heapq.heappush(heap, (g[a], a))
+                    a = parent[a]
+            alphas.append(alpha)
+            n_nodes.append(n_nodes[-1] - removed)
+        return np.array(alphas), prune_step, np.array(n_nodes)
+
+    def pruning_path(self, X, y):
+        """
+        Dãy cắt tỉa cost-complexity trên dữ liệu huấn luyện (X, y): list
+        (alpha, số node) theo alpha tăng dần, phần tử đầu là cây gốc.
+        Cây ứng với 1 alpha lấy bằng prune_cost_complexity
+        """
+        alphas, _, n_nodes = self._pruning_steps(self.node_counts(X, y))
+        return list(zip(alphas.tolist(), n_nodes.tolist()))
+
+    def prune_cost_complexity(self, X, y, alpha):
+        """
+        Cây con nhỏ nhất tối thiểu R(T) + alpha * số lá (X, y là dữ liệu huấn luyện)
+        """
+        counts = self.node_counts(X, y)
+        alphas, prune_step, _ = self._pruning_steps(counts)
+        step = np.flatnonzero(alphas <= alpha)[-1]
+        return self._collapsed(prune_step <= step, counts)
+
+    def pruning_path_scores(self, X, y, X_val, y_val):
+        """
+        Accuracy trên (X_val, y_val) và độ dài đường đi trung bình của cây ở
+        từng bước của dãy cắt tỉa trên (X, y), trong 1 lần duyệt X_val: ở bước i
+        mỗi dòng dừng tại node đầu tiên trên đường đi có prune_step <= i.
+        Trả về list dict (alpha, n_nodes, val_accuracy, avg_path_length) theo từng bước
+        """
+        counts = self.node_counts(X, y)
+        alphas, prune_step, n_nodes = self._pruning_steps(counts)
+        n_steps = len(alphas)
+
+        # Nhãn của mỗi node nếu nó là lá (node bị gộp lấy nhãn từ counts như _collapsed)
+        value = self.value_.copy()
+        for k in np.flatnonzero(self.feature_ != TREE_LEAF):
+            value[k] = self._leaf_values(counts[k])[0]
+        y_val = np.asarray(y_val)
+
+        # Đường đi của từng dòng: path[d] = node ở độ sâu d (dòng đã tới lá giữ nguyên node)
+        X_val = np.asarray(X_val, dtype=np.float64)
+        node_ids = np.zeros(len(X_val), dtype=np.intp)
+        path = [node_ids.copy()]
+        active = np.flatnonzero(self.feature_[node_ids] != TREE_LEAF)
+        while active.size:
+            nodes = node_ids[active]
+            go_left = X_val[active, self.feature_[nodes]] <= self.threshold_[nodes]
+            node_ids[active] = np.where(go_left, self.left_[nodes], self.right_[nodes])
+            active = active[self.feature_[node_ids[active]] != TREE_LEAF]
+            path.append(node_ids.copy())
+        path = np.array(path)
+
+        # Node ở độ sâu d là lá cho các bước [first[d], first[d - 1])
+        first = np.minimum.accumulate(prune_step[path], axis=0)
+        upper = np.vstack([np.full((1, len(X_val)), n_steps), first[:-1]])
+        depth, row = np.nonzero(first < upper)
+        nodes = path[depth, row]
+        if value.ndim == 1:
+            hit = self.classes_[value[nodes]] == y_val[row]
+        else:
+            hit = np.all(self.classes_[value[nodes]] == y_val[row], axis=1)
+        per_step = np.zeros((2, n_steps + 1))
+        for i, weight in enumerate((hit.astype(np.float64), depth.astype(np.float64))):
+            np.add.at(per_step[i], first[depth, row], weight)
+            np.add.at(per_step[i], upper[depth, row], -weight)
+        per_step = np.cumsum(per_step[:, :n_steps], axis=1) / len(X_val)
+        return [
+            {"alpha": float(alphas[i]), "n_nodes": int(n_nodes[i]),
+             "val_accuracy": float(per_step[0, i]), "avg_path_length": float(per_step[1, i])}
+            for i in range(n_steps)
+        ]
+
+    def _check_fitted(self):
+        if self.feature_ is None:
+            raise ValueError(f"{type(self).__name__} is not fitted yet, call fit() first")
+
+    def apply(self, X):
+        """
+        Trả về id node lá cho từng dòng của X. Mỗi vòng lặp đẩy tất cả
+        các dòng chưa tới lá xuống một tầng bằng fancy indexing,
+        nên số vòng lặp Python = độ sâu cây thay vì số dòng x độ sâu
+        """
+        self._check_fitted()
+        X = np.asarray(X, dtype=np.float64)
+        node_ids = np.zeros(X.shape[0], dtype=np.intp)
+        active = np.flatnonzero(self.feature_[node_ids] != TREE_LEAF)
+        while active.size:
+            nodes = node_ids[active]
+            go_left = X[active, self.feature_[nodes]] <= self.threshold_[nodes]
+            node_ids[active] = np.where(go_left, self.left_[nodes], self.right_[nodes])
+            active = active[self.feature_[node_ids[active]] != TREE_LEAF]
+        return node_ids
+
+    def predict_with_proba(self, X):
+        """
+        Duyệt cây 1 lần, trả về (nhãn, ma trận xác suất (n_samples, n_classes)
+        theo thứ tự classes_, id node lá)
+        """
+        leaf_ids = self.apply(X)
+        return self.classes_[self.value_[leaf_ids]], self.proba_[leaf_ids], leaf_ids
 
-        if best_gain == 0: return None, None # Không có gain nào dương
-        return split_idx, split_threshold
+    def predict(self, X):
+        leaf_ids = self.apply(X)
+        return self.classes_[self.value_[leaf_ids]]
 
-    def _information_gain(self, y, X_column, threshold):
-        # Gini của cha
-        parent_gini = self._gini(y)
+    def predict_proba(self, X):
+        # Ma trận xác suất (n_samples, n_classes), cột theo thứ tự classes_
+        leaf_ids = self.apply(X)
+        return self.proba_[leaf_ids]
 
-        # Tạo split
-        left_idxs, right_idxs = self._split(X_column, threshold)
-        if len(left_idxs) == 0 or len(right_idxs) == 0:
-            return 0
 
-        # Gini có trọng số của con
-        n = len(y)
-        n_l, n_r = len(left_idxs), len(right_idxs)
-        e_l, e_r = self._gini(y[left_idxs]), self._gini(y[right_idxs])
-        child_gini = (n_l / n) * e_l + (n_r / n) * e_r
+class MultiOutputDecisionTree(SimpleDecisionTree):
+    """
+    1 cây cho nhiều nhãn nhị phân (0/1) cùng lúc: mỗi lá lưu vector nhãn,
+    split chọn theo tổng Gini của tất cả các đầu ra. Dùng thay cho
+    SimpleMultiLabelModel (5 cây riêng) khi muốn 1 lần duyệt cây ra đủ 5 cờ vấn đề.
+    predict trả ma trận (n_samples, n_outputs), predict_proba trả
+    (n_samples, n_outputs, 2) - xác suất nhãn 0 và 1 của từng đầu ra
+    """
+    def _encode_labels(self, y):
+        y = np.asarray(y)
+        if y.ndim != 2 or not np.isin(y, (0, 1)).all():
+            raise ValueError("MultiOutputDecisionTree expects a (n_samples, n_outputs) matrix of 0/1 labels")
+        return np.array([0, 1], dtype=y.dtype), y.astype(np.int64)
+
+    def _class_counts(self, y):
+        # (n_outputs, 2): số mẫu nhãn 0 / nhãn 1 của từng đầu ra
+        pos = y.sum(axis=0)
+        return np.column_stack([len(y) - pos, pos])
+
+    def _leaf_values(self, counts):
+        return np.argmax(counts, axis=1), counts / counts.sum(axis=1, keepdims=True)
+
+    @staticmethod
+    def _gini_sum(pos, n):
+        """
+        Tổng Gini của các đầu ra nhị phân, nhân với số mẫu n:
+        n * sum_o 2p(1-p) = 2 * sum_o pos * (n - pos) / n. pos (..., n_outputs), n (...)
+        """
+        return 2 * np.sum(pos * (n[..., None] - pos), axis=-1) / n
+
+    def _best_cut(self, left_n, left_pos, parent_pos, n_samples):
+        """
+        (vị trí cắt tốt nhất, gain) từ số mẫu + số nhãn 1 của nhánh trái ở mọi vị trí cắt
+        """
+        parent_gini = self._gini_sum(parent_pos, np.asarray(n_samples)) / n_samples
+        child_gini = (
+            self._gini_sum(left_pos, left_n) + self._gini_sum(parent_pos - left_pos, n_samples - left_n)
+        ) / n_samples
+        best = np.argmin(child_gini)
+        return best, parent_gini - child_gini[best]
 
-        return parent_gini - child_gini
+    def _best_split(self, X, y, feat_idxs):
+        # Giống SimpleDecisionTree._best_split: sort 1 lần mỗi feature, cộng dồn số nhãn 1 của từng đầu ra
+        n_samples = len(y)
+        parent_pos = y.sum(axis=0)
 
-    def _split(self, X_column, split_thresh):
-        left_idxs = np.argwhere(X_column <= split_thresh).flatten()
-        right_idxs = np.argwhere(X_column > split_thresh).flatten()
-        return left_idxs, right_idxs
+        best_gain = 0
+        split_idx, split_threshold = None, None
 
-    def _gini(self, y):
-        # 1 - sum(p^2)
-        _, counts = np.unique(y, return_counts=True)
-        probabilities = counts / len(y)
-        return 1 - np.sum(probabilities ** 2)
+        for feat_idx in feat_idxs:
+            order = np.argsort(X[:, feat_idx], kind="stable")
+            x_sorted = X[order, feat_idx]
+            cut_pos = np.flatnonzero(x_sorted[:-1] < x_sorted[1:])
+            if cut_pos.size == 0:
+                continue
+
+            left_pos = np.cumsum(y[order], axis=0)[cut_pos]
+            best, gain = self._best_cut(cut_pos + 1, left_pos, parent_pos, n_samples)
+            if gain > best_gain:
+                best_gain = gain
+                split_idx = feat_idx
+                pos = cut_pos[best]
+                split_threshold = (x_sorted[pos] + x_sorted[pos + 1]) / 2
+                if split_threshold >= x_sorted[pos + 1]:
+                    split_threshold = x_sorted[pos]
 
-    def predict(self, X):
-        return np.array([self._traverse_tree(x, self.root) for x in X])
+        return split_idx, split_threshold
 
-    def predict_proba(self, X):
-        # Trả về list các dict xác suất {label: prob}
-        return [self._traverse_tree_proba(x, self.root) for x in X]
-
-    def _traverse_tree(self, x, node):
-        if node.is_leaf_node():
-            return node.value
-        if x[node.feature] <= node.threshold:
-            return self._traverse_tree(x, node.left)
-        return self._traverse_tree(x, node.right)
-    
-    def _traverse_tree_proba(self, x, node):
-        if node.is_leaf_node():
-            return node.proba
-        if x[node.feature] <= node.threshold:
-            return self._traverse_tree_proba(x, node.left)
-        return self._traverse_tree_proba(x, node.right)
+    def _best_split_binned(self, X_binned, y, idxs, feat_idxs, parent_counts):
+        y_node = y[idxs]
+        n_samples, n_outputs = y_node.shape
+        parent_pos = parent_counts[:, 1]
+        output_ids = np.arange(n_outputs)
+
+        best_gain = 0
+        split_idx, split_bin = None, None
+
+        for feat_idx in feat_idxs:
+            n_bins = len(self.bin_edges_[feat_idx]) + 1
+            bins = X_binned[idxs, feat_idx].astype(np.intp)
+            # Histogram theo bin: số mẫu (n_bins,) và số nhãn 1 của từng đầu ra (n_bins, n_outputs)
+            bin_n = np.bincount(bins, minlength=n_bins)
+            bin_pos = np.bincount(
+                (bins[:, None] * n_outputs + output_ids).ravel(),
+                weights=y_node.ravel(),
+                minlength=n_bins * n_outputs,
+            ).reshape(n_bins, n_outputs)
+
+            left_n = np.cumsum(bin_n)[:-1]
+            cut_bins = np.flatnonzero((left_n > 0) & (left_n < n_samples))
+            if cut_bins.size == 0:
+                continue
+            left_pos = np.cumsum(bin_pos, axis=0)[:-1][cut_bins]
+            best, gain = self._best_cut(left_n[cut_bins], left_pos, parent_pos, n_samples)
+            if gain > best_gain:
+                best_gain = gain
+                split_idx = feat_idx
+                split_bin = cut_bins[best]
+
+        return split_idx, split_bin
+
+    def score(self, X, y):
+        # Cùng cách tính với SimpleMultiLabelModel.score: đúng hết các nhãn mới tính là đúng
+        return np.mean(np.all(self.predict(X) == y, axis=1))
 
 
 class SimpleMultiLabelModel:
@@ -156,19 +817,38 @@ class SimpleMultiLabelModel:
     Model đa nhãn tự xây dựng (Binary Relevance):
     Huấn luyện N cây quyết định riêng biệt cho N cột nhãn đầu ra
     """
-    def __init__(self, max_depth=15):
+    def __init__(self, max_depth=15, max_bins=None, n_jobs=1, random_state=None):
         self.models = []
         self.max_depth = max_depth
+        self.max_bins = check_max_bins(max_bins)
+        self.n_jobs = n_jobs
+        self.random_state = random_state
 
     def fit(self, X, y):
         # y là matrix (n_samples, n_labels)
-        self.models = []
+        self.models = fit_parallel(self.tree_jobs(X, y), self.n_jobs)
+        return self
+
+    def tree_jobs(self, X, y):
+        """
+        Danh sách job (cây, tên hàm fit, tham số) cho từng cột nhãn, để
+        train_models gom chung với các cây khác vào 1 process pool
+        """
         n_labels = y.shape[1]
+        seeds = np.random.SeedSequence(self.random_state).spawn(n_labels)
+        if self.max_bins:
+            # Lượng tử hóa X 1 lần, dùng chung cho tất cả các cây
+            bin_edges = compute_bin_edges(X, self.max_bins)
+            X_binned = bin_features(X, bin_edges)
+        jobs = []
         for i in range(n_labels):
             y_col = y[:, i]
-            tree = SimpleDecisionTree(max_depth=self.max_depth)
-            tree.fit(X, y_col)
-            self.models.append(tree)
+            tree = SimpleDecisionTree(max_depth=self.max_depth, random_state=seeds[i])
+            if self.max_bins:
+                jobs.append((tree, "fit_binned", (X_binned, y_col, bin_edges)))
+            else:
+                jobs.append((tree, "fit", (X, y_col)))
+        return jobs
 
     def predict(self, X):
         # Kết quả trả về matrix (n_samples, n_labels)
@@ -177,6 +857,11 @@ class SimpleMultiLabelModel:
             preds.append(tree.predict(X))
         return np.column_stack(preds)
 
+    def fuse_scaler(self, mean, scale):
+        fused = SimpleMultiLabelModel(max_depth=self.max_depth)
+        fused.models = [tree.fuse_scaler(mean, scale) for tree in self.models]
+        return fused
+
     def score(self, X, y):
         # Tính accuracy đơn giản: đúng hết các nhãn mới tính là đúng
         preds = self.predict(X)
@@ -184,337 +869,345 @@ class SimpleMultiLabelModel:
         return np.mean(correct)
 
 
+def bootstrap_indices(boot_seed, n_samples):
+    """Chỉ số mẫu bootstrap (rút có hoàn lại n_samples dòng) sinh từ boot_seed"""
+    return np.random.default_rng(boot_seed).integers(0, n_samples, n_samples)
+
+
+class SimpleRandomForest:
+    """
+    Rừng ngẫu nhiên (bagging) từ SimpleDecisionTree: mỗi cây học trên 1 mẫu
+    bootstrap và chỉ xét max_features feature ngẫu nhiên ở mỗi node.
+    Confidence = trung bình xác suất lá của tất cả các cây (soft voting),
+    ổn định hơn xác suất lá của 1 cây sâu. Cùng giao diện dự đoán với
+    SimpleDecisionTree (predict_with_proba, predict, predict_proba, fuse_scaler)
+    """
+    def __init__(self, n_estimators=50, max_depth=15, min_samples_split=2, max_features="sqrt",
+                 max_bins=None, n_jobs=1, random_state=None):
+        self.n_estimators = n_estimators
+        self.max_depth = max_depth
+        self.min_samples_split = min_samples_split
+        self.max_features = max_features
+        self.max_bins = check_max_bins(max_bins)
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.estimators_ = []
+        self.oob_score_ = None
+
+    def _n_features(self, n_feats):
+        if self.max_features == "sqrt":
+            return max(1, int(np.sqrt(n_feats)))
+        if self.max_features is None:
+            return n_feats
+        return min(n_feats, int(self.max_features))
+
+    def tree_jobs(self, X, y):
+        """
+        Danh sách job (cây, tên hàm fit, tham số) cho từng cây. Job chỉ mang
+        seed bootstrap, mẫu được rút trong process huấn luyện nên không có
+        n_estimators bản copy của X cùng lúc. Seed được giữ lại để finish_fit
+        sinh lại mẫu và tính độ chính xác out-of-bag
+        """
+        n_features = self._n_features(X.shape[1])
+        if self.max_bins:
+            bin_edges = compute_bin_edges(X, self.max_bins)
+            X_binned = bin_features(X, bin_edges)
+        self._bootstrap_seeds = []
+        jobs = []
+        for seed in np.random.SeedSequence(self.random_state).spawn(self.n_estimators):
+            boot_seed, tree_seed = seed.spawn(2)
+            self._bootstrap_seeds.append(boot_seed)
+            tree = SimpleDecisionTree(
+                min_samples_split=self.min_samples_split, max_depth=self.max_depth,
+                n_features=n_features, random_state=tree_seed,
+            )
+            if self.max_bins:
+                jobs.append((tree, "fit_bootstrap", (X_binned, y, boot_seed, bin_edges)))
+            else:
+                jobs.append((tree, "fit_bootstrap", (X, y, boot_seed)))
+        return jobs
+
+    def finish_fit(self, trees, X, y):
+        """
+        Gắn các cây đã fit (theo thứ tự tree_jobs) và tính oob_score_: mỗi
+        dòng chỉ được chấm bởi các cây không thấy nó trong mẫu bootstrap
+        """
+        self.estimators_ = list(trees)
+        self.classes_ = np.unique(y)
+        self._stack()
+
+        n_samples = len(y)
+        oob_proba = np.zeros((n_samples, len(self.classes_)))
+        for k, (tree, boot_seed) in enumerate(zip(self.estimators_, self._bootstrap_seeds)):
+            in_bag = np.bincount(bootstrap_indices(boot_seed, n_samples), minlength=n_samples)
+            oob = np.flatnonzero(in_bag == 0)
+            leaf_ids = tree.apply(X[oob]) + self.offsets_[k]
+            oob_proba[oob] += self.proba_[leaf_ids]
+        del self._bootstrap_seeds
+
+        voted = oob_proba.sum(axis=1) > 0
+        self.oob_score_ = float(np.mean(self.classes_[oob_proba[voted].argmax(axis=1)] == y[voted])) if voted.any() else None
+        return self
+
+    def fit(self, X, y):
+        return self.finish_fit(fit_parallel(self.tree_jobs(X, y), self.n_jobs), X, y)
+
+    @classmethod
+    def from_trees(cls, trees):
+        """
+        Tạo rừng chỉ để dự đoán từ các cây đã compile (ví dụ load từ artifact)
+        """
+        forest = cls(n_estimators=len(trees))
+        forest.estimators_ = list(trees)
+        forest.classes_ = np.unique(np.concatenate([tree.classes_ for tree in trees]))
+        forest._stack()
+        return forest
+
+    def _stack(self):
+        """
+        Nối mảng compiled của tất cả các cây thành 1 bộ mảng phẳng (id node cộng
+        offset của cây) để duyệt mọi cây cùng lúc. Cột của proba_ theo classes_
+        của rừng: cây nào thiếu class trong mẫu bootstrap thì cột đó = 0
+        """
+        arrays = [tree.to_arrays() for tree in self.estimators_]
+        sizes = np.array([len(a["feature_"]) for a in arrays])
+        self.offsets_ = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.intp)
+
+        self.feature_ = np.concatenate([a["feature_"] for a in arrays]).astype(np.intp)
+        self.threshold_ = np.concatenate([a["threshold_"] for a in arrays]).astype(np.float64)
+        children = []
+        for name in ("left_", "right_"):
+            child = np.concatenate([a[name] for a in arrays]).astype(np.intp)
+            child += np.where(child != TREE_LEAF, np.repeat(self.offsets_, sizes), 0)
+            children.append(child)
+        self.left_, self.right_ = children
+
+        self.proba_ = np.zeros((sizes.sum(), len(self.classes_)))
+        for a, offset, size in zip(arrays, self.offsets_, sizes):
+            columns = np.searchsorted(self.classes_, a["classes_"])
+            self.proba_[offset:offset + size, columns] = a["proba_"]
+
+    def apply(self, X):
+        """
+        Id node lá (trong mảng đã nối) của từng dòng trên từng cây, shape
+        (n_estimators, n_samples). Giống SimpleDecisionTree.apply nhưng duyệt
+        n_estimators x n_samples cặp (cây, dòng) cùng lúc: số vòng lặp Python
+        = độ sâu của cây sâu nhất
+        """
+        X = np.asarray(X, dtype=np.float64)
+        n_samples = X.shape[0]
+        node_ids = np.repeat(self.offsets_, n_samples)
+        rows = np.tile(np.arange(n_samples), len(self.offsets_))
+        active = np.flatnonzero(self.feature_[node_ids] != TREE_LEAF)
+        while active.size:
+            nodes = node_ids[active]
+            go_left = X[rows[active], self.feature_[nodes]] <= self.threshold_[nodes]
+            node_ids[active] = np.where(go_left, self.left_[nodes], self.right_[nodes])
+            active = active[self.feature_[node_ids[active]] != TREE_LEAF]
+        return node_ids.reshape(len(self.offsets_), n_samples)
+
+    def predict_with_proba(self, X):
+        leaf_ids = self.apply(X)
+        proba = self.proba_[leaf_ids].mean(axis=0)
+        return self.classes_[proba.argmax(axis=1)], proba, leaf_ids
+
+    def predict(self, X):
+        return self.predict_with_proba(X)[0]
+
+    def predict_proba(self, X):
+        return self.predict_with_proba(X)[1]
+
+    def fuse_scaler(self, mean, scale):
+        fused = SimpleRandomForest.from_trees([tree.fuse_scaler(mean, scale) for tree in self.estimators_])
+        fused.oob_score_ = self.oob_score_
+        return fused
+
+
+def _run_fit_job(estimator, method, args):
+    # Hàm top-level để pickle được khi chạy trong process pool
+    return getattr(estimator, method)(*args)
+
+
+def _process_pool_context():
+    # Không fork: process có thể đang chạy các thread khác (Flask, event loop ASGI,
+    # coalescer, thread nền của /retrain) -> process con fork ra có thể kẹt ở lock
+    # mà thread khác đang giữ. Import module không load model nên spawn rẻ
+    start_methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in start_methods else "spawn")
+
+
+def fit_parallel(jobs, n_jobs=1):
+    """
+    Huấn luyện các job (estimator, tên hàm fit, tham số) độc lập trên
+    process pool, trả về các estimator đã fit theo đúng thứ tự jobs.
+    Mỗi cây có seed riêng nên kết quả giống hệt khi chạy tuần tự.
+    Chạy tuần tự khi tổng số dòng (X là tham số đầu của mọi hàm fit) dưới
+    TRAIN_PARALLEL_MIN_ROWS; số worker không vượt quá số core
+    """
+    n_jobs = min(n_jobs or 1, len(jobs), os.cpu_count() or 1)
+    total_rows = sum(len(args[0]) for _, _, args in jobs)
+    if n_jobs <= 1 or total_rows < TRAIN_PARALLEL_MIN_ROWS:
+        return [_run_fit_job(*job) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=_process_pool_context()) as pool:
+        futures = [pool.submit(_run_fit_job, *job) for job in jobs]
+        return [future.result() for future in futures]
+
+
 # ============================================
-# 1. TRAINING DATA GENERATOR (GIỮ NGUYÊN)
+# 1. TRAINING DATA GENERATOR
 # ============================================
 
-def generate_training_data():
+# Mỗi kịch bản: (số mẫu, co2, co, pm25, temperature, humidity, chất lượng, nhãn vấn đề)
+# - Khoảng giá trị (min, max); độ ẩm có thể gồm 2 khoảng (chọn ngẫu nhiên 1 trong 2)
+# - Nhãn vấn đề theo thứ tự [CO2, CO, PM2.5, Nhiệt độ, Độ ẩm]
+HUM_MODERATE = ((65, 70), (85, 92))   # hơi khô / hơi ẩm
+HUM_POOR = ((10, 40), (80, 100))      # <65 hoặc >92 = Poor
+
+TRAINING_SCENARIOS = [
+    # CASE 1: TỐT (500 samples)
+    (500, (350, 800), (0, 5), (0, 25), (25, 30), (50, 70), "Tốt", [0, 0, 0, 0, 0]),
+
+    # CASE 2: TRUNG BÌNH (1,200 samples)
+    # 2a. Tất cả sensors ở mức "Tốt" NHƯNG gần ngưỡng, tổng hợp lại "hơi khó chịu"
+    (200, (750, 850), (4, 6), (20, 30), (29, 31), (68, 87), "Trung bình", [0, 0, 0, 0, 0]),
+    # 2b. Individual sensors (đơn lẻ): CO2 / CO / PM2.5 / Nhiệt độ / Độ ẩm hơi cao
+    (150, (800, 1000), (0, 5), (0, 25), (25, 30), (70, 85), "Trung bình", [0, 0, 0, 0, 0]),
+    (150, (400, 800), (5, 9), (0, 25), (25, 30), (70, 85), "Trung bình", [0, 0, 0, 0, 0]),
+    (150, (400, 800), (0, 5), (25, 35), (25, 30), (70, 85), "Trung bình", [0, 0, 0, 0, 0]),
+    (150, (400, 800), (0, 5), (0, 25), (30, 34), (70, 85), "Trung bình", [0, 0, 0, 0, 0]),
+    (150, (400, 800), (0, 5), (0, 25), (25, 30), HUM_MODERATE, "Trung bình", [0, 0, 0, 0, 0]),
+    # 2c. Combinations (2 sensors): CO2+CO, CO2+PM2.5, CO2+Temp, CO+PM2.5, PM2.5+Temp
+    (50, (800, 1000), (5, 9), (0, 25), (25, 30), (70, 85), "Trung bình", [0, 0, 0, 0, 0]),
+    (50, (800, 1000), (0, 5), (25, 35), (25, 30), (70, 85), "Trung bình", [0, 0, 0, 0, 0]),
+    (50, (800, 1000), (0, 5), (0, 25), (30, 34), (70, 85), "Trung bình", [0, 0, 0, 0, 0]),
+    (50, (400, 800), (5, 9), (25, 35), (25, 30), (70, 85), "Trung bình", [0, 0, 0, 0, 0]),
+    (50, (400, 800), (0, 5), (25, 35), (30, 34), (70, 85), "Trung bình", [0, 0, 0, 0, 0]),
+
+    # CASE 3: KÉM - INDIVIDUAL SENSORS (CO2 >1000, CO >9, PM2.5 >35, Temp >34, Độ ẩm)
+    (150, (1000, 2500), (0, 5), (0, 30), (25, 30), (70, 85), "Kém", [1, 0, 0, 0, 0]),
+    (150, (400, 800), (9, 50), (0, 30), (25, 30), (70, 85), "Kém", [0, 1, 0, 0, 0]),
+    (150, (400, 800), (0, 5), (35, 100), (25, 30), (70, 85), "Kém", [0, 0, 1, 0, 0]),
+    (150, (400, 800), (0, 5), (0, 30), (34, 40), (70, 85), "Kém", [0, 0, 0, 1, 0]),
+    (150, (400, 800), (0, 5), (0, 30), (25, 30), HUM_POOR, "Kém", [0, 0, 0, 0, 1]),
+
+    # CASE 4: KÉM - COMBINATIONS (2 sensors)
+    (100, (1000, 2500), (9, 50), (0, 30), (25, 30), (70, 85), "Kém", [1, 1, 0, 0, 0]),
+    (100, (1000, 2500), (0, 5), (35, 100), (25, 30), (70, 85), "Kém", [1, 0, 1, 0, 0]),
+    (100, (1000, 2500), (0, 5), (0, 30), (34, 40), (70, 85), "Kém", [1, 0, 0, 1, 0]),
+    (100, (400, 800), (9, 50), (35, 100), (25, 30), (70, 85), "Kém", [0, 1, 1, 0, 0]),
+    (100, (400, 800), (0, 5), (35, 100), (34, 40), (70, 85), "Kém", [0, 0, 1, 1, 0]),
+
+    # CASE 5: KÉM - COMBINATIONS (3 sensors)
+    (100, (1000, 2500), (9, 50), (35, 100), (25, 30), (70, 85), "Kém", [1, 1, 1, 0, 0]),
+    (100, (1000, 2500), (9, 50), (0, 30), (34, 40), (70, 85), "Kém", [1, 1, 0, 1, 0]),
+
+    # CASE 6: KÉM - ALL SENSORS (vượt ngưỡng nghiêm trọng)
+    (200, (1500, 3000), (15, 50), (75, 200), (36, 40), HUM_POOR, "Kém", [1, 1, 1, 1, 0]),
+]
+
+# co2 và pm25 là số nguyên trong [min, max), các feature còn lại là số thực
+INTEGER_FEATURES = np.array([True, False, True, False, False])
+
+
+def generate_training_data(scale=1.0, random_state=42):
     """
     Tạo dữ liệu huấn luyện - ĐIỀU CHỈNH CHO KHÍ HẬU TP.HCM
     - Nhiệt độ: 25-40°C (thay vì 20-60°C)
     - Độ ẩm: 70-85% (thay vì 40-90%)
     - PM2.5: Ngưỡng cao hơn (do ô nhiễm thực tế)
     - THÊM: Cases "Trung bình" chi tiết (individual + combinations)
+
+    Sinh toàn bộ dữ liệu từ bảng TRAINING_SCENARIOS bằng các phép toán
+    vector trên 1 np.random.Generator riêng (không đụng global RNG).
+    scale nhân số mẫu của mọi kịch bản (scale=1000 -> ~3,35 triệu dòng)
     """
-    np.random.seed(42)
-    data = []
-    labels_quality = []
-    labels_problems = []
+    rng = np.random.default_rng(random_state)
 
-    # ============================================
-    # CASE 1: TỐT (500 samples)
-    # ============================================
-    for _ in range(500):
-        co2 = np.random.randint(350, 800)
-        co = np.random.uniform(0, 5)
-        pm25 = np.random.randint(0, 25)
-        temp = np.random.uniform(25, 30)
-        hum = np.random.uniform(50, 70)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Tốt")
-        labels_problems.append([0, 0, 0, 0, 0])
-
-    # ============================================
-    # CASE 2: TRUNG BÌNH (1,200 samples)
-    # ============================================
-    
-    # 2a. Tất cả sensors ở mức "Tốt" NHƯNG tổng hợp lại "hơi khó chịu" (200 samples)
-    for _ in range(200):
-        co2 = np.random.randint(750, 850)      # Gần ngưỡng
-        co = np.random.uniform(4, 6)           # Gần ngưỡng
-        pm25 = np.random.randint(20, 30)       # Gần ngưỡng
-        temp = np.random.uniform(29, 31)       # Gần ngưỡng
-        hum = np.random.uniform(68, 87)        # Gần ngưỡng
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Trung bình")
-        labels_problems.append([0, 0, 0, 0, 0])
-
-    # ============================================
-    # CASE 2B: TRUNG BÌNH - INDIVIDUAL SENSORS (ĐƠN LẺ - 750 samples)
-    # ============================================
-    
-    # 2b1. CHỈ CO2 hơi cao (150 samples)
-    for _ in range(150):
-        co2 = np.random.randint(800, 1000)     # ✅ Moderate range
-        co = np.random.uniform(0, 5)           # Tốt
-        pm25 = np.random.randint(0, 25)        # Tốt
-        temp = np.random.uniform(25, 30)       # Tốt
-        hum = np.random.uniform(70, 85)        # Tốt
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Trung bình")
-        labels_problems.append([0, 0, 0, 0, 0])
-
-    # 2b2. CHỈ CO hơi cao (150 samples)
-    for _ in range(150):
-        co2 = np.random.randint(400, 800)      # Tốt
-        co = np.random.uniform(5, 9)           # ✅ Moderate range
-        pm25 = np.random.randint(0, 25)        # Tốt
-        temp = np.random.uniform(25, 30)       # Tốt
-        hum = np.random.uniform(70, 85)        # Tốt
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Trung bình")
-        labels_problems.append([0, 0, 0, 0, 0])
-
-    # 2b3. CHỈ PM2.5 hơi cao (150 samples)
-    for _ in range(150):
-        co2 = np.random.randint(400, 800)      # Tốt
-        co = np.random.uniform(0, 5)           # Tốt
-        pm25 = np.random.randint(25, 35)       # ✅ Moderate range
-        temp = np.random.uniform(25, 30)       # Tốt
-        hum = np.random.uniform(70, 85)        # Tốt
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Trung bình")
-        labels_problems.append([0, 0, 0, 0, 0])
-
-    # 2b4. CHỈ Nhiệt độ hơi nóng (150 samples)
-    for _ in range(150):
-        co2 = np.random.randint(400, 800)      # Tốt
-        co = np.random.uniform(0, 5)           # Tốt
-        pm25 = np.random.randint(0, 25)        # Tốt
-        temp = np.random.uniform(30, 34)       # ✅ Moderate range (hơi nóng)
-        hum = np.random.uniform(70, 85)        # Tốt
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Trung bình")
-        labels_problems.append([0, 0, 0, 0, 0])
-
-    # 2b5. CHỈ Độ ẩm hơi khó chịu (150 samples)
-    for _ in range(150):
-        co2 = np.random.randint(400, 800)      # Tốt
-        co = np.random.uniform(0, 5)           # Tốt
-        pm25 = np.random.randint(0, 25)        # Tốt
-        temp = np.random.uniform(25, 30)       # Tốt
-        hum = np.random.choice([np.random.uniform(65, 70), np.random.uniform(85, 92)])  # ✅ Moderate (hơi khô / hơi ẩm)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Trung bình")
-        labels_problems.append([0, 0, 0, 0, 0])
-
-    # ============================================
-    # CASE 2C: TRUNG BÌNH - COMBINATIONS (2 sensors - 250 samples)
-    # ============================================
-    
-    # 2c1. CO2 + CO hơi cao (50 samples)
-    for _ in range(50):
-        co2 = np.random.randint(800, 1000)
-        co = np.random.uniform(5, 9)
-        pm25 = np.random.randint(0, 25)
-        temp = np.random.uniform(25, 30)
-        hum = np.random.uniform(70, 85)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Trung bình")
-        labels_problems.append([0, 0, 0, 0, 0])
-
-    # 2c2. CO2 + PM2.5 hơi cao (50 samples)
-    for _ in range(50):
-        co2 = np.random.randint(800, 1000)
-        co = np.random.uniform(0, 5)
-        pm25 = np.random.randint(25, 35)
-        temp = np.random.uniform(25, 30)
-        hum = np.random.uniform(70, 85)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Trung bình")
-        labels_problems.append([0, 0, 0, 0, 0])
-
-    # 2c3. CO2 + Temp hơi cao (50 samples)
-    for _ in range(50):
-        co2 = np.random.randint(800, 1000)
-        co = np.random.uniform(0, 5)
-        pm25 = np.random.randint(0, 25)
-        temp = np.random.uniform(30, 34)
-        hum = np.random.uniform(70, 85)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Trung bình")
-        labels_problems.append([0, 0, 0, 0, 0])
-
-    # 2c4. CO + PM2.5 hơi cao (50 samples)
-    for _ in range(50):
-        co2 = np.random.randint(400, 800)
-        co = np.random.uniform(5, 9)
-        pm25 = np.random.randint(25, 35)
-        temp = np.random.uniform(25, 30)
-        hum = np.random.uniform(70, 85)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Trung bình")
-        labels_problems.append([0, 0, 0, 0, 0])
-
-    # 2c5. PM2.5 + Temp hơi cao (50 samples)
-    for _ in range(50):
-        co2 = np.random.randint(400, 800)
-        co = np.random.uniform(0, 5)
-        pm25 = np.random.randint(25, 35)
-        temp = np.random.uniform(30, 34)
-        hum = np.random.uniform(70, 85)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Trung bình")
-        labels_problems.append([0, 0, 0, 0, 0])
-
-    # ============================================
-    # CASE 3: KÉM - INDIVIDUAL SENSORS (ĐƠN LẺ - 750 samples)
-    # ============================================
-    
-    # 3a. CHỈ CO2 vượt ngưỡng (150 samples)
-    for _ in range(150):
-        co2 = np.random.randint(1000, 2500)    # ✅ >1000 = Poor
-        co = np.random.uniform(0, 5)
-        pm25 = np.random.randint(0, 30)
-        temp = np.random.uniform(25, 30)
-        hum = np.random.uniform(70, 85)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Kém")
-        labels_problems.append([1, 0, 0, 0, 0])
-
-    # 3b. CHỈ CO vượt ngưỡng (150 samples)
-    for _ in range(150):
-        co2 = np.random.randint(400, 800)
-        co = np.random.uniform(9, 50)          # ✅ >9 = Poor
-        pm25 = np.random.randint(0, 30)
-        temp = np.random.uniform(25, 30)
-        hum = np.random.uniform(70, 85)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Kém")
-        labels_problems.append([0, 1, 0, 0, 0])
-
-    # 3c. CHỈ PM2.5 vượt ngưỡng (150 samples)
-    for _ in range(150):
-        co2 = np.random.randint(400, 800)
-        co = np.random.uniform(0, 5)
-        pm25 = np.random.randint(35, 100)      # ✅ >35 = Poor
-        temp = np.random.uniform(25, 30)
-        hum = np.random.uniform(70, 85)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Kém")
-        labels_problems.append([0, 0, 1, 0, 0])
-
-    # 3d. CHỈ Nhiệt độ vượt ngưỡng (150 samples)
-    for _ in range(150):
-        co2 = np.random.randint(400, 800)
-        co = np.random.uniform(0, 5)
-        pm25 = np.random.randint(0, 30)
-        temp = np.random.uniform(34, 40)       # ✅ >34 = Poor
-        hum = np.random.uniform(70, 85)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Kém")
-        labels_problems.append([0, 0, 0, 1, 0])
-
-    # 3e. CHỈ Độ ẩm vượt ngưỡng (150 samples)
-    for _ in range(150):
-        co2 = np.random.randint(400, 800)
-        co = np.random.uniform(0, 5)
-        pm25 = np.random.randint(0, 30)
-        temp = np.random.uniform(25, 30)
-        hum = np.random.choice([np.random.uniform(10, 40), np.random.uniform(80, 100)])  # ✅ <65 hoặc >92 = Poor
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Kém")
-        labels_problems.append([0, 0, 0, 0, 1])
-
-    # ============================================
-    # CASE 4: KÉM - COMBINATIONS (2 sensors - 500 samples)
-    # ============================================
-    
-    # 4a. CO2 + CO (100 samples)
-    for _ in range(100):
-        co2 = np.random.randint(1000, 2500)
-        co = np.random.uniform(9, 50)
-        pm25 = np.random.randint(0, 30)
-        temp = np.random.uniform(25, 30)
-        hum = np.random.uniform(70, 85)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Kém")
-        labels_problems.append([1, 1, 0, 0, 0])
-
-    # 4b. CO2 + PM2.5 (100 samples)
-    for _ in range(100):
-        co2 = np.random.randint(1000, 2500)
-        co = np.random.uniform(0, 5)
-        pm25 = np.random.randint(35, 100)
-        temp = np.random.uniform(25, 30)
-        hum = np.random.uniform(70, 85)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Kém")
-        labels_problems.append([1, 0, 1, 0, 0])
-
-    # 4c. CO2 + Temp (100 samples)
-    for _ in range(100):
-        co2 = np.random.randint(1000, 2500)
-        co = np.random.uniform(0, 5)
-        pm25 = np.random.randint(0, 30)
-        temp = np.random.uniform(34, 40)
-        hum = np.random.uniform(70, 85)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Kém")
-        labels_problems.append([1, 0, 0, 1, 0])
-
-    # 4d. CO + PM2.5 (100 samples)
-    for _ in range(100):
-        co2 = np.random.randint(400, 800)
-        co = np.random.uniform(9, 50)
-        pm25 = np.random.randint(35, 100)
-        temp = np.random.uniform(25, 30)
-        hum = np.random.uniform(70, 85)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Kém")
-        labels_problems.append([0, 1, 1, 0, 0])
-
-    # 4e. PM2.5 + Temp (100 samples)
-    for _ in range(100):
-        co2 = np.random.randint(400, 800)
-        co = np.random.uniform(0, 5)
-        pm25 = np.random.randint(35, 100)
-        temp = np.random.uniform(34, 40)
-        hum = np.random.uniform(70, 85)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Kém")
-        labels_problems.append([0, 0, 1, 1, 0])
-
-    # ============================================
-    # CASE 5: KÉM - COMBINATIONS (3 sensors - 200 samples)
-    # ============================================
-    
-    # 5a. CO2 + CO + PM2.5 (100 samples)
-    for _ in range(100):
-        co2 = np.random.randint(1000, 2500)
-        co = np.random.uniform(9, 50)
-        pm25 = np.random.randint(35, 100)
-        temp = np.random.uniform(25, 30)
-        hum = np.random.uniform(70, 85)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Kém")
-        labels_problems.append([1, 1, 1, 0, 0])
-
-    # 5b. CO2 + CO + Temp (100 samples)
-    for _ in range(100):
-        co2 = np.random.randint(1000, 2500)
-        co = np.random.uniform(9, 50)
-        pm25 = np.random.randint(0, 30)
-        temp = np.random.uniform(34, 40)
-        hum = np.random.uniform(70, 85)
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Kém")
-        labels_problems.append([1, 1, 0, 1, 0])
-        
-    # ============================================
-    # CASE 6: KÉM - ALL SENSORS (4 sensors - 200 samples)
-    # ============================================
-    
-    # 6a. Tất cả sensors vượt ngưỡng nghiêm trọng (200 samples)
-    for _ in range(200):
-        co2 = np.random.randint(1500, 3000)
-        co = np.random.uniform(15, 50)
-        pm25 = np.random.randint(75, 200)
-        temp = np.random.uniform(36, 40)
-        hum = np.random.choice([np.random.uniform(10, 40), np.random.uniform(80, 100)])
-        data.append([co2, co, pm25, temp, hum])
-        labels_quality.append("Kém")
-        labels_problems.append([1, 1, 1, 1, 0])
-
-    return np.array(data), np.array(labels_quality), np.array(labels_problems)
+    counts = np.array([max(1, int(round(n * scale))) for n, *_ in TRAINING_SCENARIOS])
+    # Khoảng giá trị của từng kịch bản: (n_scenarios, 5, 2 khoảng, min/max)
+    ranges = np.array([
+        [spec if isinstance(spec[0], tuple) else (spec, spec) for spec in scenario[1:6]]
+        for scenario in TRAINING_SCENARIOS
+    ], dtype=np.float64)
+    scenario_idx = np.repeat(np.arange(len(TRAINING_SCENARIOS)), counts)
+    n_samples = len(scenario_idx)
+
+    # Mỗi dòng chọn 1 trong 2 khoảng (2 khoảng giống nhau nếu feature chỉ có 1 khoảng)
+    pick = (rng.random((n_samples, 5)) < 0.5).astype(np.intp)
+    row_ranges = ranges[scenario_idx[:, None], np.arange(5), pick]
+    low, high = row_ranges[..., 0], row_ranges[..., 1]
 
+    u = rng.random((n_samples, 5))
+    data = low + (high - low) * u
+    data[:, INTEGER_FEATURES] = np.floor(data[:, INTEGER_FEATURES])
+
+    labels_quality = np.array([scenario[6] for scenario in TRAINING_SCENARIOS])[scenario_idx]
+    labels_problems = np.array([scenario[7] for scenario in TRAINING_SCENARIOS])[scenario_idx]
+    return data, labels_quality, labels_problems
 
 
 # ============================================
 # 2. TRAIN & LOAD CUSTOM MODELS
 # ============================================
 
-def train_models():
+class FeatureScaler:
+    """
+    Phần inference của StandardScaler: (X - mean) / scale.
+    Chỉ giữ 2 mảng nên phục vụ dự đoán không cần import sklearn
+    """
+    def __init__(self, mean, scale):
+        self.mean_ = np.asarray(mean, dtype=np.float64)
+        self.scale_ = np.asarray(scale, dtype=np.float64)
+
+    @classmethod
+    def from_sklearn(cls, scaler):
+        return cls(scaler.mean_, scaler.scale_)
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=np.float64) - self.mean_) / self.scale_
+
+
+class ModelBundle:
+    """
+    Bộ model dùng để dự đoán (scaler + cây chất lượng + model chẩn đoán).
+    Không sửa sau khi tạo: retrain tạo bundle mới rồi thay nguyên khối,
+    nên mỗi request luôn thấy 1 bộ model đồng nhất
+    """
+    def __init__(self, clf_quality, clf_problems, scaler, version=1, metrics=None):
+        self.clf_quality = clf_quality
+        self.clf_problems = clf_problems
+        # scaler = None: threshold của các cây đã ở đơn vị gốc, không cần scale
+        self.scaler = scaler
+        self.version = version
+        self.metrics = metrics or {}
+        self.created_at = datetime.now(timezone.utc).isoformat()
+
+    def fuse_scaler(self):
+        """
+        Gộp scaler vào threshold của các cây, dự đoán trên reading gốc bỏ qua bước scale
+        """
+        if self.scaler is None:
+            return self
+        mean, scale = self.scaler.mean_, self.scaler.scale_
+        fused = ModelBundle(
+            self.clf_quality.fuse_scaler(mean, scale),
+            self.clf_problems.fuse_scaler(mean, scale),
+            None,
+            version=self.version,
+            metrics=self.metrics,
+        )
+        fused.created_at = self.created_at
+        return fused
+
+
+def train_models(n_jobs=None, version=1):
+    # Chỉ cần sklearn khi huấn luyện, không nằm trên đường import của service
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.model_selection import train_test_split
+
+    n_jobs = n_jobs or TRAIN_N_JOBS
+    started = time.perf_counter()
     logger.info("Generating hybrid training data...")
     X, y_quality, y_problems = generate_training_data()
 
@@ -526,123 +1219,1638 @@ def train_models():
     X_train_scaled = scaler.fit_transform(X_train)
     X_test_scaled = scaler.transform(X_test)
 
+    # 6 cây (1 cây Quality + 5 cây chẩn đoán) độc lập -> huấn luyện song song
+    logger.info(f"Training Custom Decision Trees for Quality and Diagnostics ({n_jobs} workers)...")
+    if DIAGNOSTIC_MODEL == "multi_output":
+        clf_problems = MultiOutputDecisionTree(max_depth=15, max_bins=TRAIN_MAX_BINS, random_state=42)
+        problem_jobs = [(clf_problems, "fit", (X_train_scaled, yp_train))]
+    else:
+        clf_problems = SimpleMultiLabelModel(max_depth=15, max_bins=TRAIN_MAX_BINS, random_state=42)
+        problem_jobs = clf_problems.tree_jobs(X_train_scaled, yp_train)
+    if QUALITY_N_ESTIMATORS > 0:
+        clf_quality = SimpleRandomForest(
+            n_estimators=QUALITY_N_ESTIMATORS, max_depth=QUALITY_MAX_DEPTH, min_samples_split=QUALITY_MIN_SAMPLES_SPLIT,
+            max_bins=TRAIN_MAX_BINS, random_state=42,
+        )
+        quality_jobs = clf_quality.tree_jobs(X_train_scaled, yq_train)
+    else:
+        # Mặc định: 1 cây quyết định tự viết
+        clf_quality = SimpleDecisionTree(
+            max_depth=QUALITY_MAX_DEPTH, min_samples_split=QUALITY_MIN_SAMPLES_SPLIT,
+            max_bins=TRAIN_MAX_BINS, random_state=42,
+        )
+        quality_jobs = [(clf_quality, "fit", (X_train_scaled, yq_train))]
+    fitted = fit_parallel(quality_jobs + problem_jobs, n_jobs)
+    n_quality = len(quality_jobs)
+    if QUALITY_N_ESTIMATORS > 0:
+        clf_quality.finish_fit(fitted[:n_quality], X_train_scaled, yq_train)
+        logger.info(f"Quality forest ({n_quality} trees) OOB accuracy: {clf_quality.oob_score_:.2%}")
+    else:
+        clf_quality = fitted[0]
+    if DIAGNOSTIC_MODEL == "multi_output":
+        clf_problems = fitted[n_quality]
+    else:
+        clf_problems.models = fitted[n_quality:]
+
+    pruning = None
+    if TREE_PRUNING != "none":
+        # Rừng không cắt tỉa: số node nằm ở số cây, không ở độ sâu từng cây
+        problem_trees = [clf_problems] if DIAGNOSTIC_MODEL == "multi_output" else clf_problems.models
+        quality_trees = [] if QUALITY_N_ESTIMATORS > 0 else [clf_quality]
+        before = (_tree_size(quality_trees, X_test_scaled), _tree_size(problem_trees, X_test_scaled))
+        if quality_trees:
+            clf_quality = prune_tree(clf_quality, X_train_scaled, yq_train)
+            quality_trees = [clf_quality]
+        if DIAGNOSTIC_MODEL == "multi_output":
+            clf_problems = prune_tree(clf_problems, X_train_scaled, yp_train)
+            problem_trees = [clf_problems]
+        else:
+            clf_problems.models = [
+                prune_tree(tree, X_train_scaled, yp_train[:, i]) for i, tree in enumerate(clf_problems.models)
+            ]
+            problem_trees = clf_problems.models
+        after = (_tree_size(quality_trees, X_test_scaled), _tree_size(problem_trees, X_test_scaled))
+        pruning = {"mode": TREE_PRUNING}
+        for k, name in enumerate(("quality", "diagnostic")):
+            if not before[k][0]:
+                continue
+            pruning[f"{name}_nodes"] = [before[k][0], after[k][0]]
+            pruning[f"{name}_avg_path_length"] = [before[k][1], after[k][1]]
+            logger.info(
+                f"Pruning ({TREE_PRUNING}) {name}: {before[k][0]} -> {after[k][0]} nodes, "
+                f"avg path {before[k][1]} -> {after[k][1]}"
+            )
+
     # --- MODEL 1: QUALITY CLASSIFIER (Custom Decision Tree) ---
-    logger.info("Training Custom Decision Tree for Quality...")
-    # Thay vì RandomForest, ta dùng 1 cây quyết định tự viết
-    clf_quality = SimpleDecisionTree(max_depth=15, min_samples_split=5) 
-    clf_quality.fit(X_train_scaled, yq_train)
-    
     # Tính accuracy thủ công
     y_pred = clf_quality.predict(X_test_scaled)
     acc_q = np.mean(y_pred == yq_test)
     logger.info(f"Custom Quality Model Accuracy: {acc_q:.2%}")
 
     # --- MODEL 2: DIAGNOSTIC MODEL (Custom Multi-Label) ---
-    logger.info("Training Custom Multi-Label Model for Diagnostics...")
-    clf_problems = SimpleMultiLabelModel(max_depth=15)
-    clf_problems.fit(X_train_scaled, yp_train)
-    
     acc_p = clf_problems.score(X_test_scaled, yp_test)
     logger.info(f"Custom Diagnostic Model Accuracy: {acc_p:.2%}")
 
-    joblib.dump(clf_quality, MODEL_QUALITY_PATH)
-    joblib.dump(clf_problems, MODEL_PROBLEMS_PATH)
-    joblib.dump(scaler, SCALER_PATH)
-    
-    return clf_quality, clf_problems, scaler
-
-# Load models
-try:
-    if not os.path.exists(MODEL_QUALITY_PATH):
-        raise FileNotFoundError
-    clf_quality = joblib.load(MODEL_QUALITY_PATH)
-    clf_problems = joblib.load(MODEL_PROBLEMS_PATH)
-    scaler = joblib.load(SCALER_PATH)
-    logger.info("All CUSTOM models loaded successfully.")
-except:
-    logger.info("Models not found or outdated. Training custom models...")
-    clf_quality, clf_problems, scaler = train_models()
+    metrics = {
+        "quality_accuracy": float(acc_q),
+        "diagnostic_accuracy": float(acc_p),
+        "n_train": int(len(X_train)),
+        "training_seconds": round(time.perf_counter() - started, 3),
+        "diagnostic_model": DIAGNOSTIC_MODEL,
+    }
+    if pruning:
+        metrics["pruning"] = pruning
+    if QUALITY_N_ESTIMATORS > 0:
+        metrics["quality_estimators"] = QUALITY_N_ESTIMATORS
+        metrics["quality_oob_accuracy"] = clf_quality.oob_score_
+    bundle = ModelBundle(clf_quality, clf_problems, FeatureScaler.from_sklearn(scaler), version=version, metrics=metrics)
+    save_model_bundle(bundle)
+    # Phục vụ bằng đúng dạng đã export (threshold theo đơn vị gốc)
+    return bundle.fuse_scaler()
+
+
+def kfold_indices(n_samples, n_folds=5, random_state=None):
+    """
+    Chia dữ liệu (xáo trộn 1 lần) thành n_folds phần, trả về list
+    (chỉ số train, chỉ số validation) cho từng fold
+    """
+    order = np.random.default_rng(random_state).permutation(n_samples)
+    folds = np.array_split(order, n_folds)
+    return [(np.concatenate(folds[:k] + folds[k + 1:]), folds[k]) for k in range(n_folds)]
+
+
+def _accuracy(pred, y):
+    # Nhãn nhiều cột: đúng hết các nhãn mới tính là đúng (như SimpleMultiLabelModel.score)
+    correct = pred == y
+    return float(np.mean(correct if correct.ndim == 1 else np.all(correct, axis=1)))
+
+
+def measure_predict_latency(model, X, repeat=5):
+    """
+    (µs mỗi dòng khi dự đoán cả batch X, µs cho 1 lần dự đoán 1 dòng), lấy lần nhanh nhất
+    """
+    batch, single = [], []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        model.predict(X)
+        t1 = time.perf_counter()
+        model.predict(X[:1])
+        batch.append(t1 - t0)
+        single.append(time.perf_counter() - t1)
+    return min(batch) / len(X) * 1e6, min(single) * 1e6
+
+
+def grid_search_cv(X, y, param_grid, n_folds=5, estimator=SimpleDecisionTree, max_bins=TRAIN_MAX_BINS,
+                   n_jobs=None, random_state=42):
+    """
+    K-fold cross-validation cho mọi tổ hợp tham số trong param_grid
+    (ví dụ {"max_depth": [6, 10, 15], "min_samples_split": [2, 5]}).
+
+    X được lượng tử hóa 1 lần (bin_edges chỉ phụ thuộc X, không phụ thuộc
+    nhãn) rồi dùng chung cho mọi fold và mọi tổ hợp; n_folds x số tổ hợp cây
+    độc lập được huấn luyện song song bằng fit_parallel. max_bins=None:
+    split chính xác trên giá trị gốc (không có gì dùng chung). Mặc định dùng
+    cùng chế độ với train_models (TRAIN_MAX_BINS) để kết quả khớp model deploy.
+
+    Trả về list kết quả, tốt nhất trước (accuracy cao, ít node): params,
+    accuracy (trung bình / độ lệch chuẩn qua các fold), số node trung bình
+    và độ trễ dự đoán đo trên cây của fold đầu tiên
+    """
+    keys = list(param_grid)
+    configs = [dict(zip(keys, values)) for values in itertools.product(*(param_grid[k] for k in keys))]
+    folds = kfold_indices(len(y), n_folds, random_state)
+
+    if max_bins:
+        bin_edges = compute_bin_edges(X, max_bins)
+        X_binned = bin_features(X, bin_edges)
+        fold_args = [(X_binned[train], y[train], bin_edges) for train, _ in folds]
+    else:
+        fold_args = [(X[train], y[train]) for train, _ in folds]
+    method = "fit_binned" if max_bins else "fit"
+    jobs = [
+        (estimator(random_state=random_state, **params), method, args)
+        for params in configs for args in fold_args
+    ]
+    fitted = fit_parallel(jobs, n_jobs or TRAIN_N_JOBS)
+
+    results = []
+    for c, params in enumerate(configs):
+        trees = fitted[c * n_folds:(c + 1) * n_folds]
+        scores = [_accuracy(tree.predict(X[val]), y[val]) for tree, (_, val) in zip(trees, folds)]
+        # Đo tuần tự sau khi huấn luyện xong để các process không tranh CPU
+        us_per_row, us_single = measure_predict_latency(trees[0], X[folds[0][1]])
+        results.append({
+            "params": params,
+            "accuracy": float(np.mean(scores)),
+            "accuracy_std": float(np.std(scores)),
+            "n_nodes": float(np.mean([len(tree.feature_) for tree in trees])),
+            "predict_us_per_row": us_per_row,
+            "predict_single_us": us_single,
+        })
+    results.sort(key=lambda r: (-r["accuracy"], r["n_nodes"]))
+    return results
+
+
+def select_ccp_alpha(tree, X_train, y_train, X_val, y_val, tolerance=0.0):
+    """
+    Chọn alpha cost-complexity cho cây đã fit trên (X_train, y_train): alpha
+    lớn nhất (cây nhỏ nhất) có accuracy trên (X_val, y_val) không thấp hơn
+    accuracy tốt nhất của cả dãy cắt tỉa quá tolerance.
+    Trả về (alpha, list kết quả từng bước: alpha, số node, accuracy, độ dài đường đi trung bình)
+    """
+    report = tree.pruning_path_scores(X_train, y_train, X_val, y_val)
+    best = max(r["val_accuracy"] for r in report)
+    chosen = [r for r in report if r["val_accuracy"] >= best - tolerance][-1]
+    return chosen["alpha"], report
+
+
+def prune_tree(tree, X, y, mode=TREE_PRUNING):
+    """
+    Cắt tỉa 1 cây đã fit trên (X, y) theo mode của TREE_PRUNING. Với "ccp",
+    alpha được chọn bằng 1 cây cùng tham số học trên 80% (X, y) và đánh giá
+    trên 20% còn lại, rồi áp dụng cho cây học trên toàn bộ (X, y)
+    """
+    if mode == "ccp":
+        fit_idx, val_idx = kfold_indices(len(y), 5, random_state=42)[0]
+        probe = type(tree)(
+            min_samples_split=tree.min_samples_split, max_depth=tree.max_depth,
+            max_bins=TRAIN_MAX_BINS, random_state=42,
+        ).fit(X[fit_idx], y[fit_idx])
+        alpha, _ = select_ccp_alpha(probe, X[fit_idx], y[fit_idx], X[val_idx], y[val_idx])
+        tree = tree.prune_cost_complexity(X, y, alpha)
+    elif mode != "same_label":
+        raise ValueError(f"Unknown TREE_PRUNING mode: {mode}")
+    return tree.prune_same_label(X, y)
+
+
+def _tree_size(trees, X):
+    # (tổng số node, tổng độ dài đường đi trung bình) của 1 hoặc nhiều cây trên X
+    return (
+        int(sum(len(tree.feature_) for tree in trees)),
+        round(sum(tree.average_path_length(X) for tree in trees), 3),
+    )
+
+
+def _align(offset):
+    return -(-offset // ARTIFACT_ALIGN) * ARTIFACT_ALIGN
+
+
+def save_model_bundle(bundle, path=MODEL_ARTIFACT_PATH):
+    """
+    Lưu bundle thành 1 file artifact (.npy chứa 1 mảng uint8):
+    [8 byte: độ dài header][header JSON][các mảng số, mỗi mảng căn lề 64 byte].
+    Header ghi phiên bản định dạng, thứ tự feature, nhãn, thông số huấn luyện,
+    vị trí/dtype/shape của từng mảng và checksum sha256 của vùng dữ liệu.
+    Scaler được gộp vào threshold nên các cây trong artifact nhận thẳng
+    reading gốc. Ghi ra file tạm rồi đổi tên để process khác không đọc phải file ghi dở
+    """
+    scaler = bundle.scaler
+    bundle = bundle.fuse_scaler()
+    arrays = {}
+    if isinstance(bundle.clf_quality, SimpleRandomForest):
+        # Rừng: mỗi cây lưu riêng với tiền tố quality.<i>
+        trees = {f"quality.{i}": tree for i, tree in enumerate(bundle.clf_quality.estimators_)}
+    else:
+        trees = {"quality": bundle.clf_quality}
+    if isinstance(bundle.clf_problems, MultiOutputDecisionTree):
+        trees["problems"] = bundle.clf_problems
+    else:
+        for i, tree in enumerate(bundle.clf_problems.models):
+            trees[f"problems.{i}"] = tree
+    tree_meta = {}
+    for prefix, tree in trees.items():
+        tree_arrays = tree.to_arrays()
+        # Kiểu dữ liệu cố định (không phụ thuộc nền tảng như intp)
+        for name in ("feature_", "left_", "right_", "value_"):
+            arrays[f"{prefix}.{name}"] = tree_arrays[name].astype("<i4")
+        for name in ("threshold_", "proba_"):
+            arrays[f"{prefix}.{name}"] = tree_arrays[name].astype("<f8")
+        tree_meta[prefix] = {
+            "classes": tree_arrays["classes_"].tolist(),
+            "n_nodes": int(len(tree_arrays["feature_"])),
+        }
+
+    layout = {}
+    offset = 0
+    for name, arr in arrays.items():
+        layout[name] = {"offset": offset, "dtype": arr.dtype.str, "shape": list(arr.shape)}
+        offset = _align(offset + arr.nbytes)
+    data = np.zeros(offset, dtype=np.uint8)
+    for name, arr in arrays.items():
+        start = layout[name]["offset"]
+        data[start:start + arr.nbytes] = np.ascontiguousarray(arr).reshape(-1).view(np.uint8)
+
+    header = json.dumps({
+        "format": ARTIFACT_FORMAT,
+        "format_version": ARTIFACT_FORMAT_VERSION,
+        "model_version": bundle.version,
+        "created_at": bundle.created_at,
+        "feature_order": SENSOR_KEYS,
+        "feature_units": SENSOR_UNITS,
+        "problem_labels": SENSOR_NAMES,
+        "quality_labels": bundle.clf_quality.classes_.tolist(),
+        "metrics": bundle.metrics,
+        # Threshold theo đơn vị gốc; mean/scale lúc huấn luyện chỉ để tham khảo
+        "thresholds": "raw",
+        "training_scaler": None if scaler is None else {
+            "mean": scaler.mean_.tolist(),
+            "scale": scaler.scale_.tolist(),
+        },
+        "trees": tree_meta,
+        "arrays": layout,
+        "checksum": "sha256:" + hashlib.sha256(data).hexdigest(),
+    }, ensure_ascii=False).encode("utf-8")
+
+    data_start = _align(8 + len(header))
+    blob = np.zeros(data_start + len(data), dtype=np.uint8)
+    blob[:8] = np.frombuffer(struct.pack("<Q", len(header)), dtype=np.uint8)
+    blob[8:8 + len(header)] = np.frombuffer(header, dtype=np.uint8)
+    blob[data_start:] = data
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, blob)
+    os.replace(tmp_path, path)
+
+
+def read_artifact_header(blob):
+    (header_len,) = struct.unpack("<Q", blob[:8].tobytes())
+    header = json.loads(blob[8:8 + header_len].tobytes().decode("utf-8"))
+    if header.get("format") != ARTIFACT_FORMAT:
+        raise ValueError("Not a model artifact")
+    if header.get("format_version") not in (1, ARTIFACT_FORMAT_VERSION):
+        raise ValueError(f"Unsupported artifact format version: {header.get('format_version')}")
+    return header, _align(8 + header_len)
+
+
+def load_model_bundle(path=MODEL_ARTIFACT_PATH, verify=True):
+    """
+    Load artifact bằng np.load(mmap_mode="r"): các mảng là view trên vùng nhớ
+    map từ file, nhiều worker cùng đọc 1 bản trong page cache của OS
+    """
+    blob = np.load(path, mmap_mode="r")
+    header, data_start = read_artifact_header(blob)
+    data = blob[data_start:]
+    if verify and "sha256:" + hashlib.sha256(data).hexdigest() != header["checksum"]:
+        raise ValueError("Model artifact checksum mismatch")
+
+    def array(name):
+        spec = header["arrays"][name]
+        dtype = np.dtype(spec["dtype"])
+        n_bytes = int(np.prod(spec["shape"], dtype=np.int64)) * dtype.itemsize
+        return data[spec["offset"]:spec["offset"] + n_bytes].view(dtype).reshape(spec["shape"])
+
+    def tree(prefix, cls=SimpleDecisionTree):
+        arrays = {name: array(f"{prefix}.{name}") for name in SimpleDecisionTree.COMPILED_ARRAYS if name != "classes_"}
+        arrays["classes_"] = np.array(header["trees"][prefix]["classes"])
+        return cls.from_arrays(arrays)
+
+    n_problem_trees = sum(1 for prefix in header["trees"] if prefix.startswith("problems."))
+    n_quality_trees = sum(1 for prefix in header["trees"] if prefix.startswith("quality."))
+    if n_quality_trees:
+        clf_quality = SimpleRandomForest.from_trees([tree(f"quality.{i}") for i in range(n_quality_trees)])
+    else:
+        clf_quality = tree("quality")
+    if "problems" in header["trees"]:
+        clf_problems = tree("problems", MultiOutputDecisionTree)
+    else:
+        clf_problems = SimpleMultiLabelModel()
+        clf_problems.models = [tree(f"problems.{i}") for i in range(n_problem_trees)]
+    # Phiên bản 1 lưu threshold đã scale kèm mean/scale -> gộp khi load
+    scaler = FeatureScaler(array("scaler.mean"), array("scaler.scale")) if header["format_version"] == 1 else None
+
+    bundle = ModelBundle(clf_quality, clf_problems, scaler, version=header["model_version"], metrics=header["metrics"])
+    bundle.created_at = header["created_at"]
+    return bundle.fuse_scaler()
+
+
+def load_models():
+    try:
+        bundle = load_model_bundle()
+        logger.info(f"All CUSTOM models loaded successfully (version {bundle.version}).")
+        return bundle
+    except Exception as e:
+        logger.info(f"Models not found or outdated ({e}). Training custom models...")
+        return train_models()
+
+
+# Model được load lần đầu khi cần (không load lúc import module)
+model_bundle = None
+_bundle_lock = threading.Lock()
+
+# Nhiều worker (uvicorn/gunicorn --workers N) dùng chung 1 file artifact: worker
+# retrain xong ghi đè file, các worker khác phát hiện qua os.stat() (tối đa 1 lần
+# mỗi MODEL_RELOAD_INTERVAL giây) rồi load lại. 0 = không kiểm tra
+MODEL_RELOAD_INTERVAL = float(os.environ.get("MODEL_RELOAD_INTERVAL", "2"))
+_artifact_stamp = None
+_next_reload_check = 0.0
+
+
+def _artifact_identity(path=MODEL_ARTIFACT_PATH):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _reload_if_artifact_changed():
+    global model_bundle, _artifact_stamp, _next_reload_check
+    # Chỉ 1 thread kiểm tra, các thread khác dùng bundle hiện tại
+    if not _bundle_lock.acquire(blocking=False):
+        return
+    try:
+        _next_reload_check = time.monotonic() + MODEL_RELOAD_INTERVAL
+        stamp = _artifact_identity()
+        if stamp is None or stamp == _artifact_stamp:
+            return
+        try:
+            bundle = load_model_bundle()
+        except Exception as e:
+            logger.warning(f"Model artifact changed but could not be loaded: {e}")
+            return
+        _artifact_stamp = stamp
+        model_bundle = bundle
+        if prediction_cache is not None:
+            prediction_cache.clear()
+        logger.info(f"Reloaded model version {bundle.version} from {MODEL_ARTIFACT_PATH}")
+    finally:
+        _bundle_lock.release()
+
+
+def get_model_bundle():
+    global model_bundle, _artifact_stamp
+    if model_bundle is None:
+        with _bundle_lock:
+            if model_bundle is None:
+                model_bundle = load_models()
+                _artifact_stamp = _artifact_identity()
+    elif MODEL_RELOAD_INTERVAL > 0 and time.monotonic() >= _next_reload_check:
+        _reload_if_artifact_changed()
+    return model_bundle
+
+# Trạng thái job retrain chạy nền (chỉ 1 job tại một thời điểm)
+_retrain_lock = threading.Lock()
+retrain_state = {
+    "job_id": 0,
+    "status": "idle",
+    "started_at": None,
+    "finished_at": None,
+    "error": None,
+}
+
+
+def _retrain_worker(job_id, data_paths=None):
+    global model_bundle, _artifact_stamp
+    try:
+        version = get_model_bundle().version + 1
+        if data_paths:
+            new_bundle = train_models_streaming(data_paths, version=version)
+        else:
+            new_bundle = train_models(version=version)
+        # Gán 1 lần duy nhất: request đang chạy vẫn dùng bundle cũ mà nó đã lấy
+        with _bundle_lock:
+            model_bundle = new_bundle
+            _artifact_stamp = _artifact_identity()
+        if prediction_cache is not None:
+            prediction_cache.clear()
+        status, error = "succeeded", None
+        logger.info(f"Retrain job {job_id} finished, model version {new_bundle.version} is live")
+    except Exception as e:
+        logger.error(f"Retrain job {job_id} failed: {e}")
+        status, error = "failed", str(e)
+    with _retrain_lock:
+        retrain_state.update(
+            status=status,
+            error=error,
+            finished_at=datetime.now(timezone.utc).isoformat(),
+        )
+
+
+def start_retrain(data_paths=None):
+    """
+    Chạy train_models (hoặc train_models_streaming nếu có data_paths) trên
+    thread nền. Trả về job_id, hoặc None nếu đang có job chạy
+    """
+    with _retrain_lock:
+        if retrain_state["status"] == "running":
+            return None
+        job_id = retrain_state["job_id"] + 1
+        retrain_state.update(
+            job_id=job_id,
+            status="running",
+            started_at=datetime.now(timezone.utc).isoformat(),
+            finished_at=None,
+            error=None,
+        )
+    threading.Thread(target=_retrain_worker, args=(job_id, data_paths), daemon=True).start()
+    return job_id
+
+# ============================================
+# 2b. STREAMING TRAINING (OUT-OF-CORE)
+# ============================================
+
+# Tên cột nhãn trong file lịch sử cảm biến (cột feature theo SENSOR_KEYS)
+QUALITY_COLUMN = "quality"
+PROBLEM_COLUMNS = [f"problem_{key}" for key in SENSOR_KEYS]
+STREAM_CHUNK_SIZE = 100_000
+# Thư mục chứa file lịch sử cảm biến dùng cho /retrain
+TRAIN_DATA_DIR = os.environ.get("TRAIN_DATA_DIR", "training_data")
+# Số node tối đa mỗi cây được gom histogram trong 1 lượt đọc dữ liệu
+MAX_NODES_PER_PASS = 256
+
+
+def resolve_training_paths(names):
+    """
+    Chuyển tên file (tương đối với TRAIN_DATA_DIR) thành đường dẫn, không cho thoát ra ngoài thư mục
+    """
+    base = os.path.realpath(TRAIN_DATA_DIR)
+    paths = []
+    for name in names:
+        path = os.path.realpath(os.path.join(base, str(name)))
+        if os.path.commonpath([base, path]) != base or not os.path.isfile(path):
+            raise ValueError(f"Training file not found: {name}")
+        paths.append(path)
+    return paths
+
+
+def _chunk_from_columns(columns):
+    X = np.column_stack([np.asarray(columns[key], dtype=np.float64) for key in SENSOR_KEYS])
+    y_quality = np.asarray(columns[QUALITY_COLUMN]).astype(str)
+    y_problems = np.column_stack([np.asarray(columns[col], dtype=np.int64) for col in PROBLEM_COLUMNS])
+    return X, y_quality, y_problems
+
+
+def _iter_column_chunks(path, columns, chunk_size):
+    """
+    Đọc 1 file theo từng chunk, yield mapping tên cột -> mảng. Hỗ trợ .csv
+    (pandas, chỉ parse các cột cần), .parquet (pyarrow) và .npy (đọc qua mmap:
+    structured array với tên field = tên cột, hoặc mảng số 2 chiều)
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        import pandas as pd
+        yield from pd.read_csv(path, chunksize=chunk_size, usecols=columns)
+    elif ext == ".parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pydict()
+    elif ext == ".npy":
+        data = np.load(path, mmap_mode="r")
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+    else:
+        raise ValueError(f"Unsupported sensor data file: {path}")
+
+
+def iter_sensor_chunks(paths, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Đọc lần lượt các file lịch sử theo từng chunk, yield (X, y_quality, y_problems)
+    """
+    columns = SENSOR_KEYS + [QUALITY_COLUMN] + PROBLEM_COLUMNS
+    for path in paths:
+        for chunk in _iter_column_chunks(path, columns, chunk_size):
+            yield _chunk_from_columns(chunk)
+
+
+def iter_feature_chunks(paths, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Như iter_sensor_chunks nhưng chỉ đọc 5 cột feature (không cần nhãn), yield
+    ma trận (n, 5). File .npy có thể là mảng số (n, 5) theo thứ tự SENSOR_KEYS
+    """
+    for path in paths:
+        for chunk in _iter_column_chunks(path, SENSOR_KEYS, chunk_size):
+            if isinstance(chunk, np.ndarray) and chunk.dtype.names is None:
+                if chunk.ndim != 2 or chunk.shape[1] != len(SENSOR_KEYS):
+                    raise ValueError(f"{path}: expected an (n, {len(SENSOR_KEYS)}) array, got {chunk.shape}")
+                yield np.asarray(chunk, dtype=np.float64)
+            else:
+                yield np.column_stack([np.asarray(chunk[key], dtype=np.float64) for key in SENSOR_KEYS])
+
+
+def _holdout_mask(start, n, fraction):
+    # Chọn dòng kiểm tra theo chỉ số toàn cục -> không phụ thuộc kích thước chunk
+    row_index = np.arange(start, start + n, dtype=np.uint64)
+    return (row_index * np.uint64(2654435761) % np.uint64(2**32)) < np.uint64(fraction * 2**32)
+
+
+def _iter_split_chunks(paths, chunk_size, holdout):
+    """
+    Yield (X, y_quality, y_problems, is_holdout) cho từng chunk
+    """
+    start = 0
+    for X, y_quality, y_problems in iter_sensor_chunks(paths, chunk_size):
+        yield X, y_quality, y_problems, _holdout_mask(start, len(X), holdout)
+        start += len(X)
+
+
+class _StreamingTree:
+    """
+    Cây đang được xây từ histogram class theo bin, gom qua nhiều lượt đọc dữ liệu.
+    Mỗi lượt: định tuyến mọi dòng qua phần cây đã có tới node đang chờ,
+    cộng dồn histogram (node, feature, bin, class) rồi quyết định split/lá
+    cho các node đó. Bộ nhớ chỉ phụ thuộc số node mỗi lượt, không phụ thuộc số dòng
+    """
+    def __init__(self, tree, classes, bin_edges, rng):
+        self.tree = tree
+        tree.classes_ = classes
+        tree.bin_edges_ = bin_edges
+        tree.n_features = len(bin_edges) if not tree.n_features else min(len(bin_edges), tree.n_features)
+        self.rng = rng
+        self.store = _TreeStore(proba_shape=(len(classes),))
+        self.depth = [0]
+        self.split_bin = [0]
+        self.pending = [self.store.add()]
+
+    def start_pass(self, max_nodes):
+        self.batch = self.pending[:max_nodes]
+        self.pending = self.pending[max_nodes:]
+        n_nodes = self.store.n_nodes
+        self._feature = self.store.feature[:n_nodes].copy()
+        self._bin = np.array(self.split_bin, dtype=np.intp)
+        self._left = self.store.left[:n_nodes].copy()
+        self._right = self.store.right[:n_nodes].copy()
+        self._batch_pos = np.full(n_nodes, -1, dtype=np.intp)
+        self._batch_pos[self.batch] = np.arange(len(self.batch))
+        n_classes = len(self.tree.classes_)
+        # Số bin lớn nhất trong các feature (len(edges) + 1 <= MAX_BINS)
+        n_bins = max(len(edges) for edges in self.tree.bin_edges_) + 1
+        self.hist = np.zeros((len(self.batch), len(self.tree.bin_edges_), n_bins, n_classes), dtype=np.int64)
+
+    def accumulate(self, X_binned, y):
+        node_ids = np.zeros(len(X_binned), dtype=np.intp)
+        active = np.flatnonzero(self._feature[node_ids] != TREE_LEAF)
+        while active.size:
+            nodes = node_ids[active]
+            go_left = X_binned[active, self._feature[nodes]] <= self._bin[nodes]
+            node_ids[active] = np.where(go_left, self._left[nodes], self._right[nodes])
+            active = active[self._feature[node_ids[active]] != TREE_LEAF]
+
+        pos = self._batch_pos[node_ids]
+        in_batch = pos >= 0
+        n_batch, n_feats, n_bins, n_classes = self.hist.shape
+        flat = (
+            (pos[in_batch, None] * n_feats + np.arange(n_feats)) * n_bins
+            + X_binned[in_batch].astype(np.intp)
+        ) * n_classes + y[in_batch, None]
+        self.hist += np.bincount(flat.ravel(), minlength=self.hist.size).reshape(self.hist.shape)
+
+    def finish_pass(self):
+        tree, store = self.tree, self.store
+        for pos, node_id in enumerate(self.batch):
+            hist = self.hist[pos]
+            counts = hist[0].sum(axis=0)
+            best_feat, best_bin = None, None
+            if (self.depth[node_id] < tree.max_depth and np.count_nonzero(counts) > 1
+                    and counts.sum() >= tree.min_samples_split):
+                best_gain = 0
+                for feat_idx in self.rng.choice(hist.shape[0], tree.n_features, replace=False):
+                    n_bins = len(tree.bin_edges_[feat_idx]) + 1
+                    cut_bin, gain = tree._best_cut_from_histogram(hist[feat_idx, :n_bins], counts)
+                    if gain > best_gain:
+                        best_gain, best_feat, best_bin = gain, feat_idx, cut_bin
+
+            if best_feat is None:
+                if counts.sum() == 0:
+                    # Node không có dòng nào (không xảy ra với split hợp lệ)
+                    counts = np.ones_like(counts)
+                store.set_leaf(node_id, *tree._leaf_values(counts))
+                continue
+
+            left, right = store.add(), store.add()
+            store.set_split(node_id, int(best_feat), tree.bin_edges_[best_feat][best_bin], left, right)
+            self.split_bin[node_id] = int(best_bin)
+            for child in (left, right):
+                self.depth.append(self.depth[node_id] + 1)
+                self.split_bin.append(0)
+                self.pending.append(child)
+        self.hist = None
+
+    def build(self):
+        return self.store.finish(self.tree)
+
+
+def _scan_training_stats(paths, chunk_size, holdout, sample_size, rng):
+    """
+    Lượt đọc đầu tiên: mean/variance (gộp theo từng chunk, công thức Chan),
+    tập nhãn và 1 mẫu ngẫu nhiên kích thước cố định để tính biên bin
+    """
+    n, mean, m2 = 0, np.zeros(len(SENSOR_KEYS)), np.zeros(len(SENSOR_KEYS))
+    quality_labels, problem_labels = set(), [set() for _ in PROBLEM_COLUMNS]
+    sample, sample_keys = np.empty((0, len(SENSOR_KEYS))), np.empty(0)
+
+    for X, y_quality, y_problems, is_holdout in _iter_split_chunks(paths, chunk_size, holdout):
+        X, y_quality, y_problems = X[~is_holdout], y_quality[~is_holdout], y_problems[~is_holdout]
+        if len(X) == 0:
+            continue
+        n_chunk = len(X)
+        mean_chunk = X.mean(axis=0)
+        m2_chunk = ((X - mean_chunk) ** 2).sum(axis=0)
+        delta = mean_chunk - mean
+        total = n + n_chunk
+        mean = mean + delta * n_chunk / total
+        m2 = m2 + m2_chunk + delta ** 2 * n * n_chunk / total
+        n = total
+
+        quality_labels.update(np.unique(y_quality).tolist())
+        for i, labels in enumerate(problem_labels):
+            labels.update(np.unique(y_problems[:, i]).tolist())
+
+        # Giữ sample_size dòng có khóa ngẫu nhiên nhỏ nhất = mẫu ngẫu nhiên đều
+        sample = np.concatenate([sample, X])
+        sample_keys = np.concatenate([sample_keys, rng.random(n_chunk)])
+        if len(sample) > sample_size:
+            keep = np.argpartition(sample_keys, sample_size)[:sample_size]
+            sample, sample_keys = sample[keep], sample_keys[keep]
+
+    if n == 0:
+        raise ValueError("No training rows found")
+    scale = np.sqrt(m2 / n)
+    scale[scale == 0] = 1.0
+    return n, FeatureScaler(mean, scale), np.array(sorted(quality_labels)), \
+        [np.array(sorted(labels)) for labels in problem_labels], sample
+
+
+def train_models_streaming(paths, chunk_size=STREAM_CHUNK_SIZE, max_bins=MAX_BINS, holdout=0.2, version=1):
+    """
+    Huấn luyện từ file lịch sử cảm biến (CSV / Parquet / NPY) mà không dựng
+    toàn bộ ma trận trong bộ nhớ: mỗi lần chỉ giữ 1 chunk, histogram của các
+    node đang xây và 1 mẫu nhỏ để tính biên bin. Các cây được xây theo từng
+    tầng, mỗi lượt đọc dữ liệu xử lý tối đa MAX_NODES_PER_PASS node mỗi cây.
+    Model chẩn đoán luôn là binary relevance (5 cây 1 đầu ra)
+    """
+    started = time.perf_counter()
+    if DIAGNOSTIC_MODEL == "multi_output":
+        logger.warning("DIAGNOSTIC_MODEL=multi_output is not supported by streaming training, using binary_relevance")
+    rng = np.random.default_rng(42)
+    logger.info(f"Scanning training files: {paths}")
+    n_train, scaler, quality_classes, problem_classes, sample = _scan_training_stats(
+        paths, chunk_size, holdout, BIN_SAMPLE_SIZE, rng
+    )
+    bin_edges = compute_bin_edges(scaler.transform(sample), max_bins)
+
+    seeds = np.random.SeedSequence(42).spawn(len(PROBLEM_COLUMNS))
+    quality_tree = SimpleDecisionTree(max_depth=QUALITY_MAX_DEPTH, min_samples_split=QUALITY_MIN_SAMPLES_SPLIT)
+    trees = [_StreamingTree(quality_tree, quality_classes, bin_edges, np.random.default_rng(42))]
+    for i, classes in enumerate(problem_classes):
+        trees.append(_StreamingTree(SimpleDecisionTree(max_depth=15), classes, bin_edges,
+                                    np.random.default_rng(seeds[i])))
+
+    n_passes = 0
+    while any(t.pending for t in trees):
+        active = [t for t in trees if t.pending]
+        for t in active:
+            t.start_pass(MAX_NODES_PER_PASS)
+        for X, y_quality, y_problems, is_holdout in _iter_split_chunks(paths, chunk_size, holdout):
+            train = ~is_holdout
+            X_binned = bin_features(scaler.transform(X[train]), bin_edges)
+            labels = [np.searchsorted(quality_classes, y_quality[train])] + [
+                np.searchsorted(classes, y_problems[train, i]) for i, classes in enumerate(problem_classes)
+            ]
+            for t, y in zip(trees, labels):
+                if t in active:
+                    t.accumulate(X_binned, y)
+        for t in active:
+            t.finish_pass()
+        n_passes += 1
+    logger.info(f"Streaming training built {len(trees)} trees in {n_passes} passes over {n_train} rows")
+
+    clf_quality = trees[0].build()
+    clf_problems = SimpleMultiLabelModel(max_depth=15, max_bins=max_bins)
+    clf_problems.models = [t.build() for t in trees[1:]]
+
+    # Đánh giá trên các dòng holdout (thêm 1 lượt đọc)
+    n_test, correct_q, correct_p = 0, 0, 0
+    for X, y_quality, y_problems, is_holdout in _iter_split_chunks(paths, chunk_size, holdout):
+        if not is_holdout.any():
+            continue
+        X_test = scaler.transform(X[is_holdout])
+        n_test += int(is_holdout.sum())
+        correct_q += int(np.sum(clf_quality.predict(X_test) == y_quality[is_holdout]))
+        correct_p += int(np.sum(np.all(clf_problems.predict(X_test) == y_problems[is_holdout], axis=1)))
+    acc_q = correct_q / n_test if n_test else None
+    acc_p = correct_p / n_test if n_test else None
+    if n_test:
+        logger.info(f"Streaming Quality Model Accuracy: {acc_q:.2%}")
+        logger.info(f"Streaming Diagnostic Model Accuracy: {acc_p:.2%}")
+
+    metrics = {
+        "quality_accuracy": acc_q,
+        "diagnostic_accuracy": acc_p,
+        "n_train": int(n_train),
+        "training_seconds": round(time.perf_counter() - started, 3),
+        "data_passes": n_passes + 2,
+        "diagnostic_model": "binary_relevance",
+    }
+    bundle = ModelBundle(clf_quality, clf_problems, scaler, version=version, metrics=metrics)
+    save_model_bundle(bundle)
+    return bundle.fuse_scaler()
+
 
 # ============================================
 # 3. PREDICTION LOGIC
 # ============================================
 
+# Giới hạn số reading trong một request /predict/batch
+MAX_BATCH_SIZE = 10000
+
+# Bucket (giây) cho histogram thời gian: từ vài µs (duyệt cây 1 reading) tới vài giây (batch lớn)
+LATENCY_BUCKETS = (
+    5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Các bước xử lý được đo riêng
+PIPELINE_STAGES = ("parse", "validation", "scaling", "quality_traversal", "problem_traversal", "format", "serialization")
+
+
+class Histogram:
+    """
+    Histogram kiểu Prometheus tối giản: đếm theo bucket cố định + tổng + số lần.
+    observe() chỉ là 1 bisect và vài phép cộng nên có thể bật thường trực
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def render(self, name, labels=""):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        sep = "," if labels else ""
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{le}"}} {cumulative}')
+        label_part = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{label_part} {total!r}")
+        lines.append(f"{name}_count{label_part} {cumulative}")
+        return lines
+
+
+class ServiceMetrics:
+    """
+    Số liệu vận hành của service (theo từng process), xuất ở /metrics dạng
+    Prometheus text: thời gian từng bước, thời gian/số request theo endpoint,
+    số lần gọi model và số reading đã dự đoán
+    """
+    def __init__(self):
+        self.stages = {stage: Histogram() for stage in PIPELINE_STAGES}
+        self.request_duration = {}
+        self.requests = {}
+        self.model_calls = 0
+        self.model_readings = 0
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        self.stages[stage].observe(seconds)
+
+    def count_request(self, endpoint, status, seconds):
+        with self._lock:
+            hist = self.request_duration.get(endpoint)
+            if hist is None:
+                hist = self.request_duration[endpoint] = Histogram()
+            key = (endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+        hist.observe(seconds)
+
+    def count_model_call(self, n_readings):
+        with self._lock:
+            self.model_calls += 1
+            self.model_readings += n_readings
+
+    def render(self):
+        lines = [
+            "# HELP caqm_stage_duration_seconds Time spent in each prediction pipeline stage.",
+            "# TYPE caqm_stage_duration_seconds histogram",
+        ]
+        for stage, hist in self.stages.items():
+            lines += hist.render("caqm_stage_duration_seconds", f'stage="{stage}"')
+
+        with self._lock:
+            durations = list(self.request_duration.items())
+            requests = sorted(self.requests.items())
+            model_calls, model_readings = self.model_calls, self.model_readings
+        lines += [
+            "# HELP caqm_request_duration_seconds End-to-end request handling time per endpoint.",
+            "# TYPE caqm_request_duration_seconds histogram",
+        ]
+        for endpoint, hist in durations:
+            lines += hist.render("caqm_request_duration_seconds", f'endpoint="{endpoint}"')
+        lines += [
+            "# HELP caqm_requests_total Requests handled per endpoint and HTTP status.",
+            "# TYPE caqm_requests_total counter",
+        ]
+        lines += [f'caqm_requests_total{{endpoint="{e}",status="{st}"}} {n}' for (e, st), n in requests]
+        lines += [
+            "# HELP caqm_model_calls_total Model invocations (one per batch or micro-batch).",
+            "# TYPE caqm_model_calls_total counter",
+            f"caqm_model_calls_total {model_calls}",
+            "# HELP caqm_model_readings_total Readings scored by the model.",
+            "# TYPE caqm_model_readings_total counter",
+            f"caqm_model_readings_total {model_readings}",
+        ]
+
+        cache = prediction_cache
+        if cache is not None:
+            stats = cache.stats()
+            lines += [
+                "# HELP caqm_prediction_cache_hits_total Prediction cache hits.",
+                "# TYPE caqm_prediction_cache_hits_total counter",
+                f"caqm_prediction_cache_hits_total {stats['hits']}",
+                "# HELP caqm_prediction_cache_misses_total Prediction cache misses.",
+                "# TYPE caqm_prediction_cache_misses_total counter",
+                f"caqm_prediction_cache_misses_total {stats['misses']}",
+                "# HELP caqm_prediction_cache_hit_ratio Prediction cache hit ratio since start.",
+                "# TYPE caqm_prediction_cache_hit_ratio gauge",
+                f"caqm_prediction_cache_hit_ratio {stats['hit_rate']!r}",
+                "# HELP caqm_prediction_cache_entries Entries currently in the prediction cache.",
+                "# TYPE caqm_prediction_cache_entries gauge",
+                f"caqm_prediction_cache_entries {stats['size']}",
+            ]
+
+        bundle = get_model_bundle()
+        training_seconds = (bundle.metrics or {}).get("training_seconds")
+        with _retrain_lock:
+            running = int(retrain_state["status"] == "running")
+        lines += [
+            "# HELP caqm_model_version Version of the model currently serving.",
+            "# TYPE caqm_model_version gauge",
+            f"caqm_model_version {bundle.version}",
+            "# HELP caqm_retrain_running 1 while a background retrain job is running.",
+            "# TYPE caqm_retrain_running gauge",
+            f"caqm_retrain_running {running}",
+        ]
+        if training_seconds is not None:
+            lines += [
+                "# HELP caqm_model_training_seconds Wall time spent training the serving model.",
+                "# TYPE caqm_model_training_seconds gauge",
+                f"caqm_model_training_seconds {training_seconds!r}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+service_metrics = ServiceMetrics()
+
+# Số kết quả tối đa trong cache dự đoán (0 = tắt cache)
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", "0"))
+# Độ phân giải cảm biến dùng để lượng tử hóa khóa cache (co2, co, pm25, temperature, humidity)
+SENSOR_RESOLUTION = np.array([1.0, 0.1, 1.0, 0.1, 0.1])
+
+
+class PredictionCache:
+    """
+    Cache LRU kết quả model (nhãn, confidence, vector vấn đề) theo reading đã
+    lượng tử hóa về độ phân giải cảm biến. Mỗi mục gắn với phiên bản model
+    đã tính ra nó: mục của phiên bản cũ coi như miss nên retrain tự vô hiệu cache
+    """
+    def __init__(self, max_size, resolution=SENSOR_RESOLUTION):
+        self.max_size = max_size
+        self.resolution = np.asarray(resolution, dtype=np.float64)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, features_row):
+        return tuple(np.round(np.asarray(features_row, dtype=np.float64) / self.resolution).astype(np.int64).tolist())
+
+    def get(self, key, model_version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != model_version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, model_version, value):
+        with self._lock:
+            self._entries[key] = (model_version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE) if PREDICTION_CACHE_SIZE > 0 else None
+
+# Micro-batching cho /predict: gom request trong tối đa N ms (0 = tắt) hoặc đủ M request
+PREDICT_BATCH_WINDOW_MS = float(os.environ.get("PREDICT_BATCH_WINDOW_MS", "0"))
+PREDICT_BATCH_MAX = int(os.environ.get("PREDICT_BATCH_MAX", "64"))
+
+
+class PredictionCoalescer:
+    """
+    Gom các reading từ nhiều request /predict đồng thời thành 1 batch:
+    thread nền lấy reading đầu tiên, chờ thêm tối đa window_ms (hoặc tới
+    max_batch reading), chạy model 1 lần trên cả ma trận rồi trả kết quả
+    về từng request đang chờ qua Future
+    """
+    def __init__(self, window_ms, max_batch):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, features_row):
+        """
+        Trả về (nhãn, confidence, vector vấn đề) cho 1 reading, block tới khi batch chạy xong
+        """
+        future = Future()
+        self._queue.put((features_row, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(items) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                features = np.array([row for row, _ in items], dtype=np.float64)
+                quality_pred, quality_proba, problems_pred_matrix = _predict_matrix(features)
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for i, (_, future) in enumerate(items):
+                future.set_result((quality_pred[i], quality_proba[i], problems_pred_matrix[i]))
+
+
+prediction_coalescer = (
+    PredictionCoalescer(PREDICT_BATCH_WINDOW_MS, PREDICT_BATCH_MAX) if PREDICT_BATCH_WINDOW_MS > 0 else None
+)
+
+
+# Dự đoán theo luồng cho từng thiết bị: cửa sổ N reading gần nhất, số thiết bị
+# tối đa giữ trong bộ nhớ và thời gian không gửi dữ liệu trước khi bị xóa
+STREAM_WINDOW = int(os.environ.get("STREAM_WINDOW", "5"))
+STREAM_MAX_DEVICES = int(os.environ.get("STREAM_MAX_DEVICES", "10000"))
+STREAM_IDLE_SECONDS = float(os.environ.get("STREAM_IDLE_SECONDS", "900"))
+
+
+class RollingWindow:
+    """
+    Cửa sổ trượt N reading gần nhất của 1 thiết bị (ring buffer (N, 5)).
+    Mỗi reading cập nhật trong O(1):
+    - mean: tổng chạy
+    - slope: hồi quy tuyến tính theo thứ tự reading, từ tổng chạy S0 = sum(y_k)
+      và S1 = sum(k * y_k) (k = 0 là reading cũ nhất)
+    - max: deque đơn điệu cho từng feature (O(1) trung bình)
+    Tổng chạy được tính lại từ buffer mỗi khi ring buffer quay vòng để sai số
+    làm tròn không tích lũy
+    """
+    def __init__(self, window, n_features=len(SENSOR_KEYS)):
+        self.window = window
+        self.buffer = np.zeros((window, n_features))
+        self.count = 0      # số reading đang có trong cửa sổ (<= window)
+        self.seq = 0        # tổng số reading đã nhận
+        self.s0 = np.zeros(n_features)
+        self.s1 = np.zeros(n_features)
+        self.max_queues = [deque() for _ in range(n_features)]
+        self.last_seen = 0.0
+
+    def push(self, row):
+        head = self.seq % self.window
+        if self.count < self.window:
+            self.s1 += self.count * row
+            self.s0 += row
+            self.count += 1
+        else:
+            oldest = self.buffer[head]
+            # Bỏ y_0, các chỉ số còn lại giảm 1, reading mới ở chỉ số N-1
+            self.s1 += -(self.s0 - oldest) + (self.window - 1) * row
+            self.s0 += row - oldest
+        self.buffer[head] = row
+
+        for queue_, value in zip(self.max_queues, row.tolist()):
+            while queue_ and queue_[-1][1] <= value:
+                queue_.pop()
+            queue_.append((self.seq, value))
+            if queue_[0][0] <= self.seq - self.window:
+                queue_.popleft()
+        self.seq += 1
+
+        if self.seq % self.window == 0:
+            ordered = np.roll(self.buffer, -(self.seq % self.window), axis=0)[:self.count]
+            self.s0 = ordered.sum(axis=0)
+            self.s1 = np.arange(self.count) @ ordered
+
+    def mean(self):
+        return self.s0 / self.count
+
+    def median(self):
+        # O(N) với N cố định (mặc định 5), không phụ thuộc độ dài luồng
+        return np.median(self.buffer[:self.count], axis=0)
+
+    def max(self):
+        return np.array([queue_[0][1] for queue_ in self.max_queues])
+
+    def slope(self):
+        # Thay đổi trung bình mỗi reading (0 khi mới có 1 reading)
+        n = self.count
+        if n < 2:
+            return np.zeros_like(self.s0)
+        sx = n * (n - 1) / 2
+        sxx = (n - 1) * n * (2 * n - 1) / 6
+        return (n * self.s1 - sx * self.s0) / (n * sxx - sx * sx)
+
+
+class DeviceStreamRegistry:
+    """
+    RollingWindow theo device_id, sắp theo lần cập nhật gần nhất (OrderedDict):
+    thiết bị không gửi dữ liệu quá idle_seconds hoặc vượt max_devices
+    (bỏ thiết bị lâu nhất) bị xóa, nên bộ nhớ bị chặn bởi
+    max_devices x window x 5 số thực
+    """
+    def __init__(self, window, max_devices, idle_seconds):
+        self.window = window
+        self.max_devices = max_devices
+        self.idle_seconds = idle_seconds
+        self._devices = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def update(self, device_id, row):
+        """
+        Thêm reading vào cửa sổ của thiết bị, trả về (median, mean, max, slope, số reading trong cửa sổ)
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            state = self._devices.pop(device_id, None)
+            if state is None:
+                state = RollingWindow(self.window)
+                if len(self._devices) >= self.max_devices:
+                    self._devices.popitem(last=False)
+                    self.evicted += 1
+            self._devices[device_id] = state
+            state.last_seen = now
+            state.push(row)
+            return state.median(), state.mean(), state.max(), state.slope(), state.count
+
+    def _evict_idle(self, now):
+        while self._devices:
+            device_id, state = next(iter(self._devices.items()))
+            if now - state.last_seen <= self.idle_seconds:
+                break
+            del self._devices[device_id]
+            self.evicted += 1
+
+    def stats(self):
+        with self._lock:
+            self._evict_idle(time.monotonic())
+            return {
+                "devices": len(self._devices),
+                "max_devices": self.max_devices,
+                "window": self.window,
+                "idle_seconds": self.idle_seconds,
+                "evicted": self.evicted,
+            }
+
+
+device_streams = DeviceStreamRegistry(STREAM_WINDOW, STREAM_MAX_DEVICES, STREAM_IDLE_SECONDS)
+
+
+def _predict_matrix(features, bundle=None):
+    """
+    Chạy cả 2 model trên toàn bộ ma trận (n_samples, 5) một lần:
+    scale 1 lần, duyệt cây 1 lần cho cả batch
+    """
+    # Lấy bundle 1 lần: cả batch dùng cùng 1 phiên bản model kể cả khi đang retrain
+    bundle = bundle or get_model_bundle()
+    t0 = time.perf_counter()
+    # Bundle đã gộp scaler: cây nhận thẳng reading gốc
+    features_scaled = features if bundle.scaler is None else bundle.scaler.transform(features)
+    t1 = time.perf_counter()
+
+    # 1. Predict Quality (nhãn + xác suất trong 1 lần duyệt cây)
+    quality_pred, proba_matrix, _ = bundle.clf_quality.predict_with_proba(features_scaled)
+
+    # Lấy confidence (xác suất cao nhất = xác suất của class dự đoán)
+    quality_proba = proba_matrix.max(axis=1)
+    t2 = time.perf_counter()
+
+    # 2. Predict Problems
+    problems_pred_matrix = bundle.clf_problems.predict(features_scaled)
+    t3 = time.perf_counter()
+
+    service_metrics.observe("scaling", t1 - t0)
+    service_metrics.observe("quality_traversal", t2 - t1)
+    service_metrics.observe("problem_traversal", t3 - t2)
+    service_metrics.count_model_call(len(features))
+    return quality_pred, quality_proba, problems_pred_matrix
+
+
+def _format_result(sensor_data, quality_pred, quality_proba, problems_vector):
+    problematic_sensors = []
+    for i, is_bad in enumerate(problems_vector):
+        if is_bad == 1:
+            problematic_sensors.append({
+                "sensor": SENSOR_NAMES[i],
+                "value": sensor_data[SENSOR_KEYS[i]],
+                "unit": SENSOR_UNITS[i],
+                "threshold": "AI Detected",
+                "severity": "cao"
+            })
+
+    return {
+        "quality": quality_pred,
+        "confidence": round(quality_proba, 2),
+        "problematic_sensors": problematic_sensors,
+        "sensor_values": sensor_data
+    }
+
+
+def _predict_single(features):
+    """
+    (nhãn, confidence, vector vấn đề) cho 1 reading: qua micro-batch nếu bật,
+    ngược lại gọi model trực tiếp trên ma trận 1 dòng
+    """
+    if prediction_coalescer is not None:
+        return prediction_coalescer.submit(features[0])
+    quality_pred, quality_proba, problems_pred_matrix = _predict_matrix(features)
+    return quality_pred[0], quality_proba[0], problems_pred_matrix[0]
+
+
 def predict_logic(sensor_data):
     try:
-        features = np.array([[
-            sensor_data["co2"],
-            sensor_data["co"],
-            sensor_data["pm25"],
-            sensor_data["temperature"],
-            sensor_data["humidity"]
-        ]])
-        
-        features_scaled = scaler.transform(features)
-        
-        # 1. Predict Quality
-        quality_pred_arr = clf_quality.predict(features_scaled)
-        quality_pred = quality_pred_arr[0]
-        
-        # Lấy confidence (xác suất cao nhất của class dự đoán)
-        proba_dict_list = clf_quality.predict_proba(features_scaled)
-        proba_dict = proba_dict_list[0] # Dict {label: prob}
-        # Nếu dict trả về rỗng hoặc lỗi, default 1.0
-        quality_proba = proba_dict.get(quality_pred, 0.0)
-
-        # 2. Predict Problems
-        problems_pred_matrix = clf_problems.predict(features_scaled) 
-        problems_vector = problems_pred_matrix[0]
-
-        problematic_sensors = []
-        sensor_names = ["CO2", "CO", "PM2.5", "Nhiệt độ", "Độ ẩm"]
-        sensor_keys = ["co2", "co", "pm25", "temperature", "humidity"]
-        units = ["ppm", "ppm", "μg/m³", "°C", "%"]
-        
-        for i, is_bad in enumerate(problems_vector):
-            if is_bad == 1:
-                problematic_sensors.append({
-                    "sensor": sensor_names[i],
-                    "value": sensor_data[sensor_keys[i]],
-                    "unit": units[i],
-                    "threshold": "AI Detected",
-                    "severity": "cao"
-                })
-
-        return {
-            "quality": quality_pred,
-            "confidence": round(quality_proba, 2),
-            "problematic_sensors": problematic_sensors,
-            "sensor_values": sensor_data
-        }
+        features = np.array([[sensor_data[key] for key in SENSOR_KEYS]], dtype=np.float64)
+        cache = prediction_cache
+        if cache is None:
+            prediction = _predict_single(features)
+        else:
+            model_version = get_model_bundle().version
+            key = cache.key(features[0])
+            prediction = cache.get(key, model_version)
+            if prediction is None:
+                prediction = _predict_single(features)
+                cache.put(key, model_version, prediction)
+
+        started = time.perf_counter()
+        result = _format_result(sensor_data, *prediction)
+        service_metrics.observe("format", time.perf_counter() - started)
+        return result
 
     except Exception as e:
         logger.error(f"Prediction logic error: {e}")
         raise e
 
+
+def predict_stream_logic(device_id, sensor_data):
+    """
+    Dự đoán cho 1 reading trong luồng của 1 thiết bị: cây nhận trung vị
+    của cửa sổ, nên 1 lần vọt lên ngắn hơn nửa cửa sổ (PM2.5/CO nhiễu) không
+    lật nhãn; giá trị tăng thật sự được phản ánh sau khoảng N/2 reading.
+    Response có thêm median/mean/max/slope của cửa sổ
+    """
+    try:
+        row = np.array([sensor_data[key] for key in SENSOR_KEYS], dtype=np.float64)
+        median, mean, maximum, slope, count = device_streams.update(device_id, row)
+        prediction = _predict_single(median[None, :])
+
+        started = time.perf_counter()
+        result = _format_result(sensor_data, *prediction)
+        result["rolling"] = {
+            "device_id": device_id,
+            "samples": count,
+            "window": device_streams.window,
+            "median": dict(zip(SENSOR_KEYS, median.tolist())),
+            "mean": dict(zip(SENSOR_KEYS, mean.tolist())),
+            "max": dict(zip(SENSOR_KEYS, maximum.tolist())),
+            "slope": dict(zip(SENSOR_KEYS, slope.tolist())),
+        }
+        service_metrics.observe("format", time.perf_counter() - started)
+        return result
+
+    except Exception as e:
+        logger.error(f"Stream prediction logic error: {e}")
+        raise e
+
+
+def parse_batch(data):
+    """
+    Chuyển body của /predict/batch thành list các reading (dict).
+    Chấp nhận 3 dạng:
+    - list các reading: [{"co2": ..., "co": ..., ...}, ...]
+    - {"readings": [...]}
+    - dạng cột gọn: {"co2": [...], "co": [...], "pm25": [...], ...}
+    """
+    if isinstance(data, dict) and "readings" in data:
+        data = data["readings"]
+
+    if isinstance(data, list):
+        for i, reading in enumerate(data):
+            if not isinstance(reading, dict):
+                raise ValueError(f"Reading {i} must be an object")
+            for field in SENSOR_KEYS:
+                if field not in reading:
+                    raise ValueError(f"Reading {i}: missing field: {field}")
+        return data
+
+    if isinstance(data, dict):
+        for field in SENSOR_KEYS:
+            if field not in data:
+                raise ValueError(f"Missing field: {field}")
+            if not isinstance(data[field], list):
+                raise ValueError(f"Field {field} must be an array")
+        n = len(data[SENSOR_KEYS[0]])
+        if any(len(data[field]) != n for field in SENSOR_KEYS):
+            raise ValueError("All columns must have the same length")
+        return [
+            {field: data[field][i] for field in SENSOR_KEYS}
+            for i in range(n)
+        ]
+
+    raise ValueError("Body must be an array of readings or an object of columns")
+
+
+def predict_batch_logic(readings):
+    """
+    Dự đoán cho nhiều reading trong một lần gọi model
+    """
+    try:
+        if len(readings) == 0:
+            return []
+        features = np.array([[reading[key] for key in SENSOR_KEYS] for reading in readings], dtype=float)
+        quality_pred, quality_proba, problems_pred_matrix = _predict_matrix(features)
+        started = time.perf_counter()
+        results = [
+            _format_result(reading, quality_pred[i], quality_proba[i], problems_pred_matrix[i])
+            for i, reading in enumerate(readings)
+        ]
+        service_metrics.observe("format", time.perf_counter() - started)
+        return results
+
+    except Exception as e:
+        logger.error(f"Batch prediction logic error: {e}")
+        raise e
+
+# ============================================
+# 3b. OFFLINE RESCORING
+# ============================================
+
+# Cột của file kết quả rescore: chỉ số dòng trong input + nhãn giống file lịch sử cảm biến
+RESCORE_COLUMNS = ["row", QUALITY_COLUMN, "confidence"] + PROBLEM_COLUMNS
+
+_rescore_bundle = None
+
+
+def _init_rescore_worker(artifact_path):
+    global _rescore_bundle
+    _rescore_bundle = load_model_bundle(artifact_path)
+
+
+def _rescore_chunk(start, X):
+    """
+    Chấm điểm 1 chunk (dòng start .. start + len(X) - 1 của input), trả về
+    (các dòng CSV, số reading theo nhãn chất lượng)
+    """
+    valid = np.isfinite(X).all(axis=1)
+    quality_pred, quality_proba, problems = _predict_matrix(X[valid], _rescore_bundle)
+
+    # (nhãn, confidence, cờ vấn đề) chỉ có vài trăm tổ hợp (theo số lá của
+    # cây): format mỗi tổ hợp 1 lần thay vì từng dòng
+    labels, label_idx = np.unique(quality_pred, return_inverse=True)
+    confidences, confidence_idx = np.unique(quality_proba, return_inverse=True)
+    n_flags = len(PROBLEM_COLUMNS)
+    flag_code = problems.astype(np.int64).reshape(-1, n_flags) @ (1 << np.arange(n_flags))
+    keys, key_idx = np.unique(
+        ((label_idx * len(confidences) + confidence_idx) << n_flags) + flag_code, return_inverse=True
+    )
+    combos = []
+    for key in keys.tolist():
+        combo, code = divmod(key, 1 << n_flags)
+        label, confidence = divmod(combo, len(confidences))
+        flags = ",".join(str(code >> i & 1) for i in range(n_flags))
+        combos.append(f"{labels[label]},{confidences[confidence]:.6f},{flags}")
+
+    # Dòng không hợp lệ: các cột kết quả để trống
+    tails = np.full(len(X), "," * (len(RESCORE_COLUMNS) - 2), dtype=object)
+    tails[valid] = np.array(combos, dtype=object)[key_idx.ravel()]
+    text = "".join([f"{row},{tail}\n" for row, tail in enumerate(tails.tolist(), start)])
+    return text, dict(zip(labels.tolist(), np.bincount(label_idx.ravel(), minlength=len(labels)).tolist()))
+
+
+def rescore_files(paths, output_path, artifact_path=MODEL_ARTIFACT_PATH, chunk_size=STREAM_CHUNK_SIZE, n_jobs=1):
+    """
+    Chấm lại toàn bộ reading trong các file (.csv / .parquet / .npy) bằng model
+    trong artifact_path, ghi dần ra output_path (CSV, cột RESCORE_COLUMNS, chỉ
+    số dòng đánh liên tục qua các file theo thứ tự). Các chunk được chấm song
+    song trên n_jobs process; tối đa 2 x n_jobs chunk đang xử lý nên bộ nhớ
+    không phụ thuộc kích thước input. Trả về thống kê (số dòng, rows/s...)
+    """
+    started = time.perf_counter()
+    _init_rescore_worker(artifact_path)
+    model_version = _rescore_bundle.version
+    stats = {"rows": 0, "invalid_rows": 0, "quality_counts": {}}
+
+    def chunks():
+        start = 0
+        for X in iter_feature_chunks(paths, chunk_size):
+            yield start, X
+            start += len(X)
+
+    with open(output_path, "w", encoding="utf-8", newline="") as out:
+        out.write(",".join(RESCORE_COLUMNS) + "\n")
+
+        def write(n_rows, result):
+            text, counts = result
+            out.write(text)
+            stats["rows"] += n_rows
+            stats["invalid_rows"] += n_rows - sum(counts.values())
+            for label, count in counts.items():
+                stats["quality_counts"][label] = stats["quality_counts"].get(label, 0) + count
+            elapsed = time.perf_counter() - started
+            logger.info(f"Rescored {stats['rows']} rows ({stats['rows'] / elapsed:,.0f} rows/s)")
+
+        if n_jobs <= 1:
+            for start, X in chunks():
+                write(len(X), _rescore_chunk(start, X))
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs, mp_context=_process_pool_context(),
+                                     initializer=_init_rescore_worker, initargs=(artifact_path,)) as pool:
+                pending = deque()
+                for start, X in chunks():
+                    pending.append((len(X), pool.submit(_rescore_chunk, start, X)))
+                    if len(pending) >= 2 * n_jobs:
+                        n_rows, future = pending.popleft()
+                        write(n_rows, future.result())
+                while pending:
+                    n_rows, future = pending.popleft()
+                    write(n_rows, future.result())
+
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    stats["rows_per_second"] = round(stats["rows"] / max(stats["seconds"], 1e-9))
+    stats["model_version"] = model_version
+    return stats
+
+
 # ============================================
 # 4. API ENDPOINTS (Giữ nguyên)
 # ============================================
 
-@app.route("/predict", methods=["POST"])
-def predict():
-    data = request.get_json()
+# Các handler không phụ thuộc framework: nhận JSON đã parse, trả (payload, status).
+# Dùng chung cho Flask (bên dưới) và ASGI (air_quality_asgi.py)
+
+def handle_predict(data):
     if not data:
-        return jsonify({"error": "No data provided"}), 400
+        return {"error": "No data provided"}, 400
     try:
+        started = time.perf_counter()
         required = ["co2", "co", "pm25", "temperature", "humidity"]
         for field in required:
             if field not in data:
-                return jsonify({"error": f"Missing field: {field}"}), 400 
-        result = predict_logic(data)
-        return jsonify(result)
+                return {"error": f"Missing field: {field}"}, 400
+        service_metrics.observe("validation", time.perf_counter() - started)
+        return predict_logic(data), 200
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e)}, 500
+
+
+def handle_predict_batch(data):
+    if data is None:
+        return {"error": "No data provided"}, 400
+    try:
+        started = time.perf_counter()
+        readings = parse_batch(data)
+        service_metrics.observe("validation", time.perf_counter() - started)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if len(readings) > MAX_BATCH_SIZE:
+        return {"error": f"Batch too large (max {MAX_BATCH_SIZE} readings)"}, 413
+    try:
+        results = predict_batch_logic(readings)
+        return {"count": len(results), "results": results}, 200
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+def handle_predict_stream(data):
+    if not data:
+        return {"error": "No data provided"}, 400
+    if not isinstance(data, dict):
+        return {"error": "Body must be an object"}, 400
+    try:
+        started = time.perf_counter()
+        device_id = data.get("device_id")
+        if not isinstance(device_id, (str, int)) or device_id == "":
+            return {"error": "Missing field: device_id"}, 400
+        for field in SENSOR_KEYS:
+            if field not in data:
+                return {"error": f"Missing field: {field}"}, 400
+        service_metrics.observe("validation", time.perf_counter() - started)
+        sensor_data = {field: data[field] for field in SENSOR_KEYS}
+        return predict_stream_logic(str(device_id), sensor_data), 200
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+def handle_stream_stats():
+    return device_streams.stats(), 200
+
+
+def handle_cache_stats():
+    if prediction_cache is None:
+        return {"enabled": False}, 200
+    return {"enabled": True, **prediction_cache.stats()}, 200
+
+
+def handle_retrain(data):
+    # Body tùy chọn: {"data_paths": ["2025-01.csv", ...]} (tương đối với TRAIN_DATA_DIR)
+    data = {} if data is None else data
+    if not isinstance(data, dict):
+        return {"error": "Body must be an object"}, 400
+    data_paths = None
+    if data.get("data_paths") is not None:
+        names = data["data_paths"]
+        if not isinstance(names, list) or not names or not all(isinstance(name, str) for name in names):
+            return {"error": "data_paths must be a non-empty array of file names"}, 400
+        try:
+            data_paths = resolve_training_paths(names)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+    job_id = start_retrain(data_paths)
+    if job_id is None:
+        with _retrain_lock:
+            state = dict(retrain_state)
+        return {"error": "Retraining already in progress", "job": state}, 409
+    return {"message": "Retraining started", "job_id": job_id}, 202
+
+
+def handle_metrics():
+    return service_metrics.render(), 200
+
+
+def handle_retrain_status():
+    bundle = get_model_bundle()
+    with _retrain_lock:
+        state = dict(retrain_state)
+    return {
+        **state,
+        "model_version": bundle.version,
+        "model_created_at": bundle.created_at,
+        "model_metrics": bundle.metrics,
+    }, 200
+
+
+def _parse_json(started, silent=False):
+    data = request.get_json(silent=silent)
+    service_metrics.observe("parse", time.perf_counter() - started)
+    return data
+
+
+def _respond(endpoint, started, payload, status):
+    t = time.perf_counter()
+    response = jsonify(payload)
+    service_metrics.observe("serialization", time.perf_counter() - t)
+    service_metrics.count_request(endpoint, status, time.perf_counter() - started)
+    return response, status
+
+
+@app.route("/predict", methods=["POST"])
+def predict():
+    started = time.perf_counter()
+    payload, status = handle_predict(_parse_json(started))
+    return _respond("/predict", started, payload, status)
+
+@app.route("/predict/batch", methods=["POST"])
+def predict_batch():
+    started = time.perf_counter()
+    payload, status = handle_predict_batch(_parse_json(started))
+    return _respond("/predict/batch", started, payload, status)
+
+@app.route("/predict/stream", methods=["POST"])
+def predict_stream():
+    started = time.perf_counter()
+    payload, status = handle_predict_stream(_parse_json(started))
+    return _respond("/predict/stream", started, payload, status)
+
+@app.route("/predict/stream", methods=["GET"])
+def predict_stream_stats():
+    started = time.perf_counter()
+    payload, status = handle_stream_stats()
+    return _respond("/predict/stream", started, payload, status)
+
+@app.route("/predict/cache", methods=["GET"])
+def predict_cache_stats():
+    started = time.perf_counter()
+    payload, status = handle_cache_stats()
+    return _respond("/predict/cache", started, payload, status)
 
 @app.route("/retrain", methods=["POST"])
 def retrain():
-    global clf_quality, clf_problems, scaler
-    clf_quality, clf_problems, scaler = train_models()
-    return jsonify({"message": "Custom models retrained successfully"}), 200
+    started = time.perf_counter()
+    payload, status = handle_retrain(_parse_json(started, silent=True))
+    return _respond("/retrain", started, payload, status)
+
+@app.route("/retrain/status", methods=["GET"])
+def retrain_status():
+    started = time.perf_counter()
+    payload, status = handle_retrain_status()
+    return _respond("/retrain/status", started, payload, status)
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    started = time.perf_counter()
+    text, status = handle_metrics()
+    service_metrics.count_request("/metrics", status, time.perf_counter() - started)
+    return Response(text, status=status, content_type=METRICS_CONTENT_TYPE)
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="AI service phân loại chất lượng không khí")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("serve", help="chạy Flask service ở cổng 5000 (mặc định)")
+    rescore = commands.add_parser("rescore", help="chấm lại reading trong các file lịch sử (.csv / .parquet / .npy)")
+    rescore.add_argument("inputs", nargs="+", help="file input, cột co2, co, pm25, temperature, humidity")
+    rescore.add_argument("-o", "--output", required=True, help="file CSV kết quả")
+    rescore.add_argument("--artifact", default=MODEL_ARTIFACT_PATH, help="model artifact dùng để chấm")
+    rescore.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE)
+    rescore.add_argument("--jobs", type=int, default=TRAIN_N_JOBS, help="số process (mặc định TRAIN_N_JOBS)")
+    args = parser.parse_args(argv)
+
+    if args.command == "rescore":
+        stats = rescore_files(args.inputs, args.output, args.artifact, args.chunk_size, args.jobs)
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+        return 0
+
+    get_model_bundle()
+    app.run(host="0.0.0.0", port=5000)
+    return 0
+
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    raise SystemExit(main())
@@ -0,0 +1,266 @@
+"""
+Benchmark các đường nóng của AI service (huấn luyện + dự đoán) trên dữ liệu
+tổng hợp từ generate_training_data, quét theo kích thước dữ liệu, độ sâu cây
+và kích thước batch. Mỗi case ghi thời gian tốt nhất, throughput và bộ nhớ
+đỉnh (tracemalloc) ra file JSON để so sánh giữa các commit.
+
+    python benchmark_classifier.py --output bench/main.json
+    python benchmark_classifier.py --quick --compare bench/main.json
+
+--compare trả exit code 1 nếu có case chậm hơn baseline quá --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+import air_quality_classifier as aqc
+
+FULL_SWEEP = {
+    "fit_scales": [1, 10, 30],          # 3.350 / 33.500 / 100.500 dòng
+    "depths": [5, 10, 15],
+    "batch_sizes": [1, 100, 10000],
+    "endpoint_batch_sizes": [100, 1000],
+    "forest_sizes": [10, 50, 100],
+    "repeat": 5,
+}
+QUICK_SWEEP = {
+    "fit_scales": [1, 3],
+    "depths": [5, 15],
+    "batch_sizes": [1, 1000],
+    "endpoint_batch_sizes": [100],
+    "forest_sizes": [25],
+    "repeat": 3,
+}
+
+
+def measure(fn, repeat, min_time=0.05):
+    """
+    Chạy fn lặp lại tới khi mỗi lần đo dài ít nhất min_time giây, lấy thời
+    gian tốt nhất / trung bình của repeat lần đo; chạy thêm 1 lần dưới
+    tracemalloc để lấy bộ nhớ đỉnh (tách riêng vì tracemalloc làm chậm)
+    """
+    fn()  # warm-up (compile cây, cache của numpy...)
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or number >= 1 << 16:
+            break
+        number *= 2
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - started) / number)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(timings), "mean_seconds": float(np.mean(timings)), "peak_bytes": peak}
+
+
+def record(results, name, params, rows, fn, repeat):
+    stats = measure(fn, repeat)
+    stats["rows_per_second"] = rows / stats["seconds"]
+    results.append({"name": name, "params": params, **stats})
+    label = " ".join(f"{k}={v}" for k, v in params.items())
+    print(
+        f"{name:<32} {label:<34} {stats['seconds'] * 1e3:10.3f} ms "
+        f"{stats['rows_per_second']:14,.0f} rows/s {stats['peak_bytes'] / 2**20:8.2f} MiB",
+        flush=True,
+    )
+
+
+def bench_training(results, sweep):
+    for scale in sweep["fit_scales"]:
+        X, y_quality, y_problems = aqc.generate_training_data(scale=scale)
+        n = len(X)
+        for depth in sweep["depths"]:
+            for mode, max_bins in (("exact", None), ("binned", aqc.MAX_BINS)):
+                record(
+                    results, "SimpleDecisionTree.fit", {"rows": n, "depth": depth, "mode": mode}, n,
+                    lambda: aqc.SimpleDecisionTree(max_depth=depth, min_samples_split=5, max_bins=max_bins,
+                                                   random_state=42).fit(X, y_quality),
+                    sweep["repeat"],
+                )
+                # Huấn luyện model chẩn đoán: 5 cây riêng so với 1 cây nhiều đầu ra
+                record(
+                    results, "SimpleMultiLabelModel.fit", {"rows": n, "depth": depth, "mode": mode}, n,
+                    lambda: aqc.SimpleMultiLabelModel(max_depth=depth, max_bins=max_bins,
+                                                      random_state=42).fit(X, y_problems),
+                    sweep["repeat"],
+                )
+                record(
+                    results, "MultiOutputDecisionTree.fit", {"rows": n, "depth": depth, "mode": mode}, n,
+                    lambda: aqc.MultiOutputDecisionTree(max_depth=depth, max_bins=max_bins,
+                                                        random_state=42).fit(X, y_problems),
+                    sweep["repeat"],
+                )
+
+        # 1 lần tìm split ở node gốc (phần tốn nhất khi huấn luyện exact)
+        tree = aqc.SimpleDecisionTree()
+        tree.classes_, y_encoded = np.unique(y_quality, return_inverse=True)
+        feat_idxs = np.arange(X.shape[1])
+        record(
+            results, "SimpleDecisionTree._best_split", {"rows": n}, n,
+            lambda: tree._best_split(X, y_encoded, feat_idxs),
+            sweep["repeat"],
+        )
+
+
+def bench_inference(results, sweep):
+    X, y_quality, y_problems = aqc.generate_training_data()
+    rng = np.random.default_rng(0)
+    for depth in sweep["depths"]:
+        tree = aqc.SimpleDecisionTree(max_depth=depth, min_samples_split=5, random_state=42).fit(X, y_quality)
+        for batch in sweep["batch_sizes"]:
+            X_batch = X[rng.integers(0, len(X), batch)]
+            params = {"depth": depth, "batch": batch}
+            record(results, "SimpleDecisionTree.predict", params, batch,
+                   lambda: tree.predict(X_batch), sweep["repeat"])
+            record(results, "SimpleDecisionTree.predict_proba", params, batch,
+                   lambda: tree.predict_proba(X_batch), sweep["repeat"])
+
+    multi = aqc.SimpleMultiLabelModel(max_depth=15, random_state=42).fit(X, y_problems)
+    for batch in sweep["batch_sizes"]:
+        X_batch = X[rng.integers(0, len(X), batch)]
+        record(results, "SimpleMultiLabelModel.predict", {"depth": 15, "batch": batch}, batch,
+               lambda: multi.predict(X_batch), sweep["repeat"])
+
+    # 1 cây nhiều đầu ra thay cho 5 cây riêng của SimpleMultiLabelModel
+    multi_output = aqc.MultiOutputDecisionTree(max_depth=15, random_state=42).fit(X, y_problems)
+    for batch in sweep["batch_sizes"]:
+        X_batch = X[rng.integers(0, len(X), batch)]
+        record(results, "MultiOutputDecisionTree.predict", {"depth": 15, "batch": batch}, batch,
+               lambda: multi_output.predict(X_batch), sweep["repeat"])
+
+    # Chi phí của SimpleRandomForest so với 1 cây (cùng depth=15) theo số cây
+    for n_estimators in sweep["forest_sizes"]:
+        forest = aqc.SimpleRandomForest(n_estimators=n_estimators, max_depth=15, min_samples_split=5,
+                                        random_state=42).fit(X, y_quality)
+        for batch in sweep["batch_sizes"]:
+            X_batch = X[rng.integers(0, len(X), batch)]
+            record(results, "SimpleRandomForest.predict_proba", {"trees": n_estimators, "batch": batch}, batch,
+                   lambda: forest.predict_proba(X_batch), sweep["repeat"])
+    return X, y_quality, y_problems, multi
+
+
+def bench_endpoints(results, sweep, X, y_quality, multi):
+    # Bundle dựng trong bộ nhớ trên dữ liệu gốc (không scale, như artifact đã gộp
+    # scaler): không đọc/ghi model_artifact.npy của service
+    clf_quality = aqc.SimpleDecisionTree(max_depth=15, min_samples_split=5, random_state=42).fit(X, y_quality)
+    aqc.MODEL_RELOAD_INTERVAL = 0
+    aqc.model_bundle = aqc.ModelBundle(clf_quality, multi, None)
+    client = aqc.app.test_client()
+
+    rng = np.random.default_rng(1)
+    readings = [dict(zip(aqc.SENSOR_KEYS, row)) for row in X[rng.integers(0, len(X), max(sweep["endpoint_batch_sizes"]))].tolist()]
+
+    def post(path, body):
+        response = client.post(path, json=body)
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}: {response.get_data(as_text=True)}")
+
+    record(results, "POST /predict", {"batch": 1}, 1,
+           lambda: post("/predict", readings[0]), sweep["repeat"])
+    for batch in sweep["endpoint_batch_sizes"]:
+        body = readings[:batch]
+        record(results, "POST /predict/batch", {"batch": batch}, batch,
+               lambda: post("/predict/batch", body), sweep["repeat"])
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results, baseline_path, threshold):
+    """
+    So sánh với file kết quả cũ theo (name, params); trả về số case chậm hơn quá threshold
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {
+            (r["name"], json.dumps(r["params"], sort_keys=True)): r
+            for r in json.load(f)["results"]
+        }
+    regressions = 0
+    print(f"\nSo sánh với {baseline_path} (ngưỡng +{threshold:.0%}):")
+    for r in results:
+        old = baseline.get((r["name"], json.dumps(r["params"], sort_keys=True)))
+        if old is None:
+            continue
+        ratio = r["seconds"] / old["seconds"]
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions += 1
+            flag = "  <-- REGRESSION"
+        label = " ".join(f"{k}={v}" for k, v in r["params"].items())
+        print(f"{r['name']:<32} {label:<34} x{ratio:6.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark huấn luyện / dự đoán của AI service")
+    parser.add_argument("--quick", action="store_true", help="sweep nhỏ (vài chục giây) để kiểm tra nhanh")
+    parser.add_argument("--output", help="ghi kết quả JSON ra file này")
+    parser.add_argument("--compare", metavar="BASELINE", help="file JSON kết quả cũ để so sánh")
+    parser.add_argument("--threshold", type=float, default=0.15, help="tỉ lệ chậm hơn cho phép khi so sánh (mặc định 0.15)")
+    parser.add_argument("--only", choices=["training", "inference", "endpoints"], action="append",
+                        help="chỉ chạy nhóm benchmark này (có thể lặp lại)")
+    args = parser.parse_args(argv)
+
+    sweep = QUICK_SWEEP if args.quick else FULL_SWEEP
+    groups = set(args.only or ["training", "inference", "endpoints"])
+    results = []
+    if "training" in groups:
+        bench_training(results, sweep)
+    if groups & {"inference", "endpoints"}:
+        X, y_quality, _, multi = bench_inference(results, sweep) if "inference" in groups else (None,) * 4
+        if "endpoints" in groups:
+            if multi is None:
+                X, y_quality, y_problems = aqc.generate_training_data()
+                multi = aqc.SimpleMultiLabelModel(max_depth=15, random_state=42).fit(X, y_problems)
+            bench_endpoints(results, sweep, X, y_quality, multi)
+
+    report = {"environment": environment(), "sweep": "quick" if args.quick else "full", "results": results}
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nĐã ghi {len(results)} kết quả vào {args.output}")
+
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
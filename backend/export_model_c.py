@@ -0,0 +1,344 @@
+"""
+Xuất model trong model_artifact.npy thành 1 file header C không phụ thuộc thư
+viện (bảng node phẳng + hàm duyệt cây) để ESP32 tự phân loại tại chỗ, không
+cần gửi reading qua MQTT -> Node -> Flask.
+
+    python export_model_c.py                      # ghi ../air_quality_model.h
+    python export_model_c.py --verify --rows 100000
+
+Threshold trong artifact đã gộp StandardScaler nên header nhận thẳng giá trị
+cảm biến gốc (ppm, μg/m³, °C, %). --verify biên dịch header bằng gcc cùng 1
+chương trình thử, chạy trên dữ liệu sinh từ generate_training_data (thêm các
+điểm nằm đúng trên threshold) và so sánh từng bit với model Python.
+"""
+import argparse
+import os
+import re
+import struct
+import subprocess
+import sys
+import tempfile
+import unicodedata
+
+import numpy as np
+
+import air_quality_classifier as aqc
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "air_quality_model.h")
+
+
+def _c_identifier(label):
+    # "Trung bình" -> TRUNG_BINH (bỏ dấu tiếng Việt)
+    ascii_label = unicodedata.normalize("NFD", label.replace("đ", "d").replace("Đ", "D"))
+    ascii_label = "".join(ch for ch in ascii_label if not unicodedata.combining(ch))
+    return re.sub(r"[^A-Za-z0-9]+", "_", ascii_label).strip("_").upper()
+
+
+def _c_string(text):
+    # Chuỗi UTF-8 dạng escape \xNN để file header chỉ có ký tự ASCII
+    out, escaped = "", False
+    for byte in text.encode("utf-8"):
+        ch = chr(byte)
+        if 32 <= byte < 127 and ch not in '"\\':
+            # \xNN ăn luôn các chữ số hex phía sau -> tách thành 2 chuỗi liền nhau
+            out += ('""' if escaped and ch in "0123456789abcdefABCDEF" else "") + ch
+            escaped = False
+        else:
+            out += f"\\x{byte:02x}"
+            escaped = True
+    return '"' + out + '"'
+
+
+def _array(c_type, name, values, per_line=12):
+    values = list(values)
+    lines = [
+        "    " + ", ".join(values[i:i + per_line]) + ","
+        for i in range(0, len(values), per_line)
+    ]
+    return [f"static const {c_type} {name}[{len(values)}] = {{"] + lines + ["};"]
+
+
+def _double(value):
+    # repr của float Python là chuỗi ngắn nhất đọc lại đúng giá trị double
+    value = float(value)
+    text = repr(value)
+    return text if any(ch in text for ch in ".en") else text + ".0"
+
+
+def _model_trees(bundle):
+    """
+    (các cây chất lượng, lớp chất lượng, các cây chẩn đoán) của bundle, hỗ trợ
+    SimpleDecisionTree / SimpleRandomForest và SimpleMultiLabelModel / MultiOutputDecisionTree
+    """
+    quality = bundle.clf_quality
+    if isinstance(quality, aqc.SimpleRandomForest):
+        quality_trees, classes = quality.estimators_, quality.classes_
+    else:
+        quality_trees, classes = [quality], quality.classes_
+    problems = bundle.clf_problems
+    problem_trees = [problems] if isinstance(problems, aqc.MultiOutputDecisionTree) else problems.models
+    return quality_trees, np.asarray(classes), problem_trees
+
+
+def _tree_tables(prefix, tree):
+    arrays = tree.to_arrays()
+    n_nodes = len(arrays["feature_"])
+    if n_nodes > 32767:
+        raise ValueError(f"{prefix}: {n_nodes} nodes do not fit int16_t child indices")
+    lines = []
+    lines += _array("int8_t", f"{prefix}_feature", (str(int(v)) for v in arrays["feature_"]), 24)
+    lines += _array("double", f"{prefix}_threshold", (_double(v) for v in arrays["threshold_"]), 4)
+    lines += _array("int16_t", f"{prefix}_left", (str(int(v)) for v in arrays["left_"]), 16)
+    lines += _array("int16_t", f"{prefix}_right", (str(int(v)) for v in arrays["right_"]), 16)
+    return lines, arrays
+
+
+def render_c_header(bundle, source=""):
+    """
+    Trả về nội dung header C cho bundle (đã gộp scaler)
+    """
+    bundle = bundle.fuse_scaler()
+    quality_trees, classes, problem_trees = _model_trees(bundle)
+    n_classes = len(classes)
+    class_names = [str(c) for c in classes]
+
+    out = [
+        "/*",
+        " * Model phân loại chất lượng không khí cho ESP32 - SINH TỰ ĐỘNG bởi",
+        " * backend/export_model_c.py, không sửa tay.",
+        f" * Nguồn: {source or 'model bundle'} (model version {bundle.version}, {bundle.created_at})",
+        " *",
+        " * Đầu vào: double x[CAQM_N_FEATURES] theo thứ tự co2 (ppm), co (ppm),",
+        " * pm25 (ug/m3), temperature (C), humidity (%) - giá trị gốc, không cần scale.",
+        " *   int q = caqm_predict_quality(x, &confidence);   // chỉ số trong CAQM_QUALITY_LABELS",
+        " *   caqm_predict_problems(x, flags);                // flags[i] = 1: cảm biến i có vấn đề",
+        " */",
+        "#ifndef CAQM_MODEL_H",
+        "#define CAQM_MODEL_H",
+        "",
+        "#include <stdint.h>",
+        "",
+        f"#define CAQM_MODEL_VERSION {int(bundle.version)}",
+        f"#define CAQM_N_FEATURES {len(aqc.SENSOR_KEYS)}",
+        f"#define CAQM_N_CLASSES {n_classes}",
+        f"#define CAQM_N_PROBLEMS {len(aqc.SENSOR_NAMES)}",
+        f"#define CAQM_N_QUALITY_TREES {len(quality_trees)}",
+        "",
+    ]
+    for k, name in enumerate(class_names):
+        out.append(f"#define CAQM_CLASS_{_c_identifier(name)} {k}  /* {name} */")
+    out += [
+        "",
+        "static const char *const CAQM_QUALITY_LABELS[CAQM_N_CLASSES] = {"
+        + ", ".join(_c_string(name) for name in class_names) + "};",
+        "static const char *const CAQM_PROBLEM_LABELS[CAQM_N_PROBLEMS] = {"
+        + ", ".join(_c_string(name) for name in aqc.SENSOR_NAMES) + "};",
+        "",
+        "typedef struct {",
+        "    const int8_t *feature;      /* < 0: lá */",
+        "    const double *threshold;    /* đi nhánh trái khi x[feature] <= threshold */",
+        "    const int16_t *left;",
+        "    const int16_t *right;",
+        "    const double *proba;        /* cây chất lượng: [node][CAQM_N_CLASSES] */",
+        "    const uint8_t *label;       /* cây chất lượng: chỉ số lớp; cây chẩn đoán: [node][n_outputs] nhãn 0/1 */",
+        "    uint8_t n_outputs;",
+        "    uint8_t first_output;",
+        "} caqm_tree_t;",
+        "",
+    ]
+
+    tree_structs = []
+    for t, tree in enumerate(quality_trees):
+        prefix = f"caqm_q{t}"
+        lines, arrays = _tree_tables(prefix, tree)
+        # Cột xác suất theo thứ tự lớp của cả model (cây trong rừng có thể thiếu lớp)
+        proba = np.zeros((len(arrays["feature_"]), n_classes))
+        proba[:, np.searchsorted(classes, arrays["classes_"])] = arrays["proba_"]
+        out += lines
+        # Nhãn lưu ở lá (value_) có thể khác argmax xác suất khi 2 lớp bằng nhau
+        labels = np.searchsorted(classes, np.asarray(arrays["classes_"])[arrays["value_"]])
+        out += _array("double", f"{prefix}_proba", (_double(v) for v in proba.ravel()), 4)
+        out += _array("uint8_t", f"{prefix}_label", (str(int(v)) for v in labels), 24)
+        out.append("")
+        tree_structs.append(f"    {{{prefix}_feature, {prefix}_threshold, {prefix}_left, {prefix}_right, {prefix}_proba, {prefix}_label, 1, 0}},")
+    out += ["static const caqm_tree_t CAQM_QUALITY_TREES[CAQM_N_QUALITY_TREES] = {"] + tree_structs + ["};", ""]
+
+    tree_structs = []
+    first_output = 0
+    for t, tree in enumerate(problem_trees):
+        prefix = f"caqm_p{t}"
+        lines, arrays = _tree_tables(prefix, tree)
+        labels = np.asarray(arrays["classes_"])[arrays["value_"]].astype(np.int64)
+        n_outputs = 1 if labels.ndim == 1 else labels.shape[1]
+        out += lines
+        out += _array("uint8_t", f"{prefix}_label", (str(int(v)) for v in labels.ravel()), 24)
+        out.append("")
+        tree_structs.append(f"    {{{prefix}_feature, {prefix}_threshold, {prefix}_left, {prefix}_right, 0, {prefix}_label, {n_outputs}, {first_output}}},")
+        first_output += n_outputs
+    if first_output != len(aqc.SENSOR_NAMES):
+        raise ValueError(f"Diagnostic model has {first_output} outputs, expected {len(aqc.SENSOR_NAMES)}")
+    out += [f"#define CAQM_N_PROBLEM_TREES {len(problem_trees)}"]
+    out += ["static const caqm_tree_t CAQM_PROBLEM_TREES[CAQM_N_PROBLEM_TREES] = {"] + tree_structs + ["};", ""]
+
+    out += [
+        "/* Id node lá mà x rơi vào */",
+        "static inline int caqm_leaf(const caqm_tree_t *tree, const double *x) {",
+        "    int node = 0;",
+        "    while (tree->feature[node] >= 0) {",
+        "        node = x[tree->feature[node]] <= tree->threshold[node] ? tree->left[node] : tree->right[node];",
+        "    }",
+        "    return node;",
+        "}",
+        "",
+        "/*",
+        " * Chỉ số lớp chất lượng; *confidence = xác suất cao nhất. 1 cây: nhãn lưu ở lá;",
+        " * rừng: argmax của xác suất trung bình các cây (cộng theo thứ tự cây như numpy)",
+        " */",
+        "static inline int caqm_predict_quality(const double *x, double *confidence) {",
+        "    double proba[CAQM_N_CLASSES] = {0};",
+        "    int t, k, best = 0, leaf = 0;",
+        "    for (t = 0; t < CAQM_N_QUALITY_TREES; t++) {",
+        "        leaf = caqm_leaf(&CAQM_QUALITY_TREES[t], x);",
+        "        for (k = 0; k < CAQM_N_CLASSES; k++) proba[k] += CAQM_QUALITY_TREES[t].proba[leaf * CAQM_N_CLASSES + k];",
+        "    }",
+        "    for (k = 0; k < CAQM_N_CLASSES; k++) {",
+        "        proba[k] /= CAQM_N_QUALITY_TREES;",
+        "        if (proba[k] > proba[best]) best = k;",
+        "    }",
+        "    if (confidence) *confidence = proba[best];",
+        "    return CAQM_N_QUALITY_TREES == 1 ? CAQM_QUALITY_TREES[0].label[leaf] : best;",
+        "}",
+        "",
+        "/* flags[i] = 1 nếu cảm biến CAQM_PROBLEM_LABELS[i] có vấn đề */",
+        "static inline void caqm_predict_problems(const double *x, uint8_t *flags) {",
+        "    int t, o;",
+        "    for (t = 0; t < CAQM_N_PROBLEM_TREES; t++) {",
+        "        const caqm_tree_t *tree = &CAQM_PROBLEM_TREES[t];",
+        "        const uint8_t *label = tree->label + caqm_leaf(tree, x) * tree->n_outputs;",
+        "        for (o = 0; o < tree->n_outputs; o++) flags[tree->first_output + o] = label[o];",
+        "    }",
+        "}",
+        "",
+        "#endif /* CAQM_MODEL_H */",
+        "",
+    ]
+    return "\n".join(out)
+
+
+# Chương trình thử: đọc các reading (double, little-endian) từ file, ghi
+# chỉ số lớp, confidence dạng hex (%a, chính xác từng bit) và 5 cờ vấn đề
+_VERIFY_MAIN = r"""
+#include <stdio.h>
+#include "model.h"
+
+int main(int argc, char **argv) {
+    FILE *in;
+    double x[CAQM_N_FEATURES];
+    uint8_t flags[CAQM_N_PROBLEMS];
+    int i;
+    if (argc != 2 || !(in = fopen(argv[1], "rb"))) return 2;
+    while (fread(x, sizeof(double), CAQM_N_FEATURES, in) == CAQM_N_FEATURES) {
+        double confidence;
+        int q = caqm_predict_quality(x, &confidence);
+        caqm_predict_problems(x, flags);
+        printf("%d %a", q, confidence);
+        for (i = 0; i < CAQM_N_PROBLEMS; i++) printf(" %d", flags[i]);
+        putchar('\n');
+    }
+    fclose(in);
+    return 0;
+}
+"""
+
+
+def verification_inputs(bundle, n_rows, random_state=7):
+    """
+    Dữ liệu thử: reading sinh ngẫu nhiên + với mỗi threshold, các điểm nằm
+    đúng trên threshold và ngay hai bên (nextafter) để kiểm tra phép so sánh <=
+    """
+    X, _, _ = aqc.generate_training_data(scale=max(1.0, n_rows / 3350), random_state=random_state)
+    rng = np.random.default_rng(random_state)
+    X = X[rng.permutation(len(X))[:n_rows]]
+
+    quality_trees, _, problem_trees = _model_trees(bundle.fuse_scaler())
+    edge_rows = []
+    for tree in list(quality_trees) + list(problem_trees):
+        arrays = tree.to_arrays()
+        for feature, threshold in zip(arrays["feature_"], arrays["threshold_"]):
+            if feature < 0:
+                continue
+            for value in (np.nextafter(threshold, -np.inf), threshold, np.nextafter(threshold, np.inf)):
+                row = X[rng.integers(len(X))].copy()
+                row[feature] = value
+                edge_rows.append(row)
+    return np.vstack([X] + ([np.array(edge_rows)] if edge_rows else []))
+
+
+def verify_c_header(header_text, bundle, n_rows=20000, cc="gcc"):
+    """
+    Biên dịch header bằng gcc, chạy trên verification_inputs và so sánh với
+    model Python (nhãn, confidence từng bit, cờ vấn đề). Trả về (số dòng, số dòng lệch)
+    """
+    X = verification_inputs(bundle, n_rows)
+    bundle = bundle.fuse_scaler()
+    quality_pred, quality_proba, problems = aqc._predict_matrix(X, bundle)
+    _, classes, _ = _model_trees(bundle)
+    class_index = {label: k for k, label in enumerate(classes.tolist())}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "model.h"), "w", encoding="utf-8") as f:
+            f.write(header_text)
+        with open(os.path.join(tmp, "main.c"), "w", encoding="utf-8") as f:
+            f.write(_VERIFY_MAIN)
+        exe = os.path.join(tmp, "caqm_verify")
+        subprocess.run(
+            [cc, "-std=c99", "-O2", "-Wall", "-Wextra", "-pedantic", "-Werror", "-ffp-contract=off",
+             "-o", exe, os.path.join(tmp, "main.c")],
+            check=True,
+        )
+        readings = os.path.join(tmp, "readings.bin")
+        np.ascontiguousarray(X, dtype="<f8").tofile(readings)
+        output = subprocess.run([exe, readings], check=True, capture_output=True, text=True).stdout.splitlines()
+
+    if len(output) != len(X):
+        raise RuntimeError(f"C harness returned {len(output)} rows for {len(X)} readings")
+    mismatches = 0
+    for i, line in enumerate(output):
+        fields = line.split()
+        same = (
+            int(fields[0]) == class_index[quality_pred[i]]
+            and struct.pack("<d", float.fromhex(fields[1])) == struct.pack("<d", float(quality_proba[i]))
+            and [int(v) for v in fields[2:]] == [int(v) for v in problems[i]]
+        )
+        if not same:
+            if mismatches < 5:
+                print(f"Mismatch at row {i} {X[i].tolist()}: C={line!r} "
+                      f"Python={quality_pred[i]} {float(quality_proba[i]).hex()} {problems[i].tolist()}")
+            mismatches += 1
+    return len(X), mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Xuất model thành header C cho ESP32")
+    parser.add_argument("--artifact", default=aqc.MODEL_ARTIFACT_PATH, help="file model artifact (mặc định model_artifact.npy)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="file header cần ghi (mặc định ../air_quality_model.h)")
+    parser.add_argument("--verify", action="store_true", help="biên dịch bằng gcc và so sánh từng bit với model Python")
+    parser.add_argument("--rows", type=int, default=20000, help="số reading ngẫu nhiên dùng khi --verify")
+    parser.add_argument("--cc", default="gcc", help="trình biên dịch C dùng khi --verify")
+    args = parser.parse_args(argv)
+
+    bundle = aqc.load_model_bundle(args.artifact)
+    header_text = render_c_header(bundle, source=os.path.basename(args.artifact))
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(header_text)
+    print(f"Đã ghi {args.output} ({len(header_text.encode('utf-8')) / 1024:.1f} KiB)")
+
+    if args.verify:
+        n, mismatches = verify_c_header(header_text, bundle, args.rows, args.cc)
+        print(f"Đã kiểm tra {n} reading: {mismatches} dòng khác model Python")
+        return 1 if mismatches else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""
+Kiểm tra các endpoint Flask qua test client (không huấn luyện, không đụng
+tới model_artifact.npy).
+
+    cd backend && python -m pytest -q
+"""
+import air_quality_classifier as aqc
+
+
+def test_retrain_conflict_keeps_error_message():
+    with aqc._retrain_lock:
+        saved = dict(aqc.retrain_state)
+        aqc.retrain_state.update(job_id=7, status="running", error=None)
+    try:
+        response = aqc.app.test_client().post("/retrain")
+    finally:
+        with aqc._retrain_lock:
+            aqc.retrain_state.update(saved)
+    body = response.get_json()
+    assert response.status_code == 409
+    assert body["error"] == "Retraining already in progress"
+    assert body["job"]["job_id"] == 7
+    assert body["job"]["status"] == "running"
+
+
+def test_retrain_rejects_malformed_body():
+    client = aqc.app.test_client()
+    for body in ([1], {"data_paths": "a.csv"}, {"data_paths": []}, {"data_paths": ["a.csv", 2]}):
+        response = client.post("/retrain", json=body)
+        assert response.status_code == 400, body
+        assert "error" in response.get_json()
+    response = client.post("/retrain", json={"data_paths": ["missing.csv"]})
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Training file not found: missing.csv"
+
+
+def test_predict_stream_rejects_non_object_body():
+    response = aqc.app.test_client().post("/predict/stream", json=[1, 2])
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Body must be an object"
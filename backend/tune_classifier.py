@@ -0,0 +1,98 @@
+"""
+Chọn tham số cây (max_depth, min_samples_split) bằng k-fold cross-validation
+trên dữ liệu tổng hợp từ generate_training_data, song song trên mọi core.
+Mỗi tổ hợp in accuracy cạnh số node và độ trễ dự đoán để cân bằng giữa độ
+chính xác và chi phí inference.
+
+    python tune_classifier.py
+    python tune_classifier.py --target problems --depths 6 8 10 12 --output tune.json
+    python tune_classifier.py --prune --depths 15    # dãy cắt tỉa cost-complexity
+
+Cây được huấn luyện cùng chế độ với service (TRAIN_MAX_BINS, đổi bằng --max-bins).
+Tham số đã chọn đưa vào service qua QUALITY_MAX_DEPTH / QUALITY_MIN_SAMPLES_SPLIT
+(và TREE_PRUNING=ccp nếu cắt tỉa).
+"""
+import argparse
+import json
+import sys
+
+import air_quality_classifier as aqc
+
+
+def print_pruning_path(X, y, estimator, max_depth, min_samples_split, args):
+    train, val = aqc.kfold_indices(len(y), args.folds, random_state=42)[0]
+    tree = estimator(max_depth=max_depth, min_samples_split=min_samples_split,
+                     max_bins=args.max_bins, random_state=42).fit(X[train], y[train])
+    alpha, report = aqc.select_ccp_alpha(tree, X[train], y[train], X[val], y[val])
+
+    print(f"{'alpha':>10} {'nodes':>6} {'val accuracy':>13} {'avg path':>9}")
+    for r in report:
+        flag = "  <-- chọn" if r["alpha"] == alpha else ""
+        print(f"{r['alpha']:>10.6f} {r['n_nodes']:>6} {r['val_accuracy']:>13.2%} {r['avg_path_length']:>9.2f}{flag}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"target": args.target, "max_bins": args.max_bins, "max_depth": max_depth, "alpha": alpha,
+                       "path": report}, f, indent=2)
+        print(f"\nĐã ghi dãy cắt tỉa vào {args.output}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grid search + k-fold CV cho tham số cây quyết định")
+    parser.add_argument("--target", choices=["quality", "problems"], default="quality",
+                        help="quality: SimpleDecisionTree; problems: MultiOutputDecisionTree (5 nhãn)")
+    parser.add_argument("--depths", type=int, nargs="+", default=[4, 6, 8, 10, 12, 15])
+    parser.add_argument("--min-samples-split", type=int, nargs="+", default=[2, 5, 10, 20])
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0, help="scale của generate_training_data (1 = 3.350 dòng)")
+    parser.add_argument("--max-bins", type=int, default=aqc.TRAIN_MAX_BINS or 0,
+                        help="số bin khi huấn luyện histogram, 0 = split chính xác (mặc định như TRAIN_MAX_BINS của service)")
+    parser.add_argument("--prune", action="store_true",
+                        help="in dãy cắt tỉa cost-complexity của cây --depths lớn nhất (fold đầu tiên làm validation)")
+    parser.add_argument("--n-jobs", type=int, default=None, help="số process (mặc định TRAIN_N_JOBS)")
+    parser.add_argument("--output", help="ghi kết quả JSON ra file này")
+    args = parser.parse_args(argv)
+
+    try:
+        max_bins = aqc.check_max_bins(args.max_bins)
+    except ValueError as e:
+        parser.error(str(e))
+    if max_bins:
+        mode = f"histogram ({max_bins} bin), X lượng tử hóa 1 lần rồi dùng chung cho mọi fold và tổ hợp"
+    else:
+        mode = "split chính xác, không dùng chung gì giữa các fold/tổ hợp (mỗi cây tự sort ở từng node)"
+    print(f"Chế độ huấn luyện: {mode}")
+    if max_bins != aqc.TRAIN_MAX_BINS:
+        print(f"Lưu ý: khác với chế độ service đang dùng (TRAIN_MAX_BINS={aqc.TRAIN_MAX_BINS or 0})")
+
+    X, y_quality, y_problems = aqc.generate_training_data(scale=args.scale)
+    if args.target == "quality":
+        y, estimator = y_quality, aqc.SimpleDecisionTree
+    else:
+        y, estimator = y_problems, aqc.MultiOutputDecisionTree
+    if args.prune:
+        return print_pruning_path(X, y, estimator, max(args.depths), args.min_samples_split[0], args)
+
+    results = aqc.grid_search_cv(
+        X, y, {"max_depth": args.depths, "min_samples_split": args.min_samples_split},
+        n_folds=args.folds, estimator=estimator, max_bins=max_bins,
+        n_jobs=args.n_jobs,
+    )
+
+    print(f"{'max_depth':>9} {'min_split':>9} {'accuracy':>14} {'nodes':>8} {'µs/row (batch)':>15} {'µs (1 row)':>11}")
+    for r in results:
+        print(
+            f"{r['params']['max_depth']:>9} {r['params']['min_samples_split']:>9} "
+            f"{r['accuracy']:>8.2%} ±{r['accuracy_std']:.2%} {r['n_nodes']:>8.0f} "
+            f"{r['predict_us_per_row']:>15.3f} {r['predict_single_us']:>11.1f}"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"target": args.target, "max_bins": args.max_bins, "shared_binning": bool(max_bins),
+                       "folds": args.folds, "rows": len(X), "results": results}, f, indent=2)
+        print(f"\nĐã ghi {len(results)} kết quả vào {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
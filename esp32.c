@@ -4,6 +4,7 @@
 #include <DHT.h>
 #include <WiFiManager.h>
 #include <LiquidCrystal_I2C.h>
+#include "air_quality_model.h"  // Sinh bởi backend/export_model_c.py
 
 // ======================== WIFI & MQTT CONFIG ========================
 #define STUDENT_ID "23127503"
@@ -58,6 +59,9 @@ unsigned long lastLCDSwitch = 0;
 const unsigned long LCD_INTERVAL = 3000; // Đổi trang LCD mỗi 3 giây
 int lcdPage = 0; // Trang hiện tại (0, 1, 2)
 
+// Lớp chất lượng do model trên thiết bị dự đoán (-1 = chưa có)
+int localQuality = -1;
+
 int currentBrightness = 75;      
 String currentColor = "green";   
 
@@ -364,6 +368,33 @@ float readPM25() {
   return dust;
 }
 
+// ======================== LOCAL AI (ON-DEVICE) ========================
+// Phân loại ngay trên ESP32 bằng cây quyết định xuất từ AI service: LED đổi
+// màu không cần chờ MQTT -> Node -> Flask, và vẫn chạy khi mất mạng.
+// Lệnh set_color từ server vẫn ghi đè như cũ.
+void classifyLocally() {
+  double x[CAQM_N_FEATURES] = {(double)co2, co, pm25, temperature, humidity};
+  double confidence;
+  uint8_t problems[CAQM_N_PROBLEMS];
+
+  int quality = caqm_predict_quality(x, &confidence);
+  caqm_predict_problems(x, problems);
+
+  Serial.printf(" Local AI: %s (%.0f%%)", CAQM_QUALITY_LABELS[quality], confidence * 100);
+  for (int i = 0; i < CAQM_N_PROBLEMS; i++) {
+    if (problems[i]) Serial.printf(" [%s]", CAQM_PROBLEM_LABELS[i]);
+  }
+  Serial.println();
+
+  // Chỉ đổi LED khi lớp thay đổi
+  if (quality != localQuality) {
+    localQuality = quality;
+    if (quality == CAQM_CLASS_TOT) setLED("green", currentBrightness);
+    else if (quality == CAQM_CLASS_TRUNG_BINH) setLED("yellow", currentBrightness);
+    else setLED("red", currentBrightness);
+  }
+}
+
 // ======================== PUBLISH SENSOR DATA ========================
 void publishSensorData() {
   StaticJsonDocument<256> doc;
@@ -394,6 +425,7 @@ void loop() {
   if (now - lastPublish >= PUBLISH_INTERVAL) {
     lastPublish = now;
     readSensors();
+    classifyLocally();
     publishSensorData();
   }
 